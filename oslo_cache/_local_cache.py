@@ -0,0 +1,235 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process cache tier kept in front of the cache backend."""
+
+import collections
+import pickle
+import threading
+import time
+
+from dogpile.cache import api
+from dogpile.cache import proxy
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+NO_VALUE = api.NO_VALUE
+
+
+class LocalCache(object):
+    """Bounded LRU cache whose entries expire after a fixed time.
+
+    The values are bytes, so that their size is known exactly and that
+    their readers cannot modify them.
+    """
+
+    def __init__(self, expiration_time, max_entries, max_bytes):
+        """Initialize the cache.
+
+        :param expiration_time: seconds an entry is kept
+        :param max_entries: maximum number of entries, 0 for no limit
+        :param max_bytes: maximum total size of the values, 0 for no limit
+        """
+        self.expiration_time = expiration_time
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (expiration deadline, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._counters = dict.fromkeys(
+            ('hits', 'misses', 'evictions', 'expirations'), 0)
+
+    def _pop(self, key):
+        # NOTE: the caller holds the lock.
+        _deadline, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            try:
+                deadline, value = self._entries[key]
+            except KeyError:
+                self._counters['misses'] += 1
+                return NO_VALUE
+            if deadline <= now:
+                self._pop(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return NO_VALUE
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_bytes and len(value) > self.max_bytes:
+            # NOTE: it would evict everything else and be evicted itself.
+            self.delete(key)
+            return
+        deadline = time.monotonic() + self.expiration_time
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (deadline, value)
+            self._bytes += len(value)
+            while ((self.max_entries and
+                    len(self._entries) > self.max_entries) or
+                   (self.max_bytes and self._bytes > self.max_bytes)):
+                _deadline, evicted = self._entries.popitem(last=False)[1]
+                self._bytes -= len(evicted)
+                self._counters['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        """Return the statistics of the cache as a dict.
+
+        ``hits``, ``misses``, ``evictions`` and ``expirations`` count the
+        events since the cache was created, ``entries`` and ``bytes`` give
+        its current size.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
+
+
+class LocalCacheProxy(proxy.ProxyBackend):
+    """ProxyBackend keeping the values read and written in a local cache.
+
+    The values found in the :class:`LocalCache` are returned without calling
+    the backend. Values which are not serialized by the region are pickled
+    into the local cache, so that every reader gets its own copy, as with a
+    remote backend.
+
+    Values written and deleted by other processes are only seen once the
+    local entry expired, so the local expiration time must be short.
+    """
+
+    def __init__(self, expiration_time, max_entries, max_bytes):
+        super(LocalCacheProxy, self).__init__()
+        self.local_cache = LocalCache(expiration_time, max_entries, max_bytes)
+        self._counters = dict.fromkeys(('hits', 'misses'), 0)
+        self._lock = threading.Lock()
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self._counters['hits'] += hits
+            self._counters['misses'] += misses
+
+    def _store(self, key, value, serialized):
+        if not serialized:
+            try:
+                value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                LOG.debug('Not caching locally an unpicklable value: %s', e)
+                self.local_cache.delete(key)
+                return
+        self.local_cache.set(key, value)
+
+    def _load(self, key, serialized):
+        value = self.local_cache.get(key)
+        if value is NO_VALUE or serialized:
+            return value
+        # NOTE: the value was pickled by this process.
+        return pickle.loads(value)  # nosec
+
+    def _get(self, get, key, serialized):
+        value = self._load(key, serialized)
+        if value is not NO_VALUE:
+            return value
+        value = get(key)
+        if value is NO_VALUE:
+            self._count(0, 1)
+        else:
+            self._count(1, 0)
+            self._store(key, value, serialized)
+        return value
+
+    def _get_multi(self, get_multi, keys, serialized):
+        values = [self._load(key, serialized) for key in keys]
+        missing = [index for index, value in enumerate(values)
+                   if value is NO_VALUE]
+        if not missing:
+            return values
+        remote_values = get_multi([keys[index] for index in missing])
+        found = 0
+        for index, value in zip(missing, remote_values):
+            if value is not NO_VALUE:
+                found += 1
+                values[index] = value
+                self._store(keys[index], value, serialized)
+        self._count(found, len(missing) - found)
+        return values
+
+    def get(self, key):
+        return self._get(self.proxied.get, key, False)
+
+    def get_serialized(self, key):
+        return self._get(self.proxied.get_serialized, key, True)
+
+    def get_multi(self, keys):
+        return self._get_multi(self.proxied.get_multi, list(keys), False)
+
+    def get_serialized_multi(self, keys):
+        return self._get_multi(self.proxied.get_serialized_multi, list(keys),
+                               True)
+
+    def set(self, key, value):
+        self.proxied.set(key, value)
+        self._store(key, value, False)
+
+    def set_serialized(self, key, value):
+        self.proxied.set_serialized(key, value)
+        self._store(key, value, True)
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        for key, value in mapping.items():
+            self._store(key, value, False)
+
+    def set_serialized_multi(self, mapping):
+        self.proxied.set_serialized_multi(mapping)
+        for key, value in mapping.items():
+            self._store(key, value, True)
+
+    def delete(self, key):
+        self.local_cache.delete(key)
+        self.proxied.delete(key)
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self.local_cache.delete(key)
+        self.proxied.delete_multi(keys)
+
+    def get_stats(self):
+        """Return the statistics of both tiers.
+
+        ``local`` are the statistics of the :class:`LocalCache`, ``remote``
+        count the hits and misses of the lookups which missed it.
+        """
+        with self._lock:
+            remote = dict(self._counters)
+        return {'local': self.local_cache.get_stats(), 'remote': remote}
@@ -15,21 +15,30 @@
 
 """Thread-safe connection pool for pymemcache."""
 
+import atexit
 import collections
+from concurrent import futures
 import contextlib
 import itertools
+import os
+import socket
 import threading
 import time
+import weakref
 
 
 from oslo_log import log
+from pymemcache.client import base as pymemcache_base
 from pymemcache.client import hash as pymemcache_hash
+from pymemcache.client import rendezvous
+from pymemcache import exceptions as pymemcache_exceptions
 from pymemcache import serde
 from six.moves import queue
 from six.moves.urllib.parse import urlparse
 from six.moves import zip
 
 from oslo_cache._i18n import _
+from oslo_cache import _stats
 from oslo_cache import exception
 
 
@@ -42,35 +51,8 @@ DEFAULT_SERIALIZER = serde.python_memcache_serializer
 DEFAULT_DESERIALIZER = serde.python_memcache_deserializer
 
 
-class ConnectionPool(queue.Queue):
-    """Base connection pool class
-
-    This class implements the basic connection pool logic as an abstract base
-    class.
-    """
-    def __init__(self, maxsize, unused_timeout, conn_get_timeout=None):
-        """Initialize the connection pool.
-
-        :param maxsize: maximum number of client connections for the pool
-        :type maxsize: int
-        :param unused_timeout: idle time to live for unused clients (in
-                               seconds). If a client connection object has been
-                               in the pool and idle for longer than the
-                               unused_timeout, it will be reaped. This is to
-                               ensure resources are released as utilization
-                               goes down.
-        :type unused_timeout: int
-        :param conn_get_timeout: maximum time in seconds to wait for a
-                                 connection. If set to `None` timeout is
-                                 indefinite.
-        :type conn_get_timeout: int
-        """
-        # super() cannot be used here because Queue in stdlib is an
-        # old-style class
-        queue.Queue.__init__(self, maxsize)
-        self._unused_timeout = unused_timeout
-        self._connection_get_timeout = conn_get_timeout
-        self._acquired = 0
+class _BaseConnectionPool(object):
+    """Helpers shared by all the connection pool implementations."""
 
     def _create_connection(self):
         """Returns a connection instance.
@@ -107,17 +89,303 @@ class ConnectionPool(queue.Queue):
     def _trace_logger(self, msg, *args, **kwargs):
         self._do_log(log.TRACE, msg, *args, **kwargs)
 
+    def _init_stats(self):
+        self._stats_lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('created', 'destroyed', 'reaped', 'queue_empty', 'dead_host'), 0)
+        self._dead_hosts = collections.Counter()
+        self._acquire_wait = _stats.Histogram()
+        self._listeners = ()
+
+    def add_listener(self, listener):
+        """Register a callable notified of the events of the pool.
+
+        ``listener(pool, event, value)`` is called by the thread causing the
+        event, with ``event`` being one of:
+
+        * ``acquire_wait``: ``value`` is the number of seconds spent waiting
+          for a connection in :meth:`acquire`
+        * ``created``, ``destroyed``, ``reaped`` (expired connections, which
+          are also counted as destroyed) and ``queue_empty`` (timeouts of
+          :meth:`acquire`): ``value`` is ``1``
+        * ``dead_host``: ``value`` is the host which was marked dead
+
+        It is meant to push the events to a collector such as statsd, so it
+        must be fast. Its errors are logged and ignored.
+        """
+        self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        """Unregister a callable registered with :meth:`add_listener`."""
+        self._listeners = tuple(registered for registered in self._listeners
+                                if registered is not listener)
+
+    def _notify(self, event, value):
+        for listener in self._listeners:
+            try:
+                listener(self, event, value)
+            except Exception:
+                LOG.exception('Memcache pool listener %r failed', listener)
+
+    def _count(self, event):
+        with self._stats_lock:
+            self._counters[event] += 1
+        self._notify(event, 1)
+
+    def _record_acquire_wait(self, seconds):
+        self._acquire_wait.observe(seconds)
+        self._notify('acquire_wait', seconds)
+
+    def _record_dead_host(self, host):
+        with self._stats_lock:
+            self._counters['dead_host'] += 1
+            self._dead_hosts[host] += 1
+        self._notify('dead_host', host)
+
+    def get_stats(self):
+        """Return the statistics of the pool as a dict.
+
+        * ``maxsize``: maximum number of connections
+        * ``acquired``: number of connections currently in use
+        * ``idle``: number of connections waiting in the pool
+        * ``created``, ``destroyed``, ``reaped``, ``queue_empty`` and
+          ``dead_host``: number of events since the pool was created, see
+          :meth:`add_listener`
+        * ``dead_hosts``: number of times every host was marked dead
+        * ``acquire_wait``: histogram of the time spent in :meth:`acquire`
+          waiting for a connection, see
+          :meth:`oslo_cache._stats.Histogram.snapshot`
+        """
+        with self._stats_lock:
+            stats = dict(self._counters)
+            stats['dead_hosts'] = dict(self._dead_hosts)
+        stats['maxsize'] = self.maxsize
+        stats['acquired'] = self._acquired
+        stats['idle'] = len(self.queue)
+        stats['acquire_wait'] = self._acquire_wait.snapshot()
+        return stats
+
+    def _new_connection(self):
+        conn = self._create_connection()
+        self._count('created')
+        return conn
+
+    def _discard_connection(self, conn, event=None):
+        try:
+            self._destroy_connection(conn)
+        finally:
+            self._count('destroyed')
+            if event is not None:
+                self._count(event)
+
+    def _init_housekeeping(self, min_size, reap_interval):
+        self._min_size = min_size or 0
+        if self.maxsize:
+            self._min_size = min(self._min_size, self.maxsize)
+        self._reap_interval = reap_interval
+        self._reaper = None
+        self._reaper_stopped = None
+        self._housekeeping_lock = threading.Lock()
+        self._pid = os.getpid()
+        if reap_interval:
+            pool_ref = weakref.ref(self)
+
+            def _shutdown():
+                pool = pool_ref()
+                if pool is not None:
+                    pool.shutdown()
+            atexit.register(_shutdown)
+
+    def _expire_connections(self):
+        """Drop expired connections, inline or with the reaper thread.
+
+        This is also where a pool used in a forked child notices it: the
+        connections inherited from the parent share their sockets with it,
+        so they are dropped, and the reaper thread of the parent does not
+        exist in the child, so it is started again.
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        if not self._reap_interval:
+            self._drop_expired_connections()
+        elif self._reaper is None:
+            self._start_reaper()
+
+    def _reset_after_fork(self):
+        with self._housekeeping_lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._reaper = self._reaper_stopped = None
+            inherited = self._pop_idle_connections()
+        self._debug_logger('Dropping %d connections inherited from parent '
+                           'process', len(inherited))
+        for conn in inherited:
+            self._discard_connection(conn)
+        if self._min_size:
+            self.prewarm()
+
+    def _start_reaper(self):
+        with self._housekeeping_lock:
+            if not self._reap_interval or self._reaper is not None:
+                return
+            stopped = threading.Event()
+            reaper = threading.Thread(
+                target=_reap_connections,
+                args=(weakref.ref(self), stopped, self._reap_interval),
+                name='memcache-pool-reaper-%s' % id(self))
+            reaper.daemon = True
+            reaper.start()
+            self._reaper = reaper
+            self._reaper_stopped = stopped
+            self._debug_logger('Started connection reaper')
+
+    def _drop_expired_connections(self):
+        """Destroy the connections which have been unused for too long.
+
+        The ``min_size`` most recently used idle connections are kept.
+        """
+        for conn in self._pop_expired_connections():
+            self._trace_logger('Reaping connection %s', id(conn))
+            self._discard_connection(conn, 'reaped')
+
+    def _pop_expired_connections(self):
+        """Remove the expired connections from the pool and return them."""
+        raise NotImplementedError
+
+    def _pop_idle_connections(self):
+        """Remove all the idle connections from the pool and return them."""
+        raise NotImplementedError
+
+    def _add_idle_connection(self, conn):
+        """Add a new connection to the pool without acquiring it."""
+        raise NotImplementedError
+
+    def _connect(self, conn):
+        """Open the connection of a new connection instance.
+
+        This is called when the pool is warmed up, connections created
+        when a request needs one connect lazily.
+
+        :param conn: the connection object to connect
+
+        """
+
+    def _create_connected(self):
+        conn = self._new_connection()
+        try:
+            self._connect(conn)
+        except Exception as e:
+            # NOTE: an unreachable server must not prevent the service
+            # from starting, the connection is retried when it is used.
+            self._debug_logger('Unable to connect connection %s: %s',
+                               id(conn), e)
+        return conn
+
+    def prewarm(self):
+        """Create and connect connections until ``min_size`` are idle.
+
+        The connections are created in parallel, so warming the pool up
+        costs about one connection setup, not ``min_size`` of them.
+        """
+        missing = self._min_size - len(self.queue)
+        if missing <= 0:
+            return
+        self._debug_logger('Warming up %d connections', missing)
+        with futures.ThreadPoolExecutor(max_workers=missing) as executor:
+            creating = [executor.submit(self._create_connected)
+                        for _ in range(missing)]
+        for future in creating:
+            try:
+                conn = future.result()
+            except Exception:
+                LOG.exception('Unable to warm up memcache pool %s', id(self))
+                continue
+            self._add_idle_connection(conn)
+
+    def shutdown(self):
+        """Stop the reaper thread and close the idle connections.
+
+        This is meant to be called at process exit, which is done
+        automatically when a reaper is used, or by a forking server before
+        it forks its workers. Connections still in use are released to the
+        pool as usual and expire inline from then on.
+        """
+        with self._housekeeping_lock:
+            if self._reaper_stopped is not None:
+                self._reaper_stopped.set()
+            reaper = self._reaper
+            self._reap_interval = None
+            self._reaper = self._reaper_stopped = None
+        if (reaper is not None and reaper.is_alive() and
+                reaper is not threading.current_thread()):
+            reaper.join(1)
+        for conn in self._pop_idle_connections():
+            self._trace_logger('Closing connection %s', id(conn))
+            self._discard_connection(conn)
+
+    def _queue_empty(self):
+        return exception.QueueEmpty(
+            _('Unable to get a connection from pool id %(id)s after '
+              '%(seconds)s seconds.') %
+            {'id': id(self), 'seconds': self._connection_get_timeout})
+
+
+class ConnectionPool(_BaseConnectionPool, queue.Queue):
+    """Base connection pool class
+
+    This class implements the basic connection pool logic as an abstract base
+    class.
+    """
+    def __init__(self, maxsize, unused_timeout, conn_get_timeout=None,
+                 reap_interval=None, min_size=0):
+        """Initialize the connection pool.
+
+        :param maxsize: maximum number of client connections for the pool
+        :type maxsize: int
+        :param unused_timeout: idle time to live for unused clients (in
+                               seconds). If a client connection object has been
+                               in the pool and idle for longer than the
+                               unused_timeout, it will be reaped. This is to
+                               ensure resources are released as utilization
+                               goes down.
+        :type unused_timeout: int
+        :param conn_get_timeout: maximum time in seconds to wait for a
+                                 connection. If set to `None` timeout is
+                                 indefinite.
+        :type conn_get_timeout: int
+        :param reap_interval: interval in seconds between two runs of a
+                              background thread reaping the expired
+                              connections. If not set, expired connections
+                              are reaped inline when a connection is
+                              acquired.
+        :type reap_interval: int
+        :param min_size: number of idle connections which are kept even if
+                         unused for longer than unused_timeout, and which
+                         :meth:`prewarm` creates in advance.
+        :type min_size: int
+        """
+        # super() cannot be used here because Queue in stdlib is an
+        # old-style class
+        queue.Queue.__init__(self, maxsize)
+        self._unused_timeout = unused_timeout
+        self._connection_get_timeout = conn_get_timeout
+        self._acquired = 0
+        self._init_stats()
+        self._init_housekeeping(min_size, reap_interval)
+
     @contextlib.contextmanager
     def acquire(self):
         self._trace_logger('Acquiring connection')
-        self._drop_expired_connections()
+        self._expire_connections()
+        start = time.monotonic()
         try:
             conn = self.get(timeout=self._connection_get_timeout)
         except queue.Empty:
-            raise exception.QueueEmpty(
-                _('Unable to get a connection from pool id %(id)s after '
-                  '%(seconds)s seconds.') %
-                {'id': id(self), 'seconds': self._connection_get_timeout})
+            self._count('queue_empty')
+            raise self._queue_empty()
+        self._record_acquire_wait(time.monotonic() - start)
         self._trace_logger('Acquired connection %s', id(conn))
         try:
             yield conn
@@ -129,7 +397,7 @@ class ConnectionPool(queue.Queue):
                 queue.Queue.put(self, conn, block=False)
             except queue.Full:
                 self._trace_logger('Reaping exceeding connection %s', id(conn))
-                self._destroy_connection(conn)
+                self._discard_connection(conn)
 
     def _qsize(self):
         if self.maxsize:
@@ -149,39 +417,271 @@ class ConnectionPool(queue.Queue):
         try:
             conn = self.queue.pop().connection
         except IndexError:
-            conn = self._create_connection()
+            conn = self._new_connection()
         self._acquired += 1
         return conn
 
-    def _drop_expired_connections(self):
-        """Drop all expired connections from the left end of the queue."""
+    def _pop_expired_connections(self):
+        """Pop all expired connections from the left end of the queue."""
         now = time.time()
+        expired = []
+        with self.mutex:
+            try:
+                while (len(self.queue) > self._min_size and
+                       self.queue[0].ttl < now):
+                    expired.append(self.queue.popleft().connection)
+            except IndexError:
+                # NOTE(amakarov): This is an expected excepton. so there's no
+                # need to react. We have to handle exceptions instead of
+                # checking queue length as IndexError is a result of race
+                # condition too as well as of mere queue depletio of mere
+                # queue depletionn.
+                pass
+        return expired
+
+    def _pop_idle_connections(self):
+        with self.mutex:
+            idle = [item.connection for item in self.queue]
+            self.queue.clear()
+        return idle
+
+    def _add_idle_connection(self, conn):
+        with self.mutex:
+            if not self.maxsize or len(self.queue) < self.maxsize:
+                self.queue.append(_PoolItem(
+                    ttl=time.time() + self._unused_timeout,
+                    connection=conn,
+                ))
+                return
+        self._discard_connection(conn)
+
+    def _put(self, conn):
+        self.queue.append(_PoolItem(
+            ttl=time.time() + self._unused_timeout,
+            connection=conn,
+        ))
+        self._acquired -= 1
+
+
+class LifoConnectionPool(_BaseConnectionPool):
+    """Low contention connection pool.
+
+    Unlike :class:`ConnectionPool`, acquiring and releasing a connection does
+    not take any lock as long as the pool is not exhausted. Idle connections
+    are kept on a LIFO stack, so the most recently used (and most likely
+    still connected) one is handed out first while the oldest ones sink to
+    the bottom where they expire. The number of connections is bounded by a
+    stack of permits; a lock and a condition are only used by the threads
+    which have to wait for a permit to be given back.
+
+    Both stacks are :class:`collections.deque` objects whose ``append`` and
+    ``pop`` methods are atomic.
+    """
+    def __init__(self, maxsize, unused_timeout, conn_get_timeout=None,
+                 reap_interval=None, min_size=0):
+        """Initialize the connection pool.
+
+        See :class:`ConnectionPool` for the description of the arguments.
+        """
+        self.maxsize = maxsize
+        self._unused_timeout = unused_timeout
+        self._connection_get_timeout = conn_get_timeout
+        self.queue = collections.deque()
+        self._permits = collections.deque([None] * (maxsize or 0))
+        self._waiters = 0
+        self._permit_released = threading.Condition(threading.Lock())
+        self._init_stats()
+        self._init_housekeeping(min_size, reap_interval)
+
+    @property
+    def _acquired(self):
+        if self.maxsize:
+            return self.maxsize - len(self._permits)
+        return 0
+
+    def _take_permit(self):
+        if not self.maxsize:
+            return
         try:
-            while self.queue[0].ttl < now:
-                conn = self.queue.popleft().connection
-                self._trace_logger('Reaping connection %s', id(conn))
-                self._destroy_connection(conn)
+            self._permits.pop()
+            return
         except IndexError:
-            # NOTE(amakarov): This is an expected excepton. so there's no
-            # need to react. We have to handle exceptions instead of
-            # checking queue length as IndexError is a result of race
-            # condition too as well as of mere queue depletio of mere queue
-            # depletionn.
             pass
+        timeout = self._connection_get_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self._permit_released:
+            self._waiters += 1
+            try:
+                while True:
+                    try:
+                        self._permits.pop()
+                        return
+                    except IndexError:
+                        pass
+                    if deadline is None:
+                        self._permit_released.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._count('queue_empty')
+                        raise self._queue_empty()
+                    self._permit_released.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+    def _give_permit(self):
+        if not self.maxsize:
+            return
+        self._permits.append(None)
+        # NOTE: a waiter registers itself before checking for a permit, so
+        # reading the counter without the lock cannot miss a wake up.
+        if self._waiters:
+            with self._permit_released:
+                self._permit_released.notify()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        self._trace_logger('Acquiring connection')
+        self._expire_connections()
+        start = time.monotonic()
+        self._take_permit()
+        try:
+            conn = self._get()
+        except Exception:
+            self._give_permit()
+            raise
+        self._record_acquire_wait(time.monotonic() - start)
+        self._trace_logger('Acquired connection %s', id(conn))
+        try:
+            yield conn
+        finally:
+            self._trace_logger('Releasing connection %s', id(conn))
+            try:
+                self._put(conn)
+            finally:
+                self._give_permit()
+
+    def _get(self):
+        try:
+            return self.queue.pop().connection
+        except IndexError:
+            return self._new_connection()
 
     def _put(self, conn):
         self.queue.append(_PoolItem(
             ttl=time.time() + self._unused_timeout,
             connection=conn,
         ))
-        self._acquired -= 1
+
+    def _pop_expired_connections(self):
+        """Pop all expired connections from the bottom of the stack."""
+        now = time.time()
+        expired = []
+        while len(self.queue) > self._min_size:
+            try:
+                if self.queue[0].ttl >= now:
+                    break
+                item = self.queue.popleft()
+            except IndexError:
+                break
+            if item.ttl >= now:
+                # NOTE: another thread took the expired connection first,
+                # this one is still fresh so give it back.
+                self.queue.appendleft(item)
+                break
+            expired.append(item.connection)
+        return expired
+
+    def _pop_idle_connections(self):
+        idle = []
+        while True:
+            try:
+                idle.append(self.queue.pop().connection)
+            except IndexError:
+                return idle
+
+    def _add_idle_connection(self, conn):
+        # NOTE: idle connections never outnumber the permits, so the pool
+        # stays bounded by maxsize.
+        if self.maxsize and len(self.queue) >= self.maxsize:
+            self._discard_connection(conn)
+            return
+        self.queue.append(_PoolItem(
+            ttl=time.time() + self._unused_timeout,
+            connection=conn,
+        ))
 
 
-class MemcacheClientPool(ConnectionPool):
+def _format_urls(urls):
+    """Return the (host, port) tuples of a list of memcached urls."""
+    servers = []
+    for url in urls:
+        parsed = urlparse(url)
+        if not parsed.port:
+            port = DEFAULT_MEMCACHEPORT
+            LOG.trace("Using port ({port}) with {url}".format(url=url,
+                                                              port=port))
+        else:
+            # NOTE(hberaud) removing port information from url to avoid
+            # pymemcache to concat twice. Don't use string replace to avoid
+            # ipv6 format override. Some port values can already be used
+            # inside the ipv6 format and we don't want to replace them.
+            # (example: https://[2620:52:0:13b8:8080:ff:fe3e:1]:8080)
+            port_info = len(str(parsed.port)) + 1
+            url = url[:-port_info]
+            port = parsed.port
+        servers.append((url, int(port)))
+    return servers
+
+
+def run_concurrently(executor, batches, func):
+    """Run ``func(server, batch)`` for every server batch concurrently.
+
+    The first batch is run in the calling thread, the remaining ones are
+    handed to the executor. All of them are waited for before returning, so
+    that the connections they use are never released while still in use.
+
+    :param executor: a :class:`concurrent.futures.Executor`
+    :param batches: dict of batches of keys per server
+    :param func: callable run for every server and its batch
+    :returns: list of the results of every call
+    """
+    batches = list(batches.items())
+    pending = [executor.submit(func, server, batch)
+               for server, batch in batches[1:]]
+    try:
+        results = [func(*batches[0])]
+    finally:
+        futures.wait(pending)
+    results.extend(future.result() for future in pending)
+    return results
+
+
+def _reap_connections(pool_ref, stopped, interval):
+    """Body of the reaper thread of a connection pool.
+
+    Only a weak reference to the pool is kept so that the thread does not
+    keep an unused pool alive.
+    """
+    while not stopped.wait(interval):
+        pool = pool_ref()
+        if pool is None:
+            return
+        try:
+            pool._drop_expired_connections()
+        except Exception:
+            LOG.exception('Unable to reap memcache connections of pool %s',
+                          id(pool))
+        del pool
+
+
+class _MemcacheClientPoolMixin(object):
+    """Creates pymemcache clients and shares the host states between them.
+
+    It is mixed with one of the connection pool implementations.
+    """
     def __init__(self, urls, arguments, **kwargs):
-        # super() cannot be used here because Queue in stdlib is an
-        # old-style class
-        ConnectionPool.__init__(self, **kwargs)
+        super(_MemcacheClientPoolMixin, self).__init__(**kwargs)
         self._format_urls(urls)
         self._arguments = arguments
         self._init_arguments()
@@ -201,24 +701,7 @@ class MemcacheClientPool(ConnectionPool):
             del self._arguments['socket_timeout']
 
     def _format_urls(self, urls):
-        self.urls = []
-        for url in urls:
-            parsed = urlparse(url)
-            if not parsed.port:
-                port = DEFAULT_MEMCACHEPORT
-                self._trace_logger(
-                    "Using port ({port}) with {url}".format(url=url, port=port)
-                )
-            else:
-                # NOTE(hberaud) removing port information from url to avoid
-                # pymemcache to concat twice. Don't use string replace to avoid
-                # ipv6 format override. Some port values can already be used
-                # inside the ipv6 format and we don't want to replace them.
-                # (example: https://[2620:52:0:13b8:8080:ff:fe3e:1]:8080)
-                port_info = len(str(parsed.port)) + 1
-                url = url[:-port_info]
-                port = parsed.port
-            self.urls.append((url, int(port)))
+        self.urls = _format_urls(urls)
 
     def _create_connection(self):
         return pymemcache_hash.HashClient(self.urls, **self._arguments)
@@ -226,10 +709,15 @@ class MemcacheClientPool(ConnectionPool):
     def _destroy_connection(self, conn):
         conn.disconnect_all()
 
+    def _connect(self, conn):
+        for server, client in conn.clients.items():
+            try:
+                client._connect()
+            except Exception as e:
+                self._debug_logger('Unable to connect to %s: %s', server, e)
+
     def _get(self):
-        # super() cannot be used here because Queue in stdlib is an
-        # old-style class
-        conn = ConnectionPool._get(self)
+        conn = super(_MemcacheClientPoolMixin, self)._get()
         try:
             # Propagate host state known to us to this client's list
             now = time.time()
@@ -241,9 +729,7 @@ class MemcacheClientPool(ConnectionPool):
             # We need to be sure that connection doesn't leak from the pool.
             # This code runs before we enter context manager's try-finally
             # block, so we need to explicitly release it here.
-            # super() cannot be used here because Queue in stdlib is an
-            # old-style class
-            ConnectionPool._put(self, conn)
+            super(_MemcacheClientPoolMixin, self)._put(conn)
             raise
         return conn
 
@@ -261,6 +747,7 @@ class MemcacheClientPool(ConnectionPool):
                         self._debug_logger(
                             'Marked host %s dead until %s',
                             self.urls[i], host.deaduntil)
+                        self._record_dead_host('%s:%s' % self.urls[i])
                     else:
                         self._hosts_deaduntil[i] = 0
             # If all hosts are dead we should forget that they're dead. This
@@ -271,6 +758,218 @@ class MemcacheClientPool(ConnectionPool):
                 self._debug_logger('All hosts are dead. Marking them as live.')
                 self._hosts_deaduntil[:] = [0] * len(self._hosts_deaduntil)
         finally:
-            # super() cannot be used here because Queue in stdlib is an
-            # old-style class
-            ConnectionPool._put(self, conn)
+            super(_MemcacheClientPoolMixin, self)._put(conn)
+
+
+class MemcacheClientPool(_MemcacheClientPoolMixin, ConnectionPool):
+    """Pool of pymemcache clients built on :class:`ConnectionPool`."""
+
+
+class LifoMemcacheClientPool(_MemcacheClientPoolMixin, LifoConnectionPool):
+    """Pool of pymemcache clients built on :class:`LifoConnectionPool`."""
+
+
+class _MemcacheServerPoolMixin(object):
+    """Creates pymemcache clients connected to a single server.
+
+    It is mixed with one of the connection pool implementations.
+    """
+    def __init__(self, server, arguments, **kwargs):
+        super(_MemcacheServerPoolMixin, self).__init__(**kwargs)
+        self.server = server
+        self._arguments = arguments
+
+    def _create_connection(self):
+        return pymemcache_base.Client(self.server, **self._arguments)
+
+    def _destroy_connection(self, conn):
+        conn.close()
+
+    def _connect(self, conn):
+        conn._connect()
+
+
+class MemcacheServerPool(_MemcacheServerPoolMixin, ConnectionPool):
+    """Pool of single server clients built on :class:`ConnectionPool`."""
+
+
+class LifoMemcacheServerPool(_MemcacheServerPoolMixin, LifoConnectionPool):
+    """Pool of single server clients built on :class:`LifoConnectionPool`."""
+
+
+class MemcacheServerPools(object):
+    """Independent connection pools to every memcached server.
+
+    Pooling :class:`pymemcache.client.hash.HashClient` objects means that
+    every pooled client holds a socket to every server, even when a request
+    only talks to one of them. Here each server has its own pool of single
+    server clients, so the number of sockets to a server follows the
+    concurrency of the requests really sent to it.
+
+    Keys are routed with the same rendezvous hash as ``HashClient``, so both
+    pooling modes store a key on the same server. A server failing with a
+    socket error is left out of the hash for ``dead_retry`` seconds, unless
+    all of them are, in which case they are all tried again.
+
+    This object has the client methods used by the memcached backends of
+    dogpile.cache and can be used as their client.
+    """
+
+    _SERVER_ERRORS = (socket.error,
+                      pymemcache_exceptions.MemcacheUnexpectedCloseError)
+
+    def __init__(self, urls, arguments, pool_class=MemcacheServerPool,
+                 dead_retry=5 * 60, executor=None, **kwargs):
+        """Initialize the pools.
+
+        :param urls: memcached server urls
+        :param arguments: arguments of the backend, ``serializer``,
+                          ``deserializer`` and ``socket_timeout`` are used
+        :param pool_class: connection pool class used for every server
+        :param dead_retry: number of seconds a failed server is left out
+        :param executor: optional executor sending the batches of the multi
+                         key operations to the servers concurrently
+        :param kwargs: arguments of the connection pool of every server
+        """
+        client_arguments = {
+            'serializer': arguments.get('serializer', DEFAULT_SERIALIZER),
+            'deserializer': arguments.get('deserializer',
+                                          DEFAULT_DESERIALIZER),
+        }
+        if arguments.get('socket_timeout') is not None:
+            client_arguments['connect_timeout'] = arguments['socket_timeout']
+            client_arguments['timeout'] = arguments['socket_timeout']
+        self.urls = _format_urls(urls)
+        self.pools = collections.OrderedDict(
+            ('%s:%s' % server, pool_class(server, client_arguments, **kwargs))
+            for server in self.urls)
+        self.executor = executor
+        self._dead_retry = dead_retry
+        self._dead_until = {}
+        self._dead_lock = threading.Lock()
+        self._hasher = rendezvous.RendezvousHash(list(self.pools))
+
+    def _rehash(self):
+        # NOTE: the hash is replaced, not updated, so that readers never see
+        # it half changed.
+        self._hasher = rendezvous.RendezvousHash(
+            [name for name in self.pools if name not in self._dead_until])
+
+    def _mark_dead(self, name):
+        self.pools[name]._record_dead_host(name)
+        with self._dead_lock:
+            self._dead_until[name] = time.time() + self._dead_retry
+            LOG.debug('Marked memcached server %s dead for %s seconds',
+                      name, self._dead_retry)
+            if len(self._dead_until) == len(self.pools):
+                LOG.debug('All hosts are dead. Marking them as live.')
+                self._dead_until.clear()
+            self._rehash()
+
+    def _revive_servers(self):
+        now = time.time()
+        with self._dead_lock:
+            revived = [name for name, dead_until in self._dead_until.items()
+                       if dead_until <= now]
+            if revived:
+                for name in revived:
+                    del self._dead_until[name]
+                self._rehash()
+
+    def _server(self, key):
+        if self._dead_until:
+            self._revive_servers()
+        return self._hasher.get_node(key)
+
+    def _run(self, name, method, *args, **kwargs):
+        with self.pools[name].acquire() as client:
+            try:
+                return getattr(client, method)(*args, **kwargs)
+            except self._SERVER_ERRORS:
+                client.close()
+                self._mark_dead(name)
+                raise
+
+    def _batches(self, keys):
+        batches = collections.defaultdict(list)
+        for key in keys:
+            batches[self._server(key)].append(key)
+        return batches
+
+    def _run_batches(self, batches, func):
+        if self.executor is not None and len(batches) > 1:
+            return run_concurrently(self.executor, batches, func)
+        return [func(name, batch) for name, batch in batches.items()]
+
+    def get(self, key, *args, **kwargs):
+        return self._run(self._server(key), 'get', key, *args, **kwargs)
+
+    def set(self, key, *args, **kwargs):
+        return self._run(self._server(key), 'set', key, *args, **kwargs)
+
+    def add(self, key, *args, **kwargs):
+        return self._run(self._server(key), 'add', key, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        return self._run(self._server(key), 'delete', key, *args, **kwargs)
+
+    def get_multi(self, keys, *args, **kwargs):
+        def get_batch(name, batch):
+            return self._run(name, 'get_many', batch, *args, **kwargs)
+
+        values = {}
+        for result in self._run_batches(self._batches(keys), get_batch):
+            values.update(result)
+        return values
+
+    def set_multi(self, mapping, *args, **kwargs):
+        batches = collections.defaultdict(dict)
+        for key, value in mapping.items():
+            batches[self._server(key)][key] = value
+
+        def set_batch(name, batch):
+            return self._run(name, 'set_many', batch, *args, **kwargs)
+
+        failed = []
+        for result in self._run_batches(batches, set_batch):
+            failed.extend(result)
+        return failed
+
+    def delete_multi(self, keys, *args, **kwargs):
+        def delete_batch(name, batch):
+            return self._run(name, 'delete_many', batch, *args, **kwargs)
+
+        self._run_batches(self._batches(keys), delete_batch)
+        return True
+
+    def prewarm(self):
+        """Warm the pool of every server up, all at once."""
+        with futures.ThreadPoolExecutor(
+                max_workers=len(self.pools) or 1) as executor:
+            list(executor.map(lambda pool: pool.prewarm(),
+                              self.pools.values()))
+
+    def add_listener(self, listener):
+        """Register a listener on the pool of every server.
+
+        See :meth:`ConnectionPool.add_listener`.
+        """
+        for pool in self.pools.values():
+            pool.add_listener(listener)
+
+    def remove_listener(self, listener):
+        """Unregister a listener from the pool of every server."""
+        for pool in self.pools.values():
+            pool.remove_listener(listener)
+
+    def get_stats(self):
+        """Return the statistics of the pool of every server by server.
+
+        See :meth:`ConnectionPool.get_stats`.
+        """
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
+    def shutdown(self):
+        """Shut the pool of every server down."""
+        for pool in self.pools.values():
+            pool.shutdown()
@@ -36,6 +36,8 @@ FILE_OPTIONS = {
         cfg.StrOpt('backend', default=_DEFAULT_BACKEND,
                    choices=['oslo_cache.memcache_pool',
                             'oslo_cache.dict',
+                            'oslo_cache.sharded_dict',
+                            'oslo_cache.shm',
                             'oslo_cache.mongo',
                             'oslo_cache.etcd3gw',
                             'dogpile.cache.memcached',
@@ -73,6 +75,73 @@ FILE_OPTIONS = {
                          'cache-backend get/set/delete calls with the '
                          'keys/values.  Typically this should be left set '
                          'to false.'),
+        cfg.BoolOpt('local_cache_enabled', default=False,
+                    help='Keep the values read from and written to the '
+                         'cache backend in a bounded in-process cache as '
+                         'well, so that reading a hot key again does not '
+                         'call the backend. Values changed by other '
+                         'processes are only seen once the local copy '
+                         'expired, after local_cache_expiration_time.'),
+        cfg.IntOpt('local_cache_expiration_time', default=5, min=1,
+                   help='TTL, in seconds, of the values kept in the '
+                        'in-process cache. It should be short since it '
+                        'bounds how long stale values can be read.'),
+        cfg.IntOpt('local_cache_max_entries', default=1000, min=0,
+                   help='Maximum number of values kept in the in-process '
+                        'cache, the least recently used ones are evicted '
+                        'first. 0 means no limit.'),
+        cfg.IntOpt('local_cache_max_bytes', default=16 * 1024 * 1024, min=0,
+                   help='Maximum total size, in bytes, of the values kept in '
+                        'the in-process cache. 0 means no limit.'),
+        cfg.BoolOpt('single_flight_enabled', default=False,
+                    help='Coalesce the concurrent reads of a key by the '
+                         'threads of a process into a single backend read, '
+                         'and share the locks serializing the regeneration '
+                         'of a memoized value between the regions of the '
+                         'process, so that an expired hot key is read and '
+                         'regenerated once.'),
+        cfg.IntOpt('refresh_pool_size', default=2, min=1,
+                   help='Number of threads regenerating in the background '
+                        'the expired values returned by the memoized '
+                        'functions with stale-while-revalidate. When they '
+                        'are all busy, expired values are returned without '
+                        'being regenerated. The cache_refresh_pool_size '
+                        'option of the configuration group of the functions '
+                        'overrides it.'),
+        cfg.IntOpt('max_staleness', default=0, min=0,
+                   help='Number of seconds after their expiration during '
+                        'which the memoized functions with '
+                        'stale-while-revalidate return expired values, the '
+                        'older ones being regenerated before returning. 0 '
+                        'means no limit. The cache_max_staleness option of '
+                        'the configuration group of the functions overrides '
+                        'it.'),
+        cfg.StrOpt('key_mangler', default='sha1',
+                   choices=['sha1', 'blake2b'],
+                   help='Hash function the cache keys are mangled with, '
+                        'unless the backend has its own key mangler. blake2b '
+                        'is cheaper to compute and gives shorter keys than '
+                        'sha1. Changing it invalidates the whole cache, '
+                        'unless key_mangler_fallback is set to the previous '
+                        'value during the rollout.'),
+        cfg.StrOpt('key_mangler_fallback',
+                   choices=['sha1', 'blake2b'],
+                   help='Previous key_mangler, to change it without flushing '
+                        'the cache: a key missing from the cache is read '
+                        'again as mangled by this function and the value '
+                        'found is copied to the new key. Unset it once the '
+                        'values cached with the previous key mangler have '
+                        'expired.'),
+        cfg.BoolOpt('stats_enabled', default=False,
+                    help='Collect statistics of the cache operations: hits, '
+                         'misses, sets and deletes by region and memoized '
+                         'function, backend latency and approximate value '
+                         'size histograms. They are cheap enough to be left '
+                         'enabled in production.'),
+        cfg.IntOpt('stats_emit_interval', default=0, min=0,
+                   help='Interval, in seconds, between two logs of the cache '
+                        'statistics collected when stats_enabled is set. 0 '
+                        'disables logging them.'),
         cfg.ListOpt('memcache_servers', default=['localhost:11211'],
                     help='Memcache servers in the format of "host:port".'
                     ' (dogpile.cache.memcached and oslo_cache.memcache_pool'
@@ -101,6 +170,65 @@ FILE_OPTIONS = {
                    default=10,
                    help='Number of seconds that an operation will wait to get '
                         'a memcache client connection.'),
+        cfg.IntOpt('memcache_pool_min_size',
+                   default=0,
+                   min=0,
+                   help='Number of memcache client connections created and '
+                   'connected when the cache region is configured, and '
+                   'kept open even when unused, so that the first requests '
+                   'of a worker do not pay for connecting to memcached. '
+                   'Capped by memcache_pool_maxsize. '
+                   '(oslo_cache.memcache_pool backend only).'),
+        cfg.IntOpt('memcache_pool_reap_interval',
+                   default=0,
+                   min=0,
+                   help='Number of seconds between two runs of a background '
+                   'thread closing the connections held unused for more '
+                   'than memcache_pool_unused_timeout. The default, 0, '
+                   'closes them inline when a connection is acquired. '
+                   '(oslo_cache.memcache_pool backend only).'),
+        cfg.StrOpt('memcache_pool_implementation',
+                   default='queue',
+                   choices=['queue', 'lifo'],
+                   help='Connection pool implementation. "queue" is the '
+                   'historical pool built on a locked queue. "lifo" keeps '
+                   'idle connections on a lock-free stack and only locks '
+                   'when the pool is exhausted, which lowers contention '
+                   'with many worker threads. (oslo_cache.memcache_pool '
+                   'backend only).'),
+        cfg.BoolOpt('memcache_pool_fanout',
+                    default=False,
+                    help='Send the per-server batches of multi-key get, set '
+                    'and delete operations to every memcached server '
+                    'concurrently instead of one server after another. '
+                    '(oslo_cache.memcache_pool backend only).'),
+        cfg.BoolOpt('memcache_pool_per_server',
+                    default=False,
+                    help='Give every memcached server its own pool of '
+                    'connections instead of pooling clients connected to all '
+                    'the servers. memcache_pool_maxsize and '
+                    'memcache_pool_min_size then apply to every server. '
+                    '(oslo_cache.memcache_pool backend only).'),
+        cfg.BoolOpt('memcache_distributed_lock',
+                    default=False,
+                    help='Lock the regeneration of a memoized value with a '
+                    'key added to memcached instead of a lock of the '
+                    'process, so that a single process of all the ones '
+                    'using the memcached servers regenerates a missing '
+                    'value while the others wait for it. (dogpile.cache '
+                    'memcached backends and oslo_cache.memcache_pool '
+                    'backend only).'),
+        cfg.IntOpt('memcache_lock_timeout',
+                   default=30,
+                   min=1,
+                   help='Number of seconds after which the lock key added '
+                   'when memcache_distributed_lock is set expires, so that '
+                   'a process dying while regenerating a value does not '
+                   'keep the lock. It should be longer than the '
+                   'regeneration of the values, waiting for the lock giving '
+                   'up after as long. '
+                   '(dogpile.cache memcached backends and '
+                   'oslo_cache.memcache_pool backend only).'),
     ],
 }
 
@@ -0,0 +1,314 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Policies refreshing the values of memoized functions.
+
+* Early refresh regenerates a value before it expires with a probability
+  growing as its expiration approaches and with the time its regeneration
+  took, following the XFetch algorithm of "Optimal Probabilistic Cache
+  Stampede Prevention" (Vattani, Chierichetti and Lowenstein, VLDB 2015),
+  so that the regenerations of hot values are spread over time instead of
+  all happening when they expire.
+* Stale-while-revalidate returns an expired value at once and regenerates
+  it in the background.
+"""
+
+from concurrent import futures
+import functools
+import math
+import os
+import random
+import threading
+import time
+import weakref
+
+from dogpile.cache import api
+from dogpile.cache import proxy
+from oslo_log import log
+
+from oslo_cache import _stats
+
+
+LOG = log.getLogger(__name__)
+
+NO_VALUE = api.NO_VALUE
+
+# Metadata of the cached values holding the seconds their regeneration
+# took.
+REGENERATION_TIME = 'd'
+
+_wrap_lock = threading.Lock()
+
+_FIELDS = ('beta', 'reads', 'refresher', 'max_age')
+
+
+class _Context(threading.local):
+    # NOTE: set while a memoized function refreshing its values is called.
+    # Factor of the early expiration and times at which the keys were read.
+    beta = None
+    reads = None
+    # Refresher regenerating the expired values and maximum age of the
+    # values returned, in seconds.
+    refresher = None
+    max_age = None
+
+
+_context = _Context()
+
+
+class RefreshProxy(proxy.ProxyBackend):
+    """ProxyBackend applying the refresh policies of memoized functions.
+
+    The values written by the functions refreshing their values early are
+    stored with the time elapsed since their key was read, which is the time
+    their regeneration took, in their metadata. When these functions read
+    them again, their creation time is moved back by that time multiplied by
+    ``beta`` and by a random factor following an exponential distribution,
+    so that dogpile.cache regenerates them early once in a while.
+
+    The values older than the maximum age of the functions returning
+    expired values are not returned, so that they are regenerated before
+    the function returns.
+
+    Only the values which are not serialized by the region, which are
+    :class:`dogpile.cache.api.CachedValue` objects, are affected.
+    """
+
+    def get(self, key):
+        value = self.proxied.get(key)
+        context = _context
+        if context.reads is None and context.max_age is None:
+            return value
+        if context.reads is not None:
+            context.reads[key] = time.monotonic()
+        if not isinstance(value, api.CachedValue):
+            return value
+        created = value.metadata['ct']
+        if (context.max_age is not None and
+                time.time() - created > context.max_age):
+            return NO_VALUE
+        regeneration_time = value.metadata.get(REGENERATION_TIME)
+        if context.beta is None or not regeneration_time:
+            return value
+        # NOTE: 1 - random() is in ]0, 1], its logarithm is defined.
+        shift = (regeneration_time * context.beta *
+                 -math.log(1.0 - random.random()))  # nosec
+        metadata = dict(value.metadata, ct=created - shift)
+        return api.CachedValue(value.payload, metadata)
+
+    def set(self, key, value):
+        reads = _context.reads
+        if (reads is not None and key in reads and
+                isinstance(value, api.CachedValue)):
+            metadata = dict(value.metadata)
+            metadata[REGENERATION_TIME] = time.monotonic() - reads.pop(key)
+            value = api.CachedValue(value.payload, metadata)
+        self.proxied.set(key, value)
+
+
+def _wrap(region):
+    with _wrap_lock:
+        backend = region.backend
+        while isinstance(backend, proxy.ProxyBackend):
+            if isinstance(backend, RefreshProxy):
+                return
+            backend = backend.proxied
+        region.wrap(RefreshProxy)
+
+
+def _call(func, context, args, kwargs):
+    previous = [getattr(_context, name) for name in _FIELDS]
+    for name in _FIELDS:
+        value = context.get(name)
+        setattr(_context, name, value() if callable(value) else value)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        for name, value in zip(_FIELDS, previous):
+            setattr(_context, name, value)
+
+
+def _bind(region, func, **context):
+    """Call ``func`` with the refresh ``context``.
+
+    ``region`` is wrapped with :class:`RefreshProxy` when ``func`` is first
+    called, since memoized functions are usually defined before their region
+    is configured. The values of the context which are callables are called
+    on every call, the fields missing from it are None.
+    """
+    wrapped = []
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not wrapped:
+            _wrap(region)
+            wrapped.append(True)
+        return _call(func, context, args, kwargs)
+    return wrapper
+
+
+def _isolate(func):
+    """Call ``func`` without the refresh context of its caller."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        context = _context
+        if (context.beta is None and context.reads is None and
+                context.refresher is None and context.max_age is None):
+            return func(*args, **kwargs)
+        return _call(func, {}, args, kwargs)
+    return wrapper
+
+
+class Refresher(object):
+    """Bounded pool of threads regenerating expired values.
+
+    The threads are green threads when eventlet monkey patched the
+    ``threading`` module. When all of them are busy, the expired value is
+    not regenerated and a later call tries again.
+
+    The threads do not survive a fork: a forked process starts its own ones,
+    and the refreshes in flight in the parent are dropped.
+    """
+
+    def __init__(self, get_size, should_cache):
+        """Initialize the pool, whose threads are started when first used.
+
+        :param get_size: function returning the number of threads
+        :param should_cache: function telling whether a value is cached
+        """
+        self._get_size = get_size
+        self._should_cache = should_cache
+        self._lock = threading.Lock()
+        self._executor = None
+        self._size = None
+        # NOTE: the mutexes of the refreshes in flight.
+        self._pending = set()
+        self._counters = dict.fromkeys(('refreshes', 'skipped', 'errors'), 0)
+        _refreshers.add(self)
+
+    def submit(self, region, key, creator, mutex):
+        """Regenerate the value of ``key``, releasing ``mutex`` once done."""
+        with self._lock:
+            if self._executor is None:
+                self._size = self._get_size()
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self._size)
+            if len(self._pending) >= self._size:
+                self._counters['skipped'] += 1
+                mutex.release()
+                return
+            self._pending.add(mutex)
+        refresh = _stats.bind_namespace(_stats.current_namespace(),
+                                        self._refresh)
+        try:
+            self._executor.submit(refresh, region, key, creator, mutex)
+        except Exception:
+            self._done('errors', mutex)
+            mutex.release()
+            raise
+
+    def _refresh(self, region, key, creator, mutex):
+        outcome = 'refreshes'
+        try:
+            value = creator()
+            if self._should_cache(value):
+                region.set(key, value)
+        except Exception:
+            outcome = 'errors'
+            LOG.exception('Unable to refresh the cached value of %s', key)
+        finally:
+            mutex.release()
+            self._done(outcome, mutex)
+
+    def _done(self, outcome, mutex):
+        with self._lock:
+            self._pending.discard(mutex)
+            self._counters[outcome] += 1
+
+    def _reset(self):
+        # NOTE: the refreshes in flight are never done in a forked process,
+        # their mutexes are released so that the values are regenerated
+        # again instead of being waited for forever.
+        self._lock = threading.Lock()
+        self._executor = None
+        pending, self._pending = self._pending, set()
+        for mutex in pending:
+            try:
+                mutex.release()
+            except Exception as e:
+                LOG.debug('Unable to release the mutex of a refresh of the '
+                          'parent process: %s', e)
+
+    def get_stats(self):
+        """Return the counts of the refreshes done, skipped and failed."""
+        with self._lock:
+            return dict(self._counters)
+
+
+_refreshers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for refresher in list(_refreshers):
+        refresher._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _CreationRunner(object):
+    """Async creation runner of a region, used by the refreshing functions.
+
+    dogpile.cache only calls the runner of a region if it is true, which
+    this one is only in the calls of the functions returning expired values,
+    so that the other ones regenerate their values before returning.
+    """
+
+    def __init__(self, previous):
+        self.previous = previous
+
+    def __bool__(self):
+        return _context.refresher is not None or bool(self.previous)
+
+    def __call__(self, region, key, creator, mutex):
+        refresher = _context.refresher
+        if refresher is None:
+            return self.previous(region, key, creator, mutex)
+        refresher.submit(region, key, creator, mutex)
+
+
+def bind(region, func, beta=None, refresher=None, get_max_age=None):
+    """Apply the refresh policies of the memoized function ``func``.
+
+    The policies of the memoized function calling ``func``, if any, do not
+    apply to it.
+
+    :param beta: factor of the early refresh of the values, or None
+    :param refresher: :class:`Refresher` regenerating the expired values
+                      returned, or None
+    :param get_max_age: function returning the age in seconds beyond which
+                        an expired value is regenerated before returning, or
+                        None
+    """
+    context = {}
+    if beta is not None:
+        context.update(beta=beta, reads=dict)
+    if refresher is not None:
+        with _wrap_lock:
+            if not isinstance(region.async_creation_runner, _CreationRunner):
+                region.async_creation_runner = _CreationRunner(
+                    region.async_creation_runner)
+        context.update(refresher=refresher, max_age=get_max_age)
+    if not context:
+        return _isolate(func)
+    return _bind(region, func, **context)
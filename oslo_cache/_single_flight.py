@@ -0,0 +1,368 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Coalescing of the concurrent reads and regenerations of a key."""
+
+import pickle
+import threading
+
+from dogpile.cache import api
+from dogpile.cache import proxy
+from dogpile import util
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+NO_VALUE = api.NO_VALUE
+
+
+def _dumps(value):
+    """Return the pickled value, or None if it cannot be pickled."""
+    try:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        LOG.debug('Sharing an unpicklable value between threads: %s', e)
+        return None
+
+
+class _Call(object):
+    """Result of a call shared by the threads waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.value = None
+        self.pickled = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        if self.pickled is not None:
+            # NOTE: the value was pickled by this process.
+            return pickle.loads(self.pickled)  # nosec
+        return self.value
+
+
+class SingleFlight(object):
+    """Run a function once for all the threads calling it with a key.
+
+    A thread calling :meth:`do` while another thread runs the function for
+    the same key waits for it and gets the same result, or exception. With
+    ``copy``, the result is pickled once for the waiting threads, every one
+    of them getting its own copy.
+    """
+
+    def __init__(self, copy=False):
+        self._copy = copy
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = dict.fromkeys(('calls', 'coalesced'), 0)
+
+    def _join(self, keys):
+        """Returns the calls of the keys and the keys to call for."""
+        calls = {}
+        leading = []
+        with self._lock:
+            for key in keys:
+                if key in calls:
+                    continue
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    leading.append(key)
+                    self._counters['calls'] += 1
+                else:
+                    call.waiters += 1
+                    self._counters['coalesced'] += 1
+                calls[key] = call
+        return calls, leading
+
+    def _finish(self, calls, keys, values=None, error=None):
+        with self._lock:
+            for key in keys:
+                if self._calls.get(key) is calls[key]:
+                    del self._calls[key]
+        for index, key in enumerate(keys):
+            call = calls[key]
+            if error is None:
+                call.value = values[index]
+                # NOTE: no thread joins the call once it is removed.
+                if (self._copy and call.waiters and
+                        call.value is not NO_VALUE):
+                    call.pickled = _dumps(call.value)
+            else:
+                call.error = error
+            call.done.set()
+
+    def do(self, key, func):
+        """Return ``func(key)``, called once for the concurrent callers."""
+        return self.do_multi([key], lambda keys: [func(keys[0])])[0]
+
+    def do_multi(self, keys, func):
+        """Return ``func(keys)``, calling it only for the keys not in flight.
+
+        ``func`` gets the list of the keys for which no call is in flight and
+        returns the list of their values.
+        """
+        calls, leading = self._join(keys)
+        values = {}
+        if leading:
+            try:
+                result = func(leading)
+            # NOTE: the waiting threads would otherwise wait forever when the
+            # call is interrupted, for instance by an eventlet Timeout.
+            except BaseException as e:
+                self._finish(calls, leading, error=e)
+                raise
+            self._finish(calls, leading, values=result)
+            values = dict(zip(leading, result))
+        return [values[key] if key in values else calls[key].result()
+                for key in keys]
+
+    def forget(self, key):
+        """Let the next callers of ``key`` call the function again.
+
+        The callers already waiting get the result of the call in flight.
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+# NOTE: the mutexes are shared by the regions of the process, they are
+# garbage collected once no region uses them.
+_mutexes = util.NameRegistry(lambda key: threading.Lock())
+
+
+class _Mutex(object):
+    """Mutex of a key telling the proxy which threads waited for it.
+
+    When the backend has its own mutex, it is acquired once the mutex of the
+    process is, so that a single thread of the process waits for it.
+    """
+
+    def __init__(self, lock, proxy, key, backend_mutex=None):
+        self._lock = lock
+        self._proxy = proxy
+        self._key = key
+        self._backend_mutex = backend_mutex
+
+    def acquire(self, wait=True):
+        if not self._lock.acquire(False):
+            if not wait:
+                return False
+            self._proxy._wait(self._key)
+            self._lock.acquire()
+        if self._backend_mutex is None:
+            return True
+        try:
+            acquired = self._backend_mutex.acquire(wait)
+        except BaseException:
+            self._release()
+            raise
+        if not acquired:
+            self._release()
+        return acquired
+
+    def _release(self):
+        self._lock.release()
+        self._proxy._release(self._key)
+
+    def release(self):
+        try:
+            if self._backend_mutex is not None:
+                self._backend_mutex.release()
+        finally:
+            self._release()
+
+
+class SingleFlightProxy(proxy.ProxyBackend):
+    """ProxyBackend coalescing the concurrent operations on a key.
+
+    Concurrent reads of a key share a single backend read, including the
+    keys read by concurrent ``get_multi`` calls. Setting or deleting a key
+    makes the next reads call the backend again, so that a thread reads its
+    own writes.
+
+    The mutexes dogpile.cache uses to regenerate a single value at a time
+    are shared by every region of the process using this proxy, the mutex
+    of the backend, if any, being acquired once the one of the process is.
+    The threads waiting for the mutex of a key
+    read the value set by the thread holding it without calling the
+    backend, instead of reading it again one after the other.
+
+    Values which are not serialized by the region are pickled for the
+    threads sharing them, so that every thread gets its own copy, as with a
+    remote backend.
+    """
+
+    def __init__(self):
+        super(SingleFlightProxy, self).__init__()
+        # NOTE: the serialized and deserialized values are different.
+        self._flights = {False: SingleFlight(copy=True), True: SingleFlight()}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # key -> number of threads which waited for its mutex and did not
+        # release it yet
+        self._waiters = {}
+        # key -> (serialized, value) set while threads wait for its mutex,
+        # the values which are not serialized being pickled
+        self._handoffs = {}
+        self._counters = dict.fromkeys(('lock_waits', 'handoffs'), 0)
+
+    def get_mutex(self, key):
+        return _Mutex(_mutexes.get(key), self, key,
+                      self.proxied.get_mutex(key))
+
+    def _wait(self, key):
+        waited = getattr(self._local, 'waited', None)
+        if waited is None:
+            waited = self._local.waited = set()
+        waited.add(key)
+        with self._lock:
+            self._counters['lock_waits'] += 1
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+
+    def _release(self, key):
+        waited = getattr(self._local, 'waited', None)
+        if not waited or key not in waited:
+            return
+        waited.discard(key)
+        with self._lock:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                self._handoffs.pop(key, None)
+
+    def _handoff(self, key, serialized):
+        # NOTE: reading the dict without the lock is enough to skip the
+        # common case where no thread waits.
+        if not self._handoffs:
+            return NO_VALUE
+        with self._lock:
+            handoff = self._handoffs.get(key)
+            if handoff is None or handoff[0] != serialized:
+                return NO_VALUE
+            self._counters['handoffs'] += 1
+        if serialized:
+            return handoff[1]
+        # NOTE: the value was pickled by this process.
+        return pickle.loads(handoff[1])  # nosec
+
+    def _get(self, key, serialized, get):
+        value = self._handoff(key, serialized)
+        if value is NO_VALUE:
+            value = self._flights[serialized].do(key, get)
+        return value
+
+    def _get_multi(self, keys, serialized, get_multi):
+        keys = list(keys)
+        values = [self._handoff(key, serialized) for key in keys]
+        missing = [index for index, value in enumerate(values)
+                   if value is NO_VALUE]
+        if missing:
+            fetched = self._flights[serialized].do_multi(
+                [keys[index] for index in missing], get_multi)
+            for index, value in zip(missing, fetched):
+                values[index] = value
+        return values
+
+    def get(self, key):
+        return self._get(key, False, self.proxied.get)
+
+    def get_serialized(self, key):
+        return self._get(key, True, self.proxied.get_serialized)
+
+    def get_multi(self, keys):
+        return self._get_multi(keys, False, self.proxied.get_multi)
+
+    def get_serialized_multi(self, keys):
+        return self._get_multi(keys, True, self.proxied.get_serialized_multi)
+
+    def _written(self, mapping, serialized):
+        for flight in self._flights.values():
+            for key in mapping:
+                flight.forget(key)
+        if not self._waiters:
+            return
+        handoffs = {}
+        for key, value in mapping.items():
+            if key not in self._waiters:
+                continue
+            # NOTE: pickled before locking, the value is only handed off if
+            # threads still wait for the mutex.
+            if not serialized:
+                value = _dumps(value)
+                if value is None:
+                    continue
+            handoffs[key] = (serialized, value)
+        with self._lock:
+            for key, handoff in handoffs.items():
+                if key in self._waiters:
+                    self._handoffs[key] = handoff
+
+    def _deleted(self, keys):
+        for flight in self._flights.values():
+            for key in keys:
+                flight.forget(key)
+        with self._lock:
+            for key in keys:
+                self._handoffs.pop(key, None)
+
+    def set(self, key, value):
+        self.proxied.set(key, value)
+        self._written({key: value}, False)
+
+    def set_serialized(self, key, value):
+        self.proxied.set_serialized(key, value)
+        self._written({key: value}, True)
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        self._written(mapping, False)
+
+    def set_serialized_multi(self, mapping):
+        self.proxied.set_serialized_multi(mapping)
+        self._written(mapping, True)
+
+    def delete(self, key):
+        self.proxied.delete(key)
+        self._deleted([key])
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        self.proxied.delete_multi(keys)
+        self._deleted(keys)
+
+    def get_stats(self):
+        """Return the statistics of the coalescing as a dict.
+
+        ``reads`` counts the keys read from the backend, ``coalesced`` the
+        keys whose read was shared with another thread, ``lock_waits`` the
+        threads which waited for another one to regenerate a value and
+        ``handoffs`` the values they read without calling the backend.
+        """
+        reads = coalesced = 0
+        for flight in self._flights.values():
+            stats = flight.get_stats()
+            reads += stats['calls']
+            coalesced += stats['coalesced']
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(reads=reads, coalesced=coalesced)
+        return stats
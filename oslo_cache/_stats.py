@@ -0,0 +1,243 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Lightweight statistics used to instrument oslo.cache."""
+
+import bisect
+import collections
+import functools
+import sys
+import threading
+import weakref
+
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+
+# Upper bounds, in seconds, of the buckets of the latency histograms. They
+# go from the cost of an in-process lookup to a network timeout.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds, in bytes, of the buckets of the value size histograms.
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Namespace of the operations which are not done by a memoized function.
+NO_NAMESPACE = 'unattributed'
+
+
+class _Context(threading.local):
+    # NOTE: a class attribute is the default of every thread, reading it is
+    # much cheaper than catching the AttributeError of a missing one.
+    namespace = NO_NAMESPACE
+
+
+_context = _Context()
+
+
+class Histogram(object):
+    """Thread-safe histogram with fixed buckets.
+
+    Recording a value costs a binary search over the bucket bounds and a
+    short critical section, so it can be done on every cache operation.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, lock=None):
+        """Initialize the histogram.
+
+        :param buckets: sorted upper bounds of the buckets, values greater
+                        than the last one are counted in an extra bucket
+        :param lock: lock protecting the histogram, which can be shared with
+                     other statistics recorded at the same time
+        """
+        self.buckets = tuple(buckets)
+        self._lock = lock or threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0
+        self._max = 0
+
+    def observe(self, value):
+        """Record a value."""
+        with self._lock:
+            self._observe(value)
+
+    def _observe(self, value):
+        # NOTE: the caller holds the lock.
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._count += 1
+        self._sum += value
+        if value > self._max:
+            self._max = value
+
+    def snapshot(self):
+        """Return the recorded values as a dict.
+
+        ``buckets`` is a list of ``(upper bound, count)`` pairs, the last
+        bound being ``float('inf')``. The counts are not cumulative.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count, total, maximum = self._count, self._sum, self._max
+        return {
+            'count': count,
+            'sum': total,
+            'max': maximum,
+            'buckets': list(zip(self.buckets + (float('inf'),), counts)),
+        }
+
+
+def current_namespace():
+    """Return the namespace the cache operations are attributed to."""
+    return _context.namespace
+
+
+def bind_namespace(namespace, func):
+    """Attribute the cache operations done by ``func`` to ``namespace``."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = _context.namespace
+        _context.namespace = namespace
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _context.namespace = previous
+    return wrapper
+
+
+def approximate_size(value):
+    """Return the approximate size in bytes of a cached value.
+
+    Values which are not serialized are not pickled to be measured, which
+    would cost more than the cache operation itself: the shallow size of
+    their payload is used instead.
+    """
+    if isinstance(value, bytes):
+        return len(value)
+    payload = getattr(value, 'payload', value)
+    if isinstance(payload, (bytes, str)):
+        return len(payload)
+    return sys.getsizeof(payload)
+
+
+class CacheStats(object):
+    """Statistics of the operations of a cache region.
+
+    Hits, misses, sets and deletes are counted by namespace, which is the
+    memoized function doing the operations or :data:`NO_NAMESPACE`. The
+    latency of the backend calls and the sizes of the values are recorded
+    in histograms for the whole region.
+    """
+
+    COUNTERS = ('hits', 'misses', 'sets', 'deletes')
+
+    def __init__(self):
+        # NOTE: a single lock is taken once per operation to record all its
+        # statistics.
+        self._lock = threading.Lock()
+        self._namespaces = collections.defaultdict(
+            lambda: dict.fromkeys(self.COUNTERS, 0))
+        self.latency = {operation: Histogram(lock=self._lock)
+                        for operation in ('get', 'set', 'delete')}
+        self.value_size = Histogram(SIZE_BUCKETS, lock=self._lock)
+
+    def record_get(self, seconds, values, misses):
+        """Record a get which found ``values`` and missed ``misses`` keys."""
+        sizes = [approximate_size(value) for value in values]
+        namespace = _context.namespace
+        with self._lock:
+            self.latency['get']._observe(seconds)
+            counters = self._namespaces[namespace]
+            counters['hits'] += len(sizes)
+            counters['misses'] += misses
+            for size in sizes:
+                self.value_size._observe(size)
+
+    def record_set(self, seconds, values):
+        """Record a set of ``values``."""
+        sizes = [approximate_size(value) for value in values]
+        namespace = _context.namespace
+        with self._lock:
+            self.latency['set']._observe(seconds)
+            self._namespaces[namespace]['sets'] += len(sizes)
+            for size in sizes:
+                self.value_size._observe(size)
+
+    def record_delete(self, seconds, count):
+        """Record a delete of ``count`` keys."""
+        namespace = _context.namespace
+        with self._lock:
+            self.latency['delete']._observe(seconds)
+            self._namespaces[namespace]['deletes'] += count
+
+    def snapshot(self):
+        """Return the statistics as a dict.
+
+        * ``hits``, ``misses``, ``sets`` and ``deletes``: counts of the whole
+          region
+        * ``namespaces``: the same counts by namespace
+        * ``latency``: histograms of the ``get``, ``set`` and ``delete``
+          backend calls, in seconds
+        * ``value_size``: histogram of the sizes of the values read and
+          written, in bytes
+        """
+        with self._lock:
+            namespaces = {namespace: dict(counters)
+                          for namespace, counters in self._namespaces.items()}
+        snapshot = dict.fromkeys(self.COUNTERS, 0)
+        for counters in namespaces.values():
+            for name, count in counters.items():
+                snapshot[name] += count
+        snapshot['namespaces'] = namespaces
+        snapshot['latency'] = {operation: histogram.snapshot()
+                               for operation, histogram
+                               in self.latency.items()}
+        snapshot['value_size'] = self.value_size.snapshot()
+        return snapshot
+
+
+class StatsEmitter(object):
+    """Periodically pass a snapshot of :class:`CacheStats` to a callable.
+
+    The emitter runs in a daemon thread which only holds a weak reference to
+    the statistics, it stops with :meth:`stop` or once they are garbage
+    collected.
+    """
+
+    def __init__(self, stats, interval, emit):
+        self._stats = weakref.ref(stats)
+        self._interval = interval
+        self._emit = emit
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='cache-stats-emitter')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            stats = self._stats()
+            if stats is None:
+                return
+            try:
+                self._emit(stats.snapshot())
+            except Exception:
+                LOG.exception('Unable to emit cache statistics')
+            del stats
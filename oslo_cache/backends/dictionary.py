@@ -14,15 +14,93 @@
 
 """dogpile.cache backend that uses dictionary for storage"""
 
+import collections
+import operator
+import os
+import pickle
+import sys
+import threading
+import time
+
 from dogpile.cache import api
+from oslo_cache._i18n import _
 from oslo_cache import core
+from oslo_cache import exception
 from oslo_utils import timeutils
 
 __all__ = [
-    'DictCacheBackend'
+    'DictCacheBackend',
+    'ShardedDictCacheBackend',
 ]
 
 _NO_VALUE = core.NO_VALUE
+_MISSING = (_NO_VALUE, 0)
+
+# Number of expired keys expunged on each set, in addition to one per key
+# set, so that expunging keeps up with the keys set.
+_EXPUNGE_BATCH = 16
+
+# Interval in seconds between two updates of the coarse clock.
+_COARSE_CLOCK_RESOLUTION = 0.1
+
+_CLOCKS = ('monotonic', 'coarse')
+
+
+# NOTE: oslo.utils has no public API telling whether its time is
+# overridden, as by oslo_utils.fixture.TimeFixture, so the state of
+# timeutils.set_time_override() is looked up where the releases keep it, the
+# override being ignored if it is not found.
+if hasattr(timeutils, '_override_time'):
+    def _time_overridden():
+        return timeutils._override_time is not None
+elif hasattr(timeutils.utcnow, 'override_time'):
+    def _time_overridden():
+        return timeutils.utcnow.override_time is not None
+else:
+    def _time_overridden():
+        return False
+
+
+class _CoarseClock(object):
+    """Monotonic clock updated periodically by a daemon thread.
+
+    Reading the clock only reads an attribute, at the cost of lagging up to
+    ``resolution`` seconds behind :func:`time.monotonic`. The thread is
+    started by the first backend using the clock.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.now = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.now = time.monotonic()
+                self._thread = threading.Thread(target=self._run,
+                                                name='cache-coarse-clock')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _reset(self):
+        # NOTE: the thread does not survive a fork, it is started again in
+        # the child.
+        self._lock = threading.Lock()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.resolution)
+            self.now = time.monotonic()
+
+
+_coarse_clock = _CoarseClock(_COARSE_CLOCK_RESOLUTION)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_coarse_clock._reset)
 
 
 class DictCacheBackend(api.CacheBackend):
@@ -35,11 +113,54 @@ class DictCacheBackend(api.CacheBackend):
         Default expiration_time value is 0, that means that all keys have
         infinite time-to-live value.
     :type expiration_time: real
+    :param max_entries: maximum number of keys, the least recently used ones
+        are evicted first. Default is 0, no limit.
+    :type max_entries: int
+    :param max_bytes: maximum total size of the values, measured by pickling
+        them when they are set, the least recently used ones are evicted
+        first. Default is 0, no limit.
+    :type max_bytes: int
+    :param clock: clock measuring the time-to-live of the keys, either
+        ``monotonic``, the default, or ``coarse``, which is cheaper to read
+        but lags up to a tenth of a second behind, so that keys may live
+        that much longer.
+    :type clock: str
+
+    The time-to-live of the keys is measured with :func:`time.monotonic`,
+    unless the time is overridden with :mod:`oslo_utils.timeutils`, as done
+    by :class:`oslo_utils.fixture.TimeFixture`.
+
+    All the operations are serialized by a lock, see
+    :class:`ShardedDictCacheBackend` for a backend shared by many threads.
     """
 
     def __init__(self, arguments):
         self.expiration_time = arguments.get('expiration_time', 0)
-        self.cache = {}
+        self.max_entries = int(arguments.get('max_entries', 0))
+        self.max_bytes = int(arguments.get('max_bytes', 0))
+        clock = arguments.get('clock', 'monotonic')
+        if clock not in _CLOCKS:
+            raise exception.ConfigurationError(
+                _('Unknown clock %(clock)s, must be one of %(clocks)s') %
+                {'clock': clock, 'clocks': ', '.join(_CLOCKS)})
+        self._coarse_clock = None
+        if clock == 'coarse' and self.expiration_time > 0:
+            self._coarse_clock = _coarse_clock
+            self._coarse_clock.start()
+        # NOTE: the keys are kept from the least to the most recently used
+        # when the cache is bounded, so that the key to evict is the first.
+        self.cache = collections.OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        # NOTE: every key set is queued with its timeout. All the keys have
+        # the same time-to-live, so the queue is sorted by timeout and the
+        # expired keys are found at its left end without scanning the cache.
+        self._timeouts = collections.deque()
+        # NOTE: the clock the timeouts were measured with, and the last time
+        # read while the time was overridden, see _now().
+        self._overridden = _time_overridden()
+        self._overridden_now = None
+        self._lock = threading.Lock()
 
     def get(self, key):
         """Retrieves the value for a key.
@@ -48,16 +169,88 @@ class DictCacheBackend(api.CacheBackend):
         :returns: value for a key or :data:`oslo_cache.core.NO_VALUE`
             for nonexistent or expired keys.
         """
-        (value, timeout) = self.cache.get(key, (_NO_VALUE, 0))
-        if self.expiration_time > 0 and timeutils.utcnow_ts() >= timeout:
-            self.cache.pop(key, None)
+        with self._lock:
+            return self._get(key)
+
+    def _now(self):
+        """Returns the current time, under the lock.
+
+        The timeouts measured before the time is overridden, or restored,
+        are moved to the clock used from then on, keeping the time-to-live
+        left, so that the times of the two clocks are never compared.
+        """
+        overridden = _time_overridden()
+        if overridden:
+            now = self._overridden_now = timeutils.utcnow_ts(
+                microsecond=True)
+        elif self._coarse_clock is not None:
+            now = self._coarse_clock.now
+        else:
+            now = time.monotonic()
+        if overridden != self._overridden:
+            self._shift_timeouts(overridden, now)
+        return now
+
+    def _monotonic(self):
+        if self._coarse_clock is not None:
+            return self._coarse_clock.now
+        return time.monotonic()
+
+    def _shift_timeouts(self, overridden, now):
+        """Moves the timeouts to the clock giving ``now``, under the lock."""
+        if overridden:
+            previous = self._monotonic()
+        else:
+            # NOTE: the overridden time cannot be read once restored.
+            previous = self._overridden_now
+        self._overridden = overridden
+        if previous is None or not self._timeouts:
+            return
+        delta = now - previous
+        cache = self.cache
+        for key, (value, timeout) in list(cache.items()):
+            if timeout:
+                cache[key] = (value, timeout + delta)
+        self._timeouts = collections.deque(
+            (timeout + delta, key) for timeout, key in self._timeouts)
+
+    def _get(self, key):
+        # NOTE: the clock is read first, as reading it may move the timeouts.
+        now = self._now() if self.expiration_time > 0 else None
+        (value, timeout) = self.cache.get(key, _MISSING)
+        if now is not None and now >= timeout:
+            self._pop(key)
             return _NO_VALUE
 
+        if (self.max_entries or self.max_bytes) and value is not _NO_VALUE:
+            self.cache.move_to_end(key)
         return value
 
     def get_multi(self, keys):
-        """Retrieves the value for a list of keys."""
-        return [self.get(key) for key in keys]
+        """Retrieves the value for a list of keys.
+
+        The clock is read once and the keys are processed in one pass for
+        the whole list.
+        """
+        keys = list(keys)
+        with self._lock:
+            now = self._now() if self.expiration_time > 0 else None
+            cache_get = self.cache.get
+            entries = [cache_get(key, _MISSING) for key in keys]
+            if now is not None:
+                values = [_NO_VALUE if now >= timeout else value
+                          for value, timeout in entries]
+                for key, (_value, timeout) in zip(keys, entries):
+                    if now >= timeout:
+                        self._pop(key)
+            else:
+                values = [value for value, _timeout in entries]
+            if self.max_entries or self.max_bytes:
+                move_to_end = self.cache.move_to_end
+                for key, value in zip(keys, values):
+                    if value is not _NO_VALUE:
+                        move_to_end(key)
+        return values
 
     def set(self, key, value):
         """Sets the value for a key.
@@ -73,34 +266,186 @@ class DictCacheBackend(api.CacheBackend):
         """Set multiple values in the cache.
         Expunges expired keys during each set.
 
+        Expunging costs at most one step per key set plus a small constant,
+        so a set does not get slower as the cache grows.
+
         :param mapping: dictionary with key/value pairs
         """
-        self._clear()
-        timeout = 0
-        if self.expiration_time > 0:
-            timeout = timeutils.utcnow_ts() + self.expiration_time
-        for key, value in mapping.items():
-            self.cache[key] = (value, timeout)
+        sizes = None
+        if self.max_bytes:
+            sizes = {key: _value_size(value)
+                     for key, value in mapping.items()}
+        with self._lock:
+            timeout = 0
+            if self.expiration_time > 0:
+                now = self._now()
+                self._expunge(now, len(mapping) + _EXPUNGE_BATCH)
+                timeout = now + self.expiration_time
+            if self.max_entries or sizes is not None:
+                # NOTE: keys set again are moved to the most recently used
+                # end and their size is replaced.
+                for key, value in mapping.items():
+                    self._pop(key)
+                    self.cache[key] = (value, timeout)
+                    if sizes is not None:
+                        self._sizes[key] = sizes[key]
+                        self._bytes += sizes[key]
+                self._evict()
+            else:
+                self.cache.update((key, (value, timeout))
+                                  for key, value in mapping.items())
+            if timeout:
+                self._timeouts.extend((timeout, key) for key in mapping)
+                if (len(self._timeouts) >
+                        2 * len(self.cache) + _EXPUNGE_BATCH):
+                    self._compact()
 
     def delete(self, key):
         """Deletes the value associated with the key if it exists.
 
         :param key: dictionary key
         """
-        self.cache.pop(key, None)
+        with self._lock:
+            self._pop(key)
 
     def delete_multi(self, keys):
         """Deletes the value associated with each key in list if it exists.
 
         :param keys: list of dictionary keys
         """
-        for key in keys:
-            self.cache.pop(key, None)
+        with self._lock:
+            if self.max_bytes:
+                for key in keys:
+                    self._pop(key)
+            else:
+                pop = self.cache.pop
+                for key in keys:
+                    pop(key, None)
 
     def _clear(self):
         """Expunges expired keys."""
-        now = timeutils.utcnow_ts()
-        for k in list(self.cache):
-            (_value, timeout) = self.cache[k]
-            if timeout > 0 and now >= timeout:
-                del self.cache[k]
+        with self._lock:
+            self._expunge(self._now())
+
+    def _expunge(self, now, limit=None):
+        """Expunges up to ``limit`` keys expired at ``now``.
+
+        The queued timeouts of keys which were deleted or set again since
+        are dropped without touching the cache. The caller holds the lock.
+        """
+        timeouts = self._timeouts
+        while timeouts and timeouts[0][0] <= now and limit != 0:
+            timeout, key = timeouts.popleft()
+            if limit is not None:
+                limit -= 1
+            entry = self.cache.get(key)
+            if entry is not None and entry[1] == timeout:
+                self._pop(key)
+
+    def _compact(self):
+        """Queues again the timeouts of the keys in the cache only.
+
+        The timeouts of the keys set again, deleted or evicted stay queued
+        until they expire, so the queue is rebuilt once most of it is stale,
+        which bounds it whatever the time-to-live. The caller holds the lock.
+        """
+        self._timeouts = collections.deque(sorted(
+            ((timeout, key) for key, (_value, timeout) in self.cache.items()),
+            key=operator.itemgetter(0)))
+
+    def _pop(self, key):
+        """Removes a key and its size if it exists, under the lock."""
+        if self.cache.pop(key, None) is not None and self.max_bytes:
+            self._bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        """Evicts the least recently used keys exceeding the limits."""
+        while self.cache and (
+                (self.max_entries and len(self.cache) > self.max_entries) or
+                (self.max_bytes and self._bytes > self.max_bytes)):
+            key = next(iter(self.cache))
+            self._pop(key)
+
+
+def _value_size(value):
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class ShardedDictCacheBackend(api.CacheBackend):
+    """A dictionary backend split in shards locked independently.
+
+    Every key belongs to one of several :class:`DictCacheBackend` shards,
+    chosen by its hash, so that threads using different keys seldom wait
+    for each other.
+
+    Arguments accepted in the arguments dictionary, in addition to the ones
+    of :class:`DictCacheBackend`:
+
+    :param shards: number of shards. Default is 16.
+    :type shards: int
+
+    ``max_entries`` and ``max_bytes`` are split evenly between the shards.
+    """
+
+    def __init__(self, arguments):
+        shards = int(arguments.get('shards', 16))
+        if shards < 1:
+            raise exception.ConfigurationError(
+                _('The number of shards must be positive: %s') % shards)
+        shard_arguments = dict(arguments)
+        for limit in ('max_entries', 'max_bytes'):
+            if shard_arguments.get(limit):
+                # NOTE: rounded up, so that a limit is never 0, unlimited.
+                shard_arguments[limit] = -(-int(arguments[limit]) // shards)
+        self.shards = [DictCacheBackend(shard_arguments)
+                       for _shard in range(shards)]
+
+    def _shard(self, key):
+        return self.shards[hash(key) % len(self.shards)]
+
+    def _group(self, keys):
+        """Groups the indices of the keys by shard."""
+        groups = collections.defaultdict(list)
+        shards = self.shards
+        for index, key in enumerate(keys):
+            groups[hash(key) % len(shards)].append(index)
+        return groups
+
+    def get(self, key):
+        return self._shard(key).get(key)
+
+    def get_multi(self, keys):
+        keys = list(keys)
+        values = [None] * len(keys)
+        for shard, indices in self._group(keys).items():
+            shard_values = self.shards[shard].get_multi(
+                [keys[index] for index in indices])
+            for index, value in zip(indices, shard_values):
+                values[index] = value
+        return values
+
+    def set(self, key, value):
+        self._shard(key).set(key, value)
+
+    def set_multi(self, mapping):
+        keys = list(mapping)
+        for shard, indices in self._group(keys).items():
+            self.shards[shard].set_multi(
+                {keys[index]: mapping[keys[index]] for index in indices})
+
+    def delete(self, key):
+        self._shard(key).delete(key)
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        for shard, indices in self._group(keys).items():
+            self.shards[shard].delete_multi(
+                [keys[index] for index in indices])
+
+    def _clear(self):
+        """Expunges expired keys of every shard."""
+        for shard in self.shards:
+            shard._clear()
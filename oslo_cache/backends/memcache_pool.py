@@ -15,17 +15,54 @@
 
 """dogpile.cache backend that uses Memcached connection pool"""
 
+import collections
+from concurrent import futures
 import functools
+import random
+import threading
+import time
 
 from dogpile.cache.backends import memcached as memcached_backend
+from oslo_log import log
+from oslo_utils import uuidutils
 
+from oslo_cache._i18n import _
 from oslo_cache import _memcache_pool
+from oslo_cache import exception
+
+
+LOG = log.getLogger(__name__)
+
+# Bounds, in seconds, of the interval between two attempts to acquire a
+# distributed lock, doubled after every attempt.
+_LOCK_MIN_DELAY = 0.01
+_LOCK_MAX_DELAY = 0.5
+
+
+# Pool classes of every implementation, pooling respectively HashClient
+# objects and single server clients.
+_POOL_IMPLEMENTATIONS = {
+    'queue': (_memcache_pool.MemcacheClientPool,
+              _memcache_pool.MemcacheServerPool),
+    'lifo': (_memcache_pool.LifoMemcacheClientPool,
+             _memcache_pool.LifoMemcacheServerPool),
+}
+
+
+# NOTE: the fan-out uses internals of the pymemcache HashClient, which the
+# supported releases have, the clients lacking them are used as they are.
+_FANOUT_ATTRIBUTES = ('_get_client', '_safely_run_func',
+                      '_safely_run_set_many')
+
+# Class of client -> whether it has the attributes used by the fan-out
+_fanout_support = {}
 
 
 # Helper to ease backend refactoring
 class ClientProxy(object):
-    def __init__(self, client_pool):
+    def __init__(self, client_pool, executor=None):
         self.client_pool = client_pool
+        self.executor = executor
 
     def _run_method(self, __name, *args, **kwargs):
         with self.client_pool.acquire() as client:
@@ -34,28 +71,258 @@ class ClientProxy(object):
     def __getattr__(self, name):
         return functools.partial(self._run_method, name)
 
+    def _can_fan_out(self, client):
+        client_class = type(client)
+        supported = _fanout_support.get(client_class)
+        if supported is None:
+            supported = _fanout_support[client_class] = all(
+                hasattr(client_class, name) for name in _FANOUT_ATTRIBUTES)
+            if not supported:
+                LOG.warning('The memcached client %s does not support '
+                            'fanning out the multi-key operations, they '
+                            'are sent to the servers one after the other.',
+                            client_class.__name__)
+        return supported
+
+    def _run_batches(self, batches, func):
+        # NOTE: the batches share the acquired client, which is only released
+        # once all of them are done.
+        return _memcache_pool.run_concurrently(self.executor, batches, func)
+
+    def get_multi(self, keys, *args, **kwargs):
+        if self.executor is None:
+            return self._run_method('get_multi', keys, *args, **kwargs)
+        with self.client_pool.acquire() as client:
+            if not self._can_fan_out(client):
+                return client.get_multi(keys, *args, **kwargs)
+            batches = collections.defaultdict(list)
+            for key in keys:
+                server = client._get_client(key)
+                if server is not None:
+                    batches[server].append(key)
+            if len(batches) < 2:
+                return client.get_multi(keys, *args, **kwargs)
+
+            def get_batch(server, batch):
+                return client._safely_run_func(
+                    server, server.get_many, {}, batch, *args, **kwargs)
+
+            values = {}
+            for result in self._run_batches(batches, get_batch):
+                values.update(result)
+            return values
+
+    def set_multi(self, mapping, *args, **kwargs):
+        if self.executor is None:
+            return self._run_method('set_multi', mapping, *args, **kwargs)
+        with self.client_pool.acquire() as client:
+            if not self._can_fan_out(client):
+                return client.set_multi(mapping, *args, **kwargs)
+            batches = collections.defaultdict(dict)
+            failed = []
+            for key, value in mapping.items():
+                server = client._get_client(key)
+                if server is None:
+                    failed.append(key)
+                else:
+                    batches[server][key] = value
+            if len(batches) < 2:
+                return client.set_multi(mapping, *args, **kwargs)
+
+            def set_batch(server, batch):
+                return client._safely_run_set_many(
+                    server, batch, *args, **kwargs)
+
+            for result in self._run_batches(batches, set_batch):
+                failed.extend(result)
+            return failed
+
+    def delete_multi(self, keys, *args, **kwargs):
+        if self.executor is None:
+            return self._run_method('delete_multi', keys, *args, **kwargs)
+        with self.client_pool.acquire() as client:
+            if not self._can_fan_out(client):
+                return client.delete_multi(keys, *args, **kwargs)
+            batches = collections.defaultdict(list)
+            for key in keys:
+                server = client._get_client(key)
+                if server is not None:
+                    batches[server].append(key)
+
+            def delete_batch(server, batch):
+                return client._safely_run_func(
+                    server, server.delete_many, False, batch, *args, **kwargs)
+
+            if batches:
+                self._run_batches(batches, delete_batch)
+            return True
+
+
+class _MemcachedLock(object):
+    """Lock shared by all the processes using the memcached servers.
+
+    The lock is held by the thread which added its key, the value of the key
+    being a token of the acquisition so that it is only released by its
+    holder. The key expires after ``timeout`` seconds, so that a process
+    dying while holding the lock does not keep it forever.
+
+    Waiting for the lock gives up after ``timeout`` seconds and proceeds
+    without holding it, so that the servers failing to add the key do not
+    block the callers.
+    """
+
+    def __init__(self, client, key, timeout):
+        if timeout < 1:
+            raise exception.ConfigurationError(
+                _('The memcached lock timeout must be at least 1 second, '
+                  'got %s') % timeout)
+        self.client = client
+        self.key = '_lock' + key
+        self.timeout = timeout
+        # NOTE: dogpile.cache shares the mutex of a key between the threads
+        # of the process, each of them holding the lock or not.
+        self._local = threading.local()
+
+    def acquire(self, wait=True):
+        self._local.token = None
+        token = uuidutils.generate_uuid(dashed=False)
+        deadline = time.monotonic() + self.timeout
+        delay = _LOCK_MIN_DELAY
+        while True:
+            # NOTE: the pymemcache clients do not wait for the reply of the
+            # servers by default, which tells whether the key was added.
+            if self.client.add(self.key, token, self.timeout,
+                               noreply=False):
+                self._local.token = token
+                return True
+            if not wait:
+                return False
+            if time.monotonic() >= deadline:
+                LOG.warning('Gave up waiting for the cache lock %s after %s '
+                            'seconds', self.key, self.timeout)
+                return True
+            # NOTE: randomized, so that the waiters do not poll together.
+            time.sleep(delay * random.uniform(0.5, 1.5))  # nosec
+            delay = min(delay * 2, _LOCK_MAX_DELAY)
+
+    def release(self):
+        token = getattr(self._local, 'token', None)
+        if token is None:
+            return
+        self._local.token = None
+        # NOTE: the key may have expired and been added by another process,
+        # whose lock must not be released. The key is expired at once with a
+        # negative expiration time, only if it was not changed since read.
+        value, cas = self.client.gets(self.key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        if value == token:
+            self.client.cas(self.key, token, cas, expire=-1, noreply=False)
+
 
 class PooledMemcachedBackend(memcached_backend.MemcachedBackend):
-    """Memcached backend that does connection pooling."""
+    """Memcached backend that does connection pooling.
+
+    Arguments accepted in the arguments dictionary, in addition to the ones
+    of :class:`dogpile.cache.backends.memcached.MemcachedBackend`:
+
+    :param pool_maxsize: maximum number of clients held by the pool.
+    :param pool_unused_timeout: seconds an unused client is kept in the pool.
+    :param pool_connection_get_timeout: seconds to wait for a pooled client.
+    :param pool_min_size: number of clients created and connected in
+        parallel when the backend is created, and kept even when unused.
+    :param pool_reap_interval: seconds between two runs of a background
+        thread closing the unused clients. If ``0`` (default), they are closed
+        inline when a client is acquired.
+    :param pool_implementation: ``queue`` (default) or ``lifo``, see
+        :class:`oslo_cache._memcache_pool.ConnectionPool` and
+        :class:`oslo_cache._memcache_pool.LifoConnectionPool`.
+    :param pool_fanout: if ``True``, the per-server batches of ``get_multi``,
+        ``set_multi`` and ``delete_multi`` are sent to all the servers
+        concurrently, so that a multi-key operation costs about one round
+        trip instead of one round trip per server. Default is ``False``.
+    :param pool_per_server: if ``True``, every server gets its own pool of
+        single server clients instead of pooling clients connected to all the
+        servers, see :class:`oslo_cache._memcache_pool.MemcacheServerPools`.
+        ``pool_maxsize`` and ``pool_min_size`` then apply to every server.
+        Default is ``False``.
+
+    The ``distributed_lock`` and ``lock_timeout`` arguments of
+    :class:`dogpile.cache.backends.memcached.GenericMemcachedBackend` are
+    supported, the lock being a :class:`_MemcachedLock` added through the
+    pool. ``lock_timeout`` must then be at least 1 second.
+    """
 
     # Composed from GenericMemcachedBackend's and MemcacheArgs's __init__
     def __init__(self, arguments):
         super(PooledMemcachedBackend, self).__init__(arguments)
-        self.client_pool = _memcache_pool.MemcacheClientPool(
-            self.url,
-            arguments={
-                'dead_retry': arguments.get('dead_retry', 5 * 60),
-                'socket_timeout': arguments.get('socket_timeout', 3.0),
-                'server_max_value_length':
-                    arguments.get('server_max_value_length'),
-            },
-            maxsize=arguments.get('pool_maxsize', 10),
-            unused_timeout=arguments.get('pool_unused_timeout', 60),
-            conn_get_timeout=arguments.get('pool_connection_get_timeout', 10),
-        )
+        if self.distributed_lock and self.lock_timeout < 1:
+            raise exception.ConfigurationError(
+                _('The memcached lock timeout must be at least 1 second, '
+                  'got %s') % self.lock_timeout)
+        maxsize = arguments.get('pool_maxsize', 10)
+        implementation = arguments.get('pool_implementation', 'queue')
+        try:
+            client_pool_class, server_pool_class = _POOL_IMPLEMENTATIONS[
+                implementation]
+        except KeyError:
+            raise exception.ConfigurationError(
+                _('Unknown memcache pool implementation: %s') %
+                implementation)
+        pool_arguments = {
+            'maxsize': maxsize,
+            'unused_timeout': arguments.get('pool_unused_timeout', 60),
+            'conn_get_timeout': arguments.get('pool_connection_get_timeout',
+                                              10),
+            'reap_interval': arguments.get('pool_reap_interval', 0),
+            'min_size': arguments.get('pool_min_size', 0),
+        }
+        self.executor = None
+        if arguments.get('pool_fanout', False) and len(self.url) > 1:
+            # NOTE: every client checked out of the pool may fan out to all
+            # the servers at once, one batch being run by the caller itself.
+            self.executor = futures.ThreadPoolExecutor(
+                max_workers=max(maxsize, 1) * (len(self.url) - 1))
+        self.per_server = arguments.get('pool_per_server', False)
+        if self.per_server:
+            self.client_pool = _memcache_pool.MemcacheServerPools(
+                self.url,
+                arguments={
+                    'socket_timeout': arguments.get('socket_timeout', 3.0),
+                },
+                pool_class=server_pool_class,
+                dead_retry=arguments.get('dead_retry', 5 * 60),
+                executor=self.executor,
+                **pool_arguments)
+        else:
+            self.client_pool = client_pool_class(
+                self.url,
+                arguments={
+                    'dead_retry': arguments.get('dead_retry', 5 * 60),
+                    'socket_timeout': arguments.get('socket_timeout', 3.0),
+                    'server_max_value_length':
+                        arguments.get('server_max_value_length'),
+                },
+                **pool_arguments)
+        self.client_pool.prewarm()
+
+    def get_stats(self):
+        """Return the statistics of the connection pool.
+
+        See :meth:`oslo_cache._memcache_pool.ConnectionPool.get_stats`, they
+        are given by server when ``pool_per_server`` is set.
+        """
+        return self.client_pool.get_stats()
+
+    def get_mutex(self, key):
+        if self.distributed_lock:
+            return _MemcachedLock(self.client, key, self.lock_timeout)
+        return None
 
     # Since all methods in backend just call one of methods of client, this
     # lets us avoid need to hack it too much
     @property
     def client(self):
-        return ClientProxy(self.client_pool)
+        if self.per_server:
+            return self.client_pool
+        return ClientProxy(self.client_pool, self.executor)
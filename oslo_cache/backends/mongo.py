@@ -14,12 +14,17 @@
 
 import abc
 import datetime
+import os
+import pickle  # nosec
+import threading
+import zlib
 
 from dogpile.cache import api
 from dogpile import util as dp_util
 from oslo_cache import core
 from oslo_log import log
 from oslo_utils import importutils
+from oslo_utils import strutils
 from oslo_utils import timeutils
 import six
 
@@ -34,6 +39,31 @@ __all__ = [
 _NO_VALUE = core.NO_VALUE
 LOG = log.getLogger(__name__)
 
+# Fields of the documents read, per storage format, when the cached values
+# are built without the manipulator.
+_PROJECTIONS = {
+    'document': {'value': True, 'meta': True},
+    'blob': {'blob': True},
+}
+
+# First byte of the blobs, telling whether the pickled value is compressed.
+_BLOB_PICKLED = b'p'
+_BLOB_COMPRESSED = b'z'
+
+# Arguments of the CRUD calls which are options of the write concern of the
+# collection.
+_WRITE_CONCERN_ARGS = ('w', 'wtimeout', 'j', 'fsync')
+# Arguments of the CRUD calls removed from pymongo, which are ignored.
+_REMOVED_ARGS = ('continue_on_error', 'manipulate', 'safe',
+                 'secondary_acceptable_latency_ms')
+# Integer arguments of the connection pool and their MongoClient options.
+_POOL_ARGS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+    'max_idle_time_ms': 'maxIdleTimeMS',
+    'wait_queue_timeout_ms': 'waitQueueTimeoutMS',
+}
+
 
 class MongoCacheBackend(api.CacheBackend):
     """A MongoDB based caching backend implementing dogpile backend APIs.
@@ -61,6 +91,27 @@ class MongoCacheBackend(api.CacheBackend):
     :param max_pool_size: integer, the maximum number of connections that the
         pool will open simultaneously. By default the pool size is 10.
 
+    :param min_pool_size: integer, the minimum number of connections that the
+        pool keeps open. By default no connection is kept open.
+
+    :param max_idle_time_ms: integer, the number of milliseconds after which
+        an idle connection is closed. By default idle connections are kept.
+
+    :param wait_queue_timeout_ms: integer, the number of milliseconds a
+        thread waits for a connection when the pool is full before failing.
+        By default threads wait without timeout.
+
+    :param compressors: string, comma separated list of the compressors
+        negotiated with the server for the network traffic, among
+        ``snappy``, ``zlib`` and ``zstd``. By default no compression is used.
+
+    :param zlib_compression_level: integer, the compression level, from -1 to
+        9, of the ``zlib`` compressor.
+
+        The regions using the same ``db_hosts``, ``db_name`` and connection
+        arguments share their client and its connection pool, the regions
+        with different pool or compression arguments get their own one.
+
     :param w: integer, write acknowledgement for MongoDB client
 
         If not provided, then no default is set on MongoDB and then write
@@ -91,16 +142,17 @@ class MongoCacheBackend(api.CacheBackend):
         implements MongoDB SONManipulator.
         Default manipulator used is :class:`.BaseTransform`.
 
-        This manipulator is added per database. In multiple cache
-        configurations, the manipulator name should be same if same
-        database name ``db_name`` is used in those configurations.
+        The backend applies this manipulator to the documents it writes and
+        reads, as pymongo no longer supports SON manipulators.
 
         SONManipulator is used to manipulate custom data types as they are
         saved or retrieved from MongoDB. Custom impl is only needed if cached
         data is custom class and needs transformations when saving or reading
         from db. If dogpile cached value contains built-in data types, then
         BaseTransform class is sufficient as it already handles dogpile
-        CachedValue class transformation.
+        CachedValue class transformation. With it, the documents are read
+        without the manipulator, only their ``value`` and ``meta`` fields
+        being fetched to build the cached values.
 
     :param mongo_ttl_seconds: integer, interval in seconds to indicate maximum
         time-to-live value.
@@ -122,6 +174,22 @@ class MongoCacheBackend(api.CacheBackend):
             be available during a regeneration, forcing all threads to wait for
             a regeneration each time a value expires.
 
+    :param bulk_write_size: integer, the maximum number of documents written
+        by a single bulk write of ``set_multi``, larger mappings being
+        written in several batches. By default the size is 1000.
+
+    :param storage_format: string, the format of the cached values in the
+        documents. ``document``, the default, stores their payload and
+        metadata as BSON sub-documents in the ``value`` and ``meta`` fields.
+        ``blob`` stores the value pickled in the binary ``blob`` field,
+        which is written and read without the manipulator walking the
+        payload, the ``son_manipulator`` being then unused. The values
+        stored in another format are not found.
+
+    :param blob_compression: boolean, if True the blobs are compressed with
+        zlib. Default is `False`. Used only when ``storage_format`` is
+        ``blob``.
+
     :param ssl: boolean, If True, create the connection to the server
         using SSL. Default is `False`. Client SSL connection parameters depends
         on server side SSL setup. For further reference on SSL configuration:
@@ -149,8 +217,10 @@ class MongoCacheBackend(api.CacheBackend):
         must point to a file of CA certificates. Used only when `ssl`
         is `True`.
 
-    Rest of arguments are passed to mongo calls for read, write and remove.
-    So related options can be specified to pass to these operations.
+    Rest of arguments are passed to mongo calls for read. The write concern
+    arguments ``w``, ``wtimeout``, ``j`` and ``fsync`` are applied to the
+    writes and removals. Arguments of the calls removed from pymongo, such
+    as ``continue_on_error``, are ignored.
 
     Further details of various supported arguments can be referred from
     <http://api.mongodb.org/python/current/api/pymongo/>
@@ -211,6 +281,18 @@ class MongoCacheBackend(api.CacheBackend):
     def delete_multi(self, keys):
         self.client.delete_multi(keys)
 
+    def warm_up(self):
+        """Connect to MongoDB before the first request.
+
+        Prefork servers can call it in each worker once forked, so that the
+        first request does not pay the connection cost.
+        """
+        self.client.warm_up()
+
+    def close(self):
+        """Close the MongoDB client, shared with the regions using it."""
+        self.api.close()
+
 
 class MongoApi(object):
     """Class handling MongoDB specific functionality.
@@ -223,16 +305,23 @@ class MongoApi(object):
 
     In a single deployment, multiple cache configuration can be defined. In
     that case of multiple cache collections usage, db client connection pool
-    is shared when cache collections are within same database.
+    is shared when cache collections are within same database and use the
+    same connection arguments.
+
+    The clients are not shared with the forked processes, which create their
+    own clients when they first use them.
     """
 
     # class level attributes for re-use of db client connection and collection
-    _DB = {}  # dict of db_name: db connection reference
-    _MONGO_COLLS = {}  # dict of cache_collection : db collection reference
+    _DB = {}  # dict of db key: db connection reference
+    _MONGO_COLLS = {}  # dict of (db key, cache_collection) : db collection
+    _LOCK = threading.Lock()
+    _PID = os.getpid()  # process which created the clients
 
     def __init__(self, arguments):
         self._init_args(arguments)
         self._data_manipulator = None
+        self._db_key = self._get_db_key()
 
     def _init_args(self, arguments):
         """Helper logic for collecting and parsing MongoDB specific arguments.
@@ -260,7 +349,29 @@ class MongoApi(object):
 
         self.username = arguments.pop('username', None)
         self.password = arguments.pop('password', None)
-        self.max_pool_size = arguments.pop('max_pool_size', 10)
+        arguments.setdefault('max_pool_size', 10)
+        for arg, option in _POOL_ARGS.items():
+            value = arguments.pop(arg, None)
+            if value is None:
+                continue
+            try:
+                self.conn_kwargs[option] = int(value)
+            except ValueError:
+                msg = _('integer value expected for %s') % arg
+                raise exception.ConfigurationError(msg)
+        self.max_pool_size = self.conn_kwargs['maxPoolSize']
+
+        compressors = arguments.pop('compressors', None)
+        if compressors:
+            self.conn_kwargs['compressors'] = compressors
+        zlib_compression_level = arguments.pop('zlib_compression_level', None)
+        if zlib_compression_level is not None:
+            try:
+                self.conn_kwargs['zlibCompressionLevel'] = int(
+                    zlib_compression_level)
+            except ValueError:
+                msg = _('integer value expected for zlib_compression_level')
+                raise exception.ConfigurationError(msg)
 
         self.w = arguments.pop('w', -1)
         try:
@@ -270,6 +381,10 @@ class MongoApi(object):
             raise exception.ConfigurationError(msg)
 
         self.read_preference = arguments.pop('read_preference', None)
+        # NOTE: read_preference is replaced by the mode once pymongo is
+        # loaded, the name is kept to create the collection again, as after
+        # a fork or close().
+        self._read_preference_name = self.read_preference
 
         self.use_replica = arguments.pop('use_replica', False)
         if self.use_replica:
@@ -280,6 +395,24 @@ class MongoApi(object):
 
         self.son_manipulator = arguments.pop('son_manipulator', None)
 
+        self.storage_format = arguments.pop('storage_format', 'document')
+        if self.storage_format not in _PROJECTIONS:
+            msg = (_('Invalid storage_format value of %s, must be one of '
+                     '"document", "blob"') % self.storage_format)
+            raise exception.ConfigurationError(msg)
+        self.blob_compression = strutils.bool_from_string(
+            arguments.pop('blob_compression', False))
+
+        self.bulk_write_size = arguments.pop('bulk_write_size', 1000)
+        try:
+            self.bulk_write_size = int(self.bulk_write_size)
+        except ValueError:
+            msg = _('integer value expected for bulk_write_size')
+            raise exception.ConfigurationError(msg)
+        if self.bulk_write_size < 1:
+            msg = _('bulk_write_size must be greater than 0')
+            raise exception.ConfigurationError(msg)
+
         # set if mongo collection needs to be TTL type.
         # This needs to be max ttl for any cache entry.
         # By default, -1 means don't use TTL collection.
@@ -298,18 +431,32 @@ class MongoApi(object):
             ssl_certfile = arguments.pop('ssl_certfile', None)
             ssl_ca_certs = arguments.pop('ssl_ca_certs', None)
             ssl_cert_reqs = arguments.pop('ssl_cert_reqs', None)
-            if ssl_keyfile:
-                self.conn_kwargs['ssl_keyfile'] = ssl_keyfile
-            if ssl_certfile:
-                self.conn_kwargs['ssl_certfile'] = ssl_certfile
+            # the certificate file holds the private key when both are
+            # included
+            if ssl_certfile or ssl_keyfile:
+                self.conn_kwargs['tlsCertificateKeyFile'] = (
+                    ssl_certfile or ssl_keyfile)
             if ssl_ca_certs:
-                self.conn_kwargs['ssl_ca_certs'] = ssl_ca_certs
+                self.conn_kwargs['tlsCAFile'] = ssl_ca_certs
             if ssl_cert_reqs:
-                self.conn_kwargs['ssl_cert_reqs'] = (
-                    self._ssl_cert_req_type(ssl_cert_reqs))
+                import ssl
+                self.conn_kwargs['tlsAllowInvalidCertificates'] = (
+                    self._ssl_cert_req_type(ssl_cert_reqs) == ssl.CERT_NONE)
 
         # rest of arguments are passed to mongo crud calls
         self.meth_kwargs = arguments
+        self.write_concern = {arg: arguments[arg]
+                              for arg in _WRITE_CONCERN_ARGS
+                              if arg in arguments}
+        if self.w > -1:
+            self.write_concern['w'] = self.w
+        removed = sorted(arg for arg in _REMOVED_ARGS if arg in arguments)
+        if removed:
+            LOG.warning('The %s arguments of the MongoDB backend are ignored',
+                        ', '.join(removed))
+        self.find_kwargs = {arg: value for arg, value in arguments.items()
+                            if arg not in _WRITE_CONCERN_ARGS and
+                            arg not in _REMOVED_ARGS}
 
     def _ssl_cert_req_type(self, req_type):
         try:
@@ -332,22 +479,23 @@ class MongoApi(object):
         # defer imports until backend is used
         global pymongo
         import pymongo
+        kwargs = dict(self.conn_kwargs)
         if self.use_replica:
-            connection = pymongo.MongoReplicaSetClient(
-                host=self.hosts, replicaSet=self.replicaset_name,
-                max_pool_size=self.max_pool_size, **self.conn_kwargs)
-        else:  # used for standalone node or mongos in sharded setup
-            connection = pymongo.MongoClient(
-                host=self.hosts, max_pool_size=self.max_pool_size,
-                **self.conn_kwargs)
-
-        database = getattr(connection, self.db_name)
-
-        self._assign_data_mainpulator()
-        database.add_son_manipulator(self._data_manipulator)
+            kwargs['replicaSet'] = self.replicaset_name
+        # else used for standalone node or mongos in sharded setup
         if self.username and self.password:
-            database.authenticate(self.username, self.password)
-        return database
+            kwargs.update(username=self.username, password=self.password,
+                          authSource=self.db_name)
+        connection = pymongo.MongoClient(host=self.hosts, **kwargs)
+        return connection[self.db_name]
+
+    def _get_db_key(self):
+        """Key of the client of the database in the class level cache."""
+        hosts = self.hosts
+        if isinstance(hosts, list):
+            hosts = tuple(hosts)
+        return (hosts, self.db_name, self.username,
+                tuple(sorted(self.conn_kwargs.items())))
 
     def _assign_data_mainpulator(self):
         if self._data_manipulator is None:
@@ -365,36 +513,81 @@ class MongoApi(object):
             doc_date = timeutils.utcnow()
         return doc_date
 
+    @classmethod
+    def _check_pid(cls):
+        """Forget the clients of the parent process in a forked process.
+
+        The clients are not closed, as their sockets are shared with the
+        parent process, and new clients are created when first used.
+        """
+        pid = os.getpid()
+        if pid != cls._PID:
+            # NOTE: a thread of the parent may have held the lock.
+            cls._LOCK = threading.Lock()
+            cls._DB.clear()
+            cls._MONGO_COLLS.clear()
+            cls._PID = pid
+
     def get_cache_collection(self):
-        if self.cache_collection not in self._MONGO_COLLS:
-            global pymongo
-            import pymongo
-            # re-use db client connection if already defined as part of
-            # earlier dogpile cache configuration
-            if self.db_name not in self._DB:
-                self._DB[self.db_name] = self._get_db()
-            coll = getattr(self._DB[self.db_name], self.cache_collection)
-
-            self._assign_data_mainpulator()
-            if self.read_preference:
-                # pymongo 3.0 renamed mongos_enum to read_pref_mode_from_name
-                f = getattr(pymongo.read_preferences,
-                            'read_pref_mode_from_name', None)
-                if not f:
-                    f = pymongo.read_preferences.mongos_enum
-                self.read_preference = f(self.read_preference)
-                coll.read_preference = self.read_preference
-            if self.w > -1:
-                coll.write_concern['w'] = self.w
-            if self.ttl_seconds > 0:
-                kwargs = {'expireAfterSeconds': self.ttl_seconds}
-                coll.ensure_index('doc_date', cache_for=5, **kwargs)
-            else:
-                self._validate_ttl_index(coll, self.cache_collection,
-                                         self.ttl_seconds)
-            self._MONGO_COLLS[self.cache_collection] = coll
+        self._check_pid()
+        # NOTE: the collection may have been created by another instance
+        # using the same client and collection.
+        self._assign_data_mainpulator()
+        coll_key = (self._db_key, self.cache_collection)
+        coll = self._MONGO_COLLS.get(coll_key)
+        if coll is None:
+            with self._LOCK:
+                coll = self._MONGO_COLLS.get(coll_key)
+                if coll is None:
+                    coll = self._MONGO_COLLS[coll_key] = (
+                        self._get_cache_collection())
+        return coll
+
+    def _get_cache_collection(self):
+        global pymongo
+        import pymongo
+        # re-use db client connection if already defined as part of
+        # earlier dogpile cache configuration
+        if self._db_key not in self._DB:
+            self._DB[self._db_key] = self._get_db()
+        coll = self._DB[self._db_key][self.cache_collection]
 
-        return self._MONGO_COLLS[self.cache_collection]
+        self._assign_data_mainpulator()
+        options = {}
+        if self._read_preference_name:
+            self.read_preference = (
+                pymongo.read_preferences.read_pref_mode_from_name(
+                    self._read_preference_name))
+            options['read_preference'] = (
+                pymongo.read_preferences.make_read_preference(
+                    self.read_preference, None))
+        if self.write_concern:
+            options['write_concern'] = pymongo.WriteConcern(
+                **self.write_concern)
+        if options:
+            coll = coll.with_options(**options)
+        if self.ttl_seconds > 0:
+            coll.create_index('doc_date',
+                              expireAfterSeconds=self.ttl_seconds)
+        else:
+            self._validate_ttl_index(coll, self.cache_collection,
+                                     self.ttl_seconds)
+        return coll
+
+    def warm_up(self):
+        """Create the client and open a connection of its pool."""
+        self.get_cache_collection().database.client.admin.command('ping')
+
+    def close(self):
+        """Close the client and forget the collections using it."""
+        self._check_pid()
+        with self._LOCK:
+            database = self._DB.pop(self._db_key, None)
+            for coll_key in list(self._MONGO_COLLS):
+                if coll_key[0] == self._db_key:
+                    del self._MONGO_COLLS[coll_key]
+        if database is not None:
+            database.client.close()
 
     def _get_cache_entry(self, key, value, meta, doc_date):
         """MongoDB cache data representation.
@@ -428,71 +621,125 @@ class MongoApi(object):
                     LOG.warning(msg, {'c_name': coll_name,
                                       'indx_name': indx_name})
 
+    def _lean_reads(self):
+        """Tell whether the documents can be read without the manipulator.
+
+        The default manipulator only builds the cached values, which is done
+        from the ``value`` and ``meta`` fields of the documents without
+        walking the payloads, or from their blob. Custom manipulators read
+        whole documents, unless the values are stored as blobs.
+        """
+        return (self.storage_format == 'blob' or
+                type(self._data_manipulator) is BaseTransform)
+
+    def _get_document(self, key, value, doc_date):
+        """Build the document storing a cached value."""
+        if self.storage_format == 'blob':
+            blob = pickle.dumps((value.payload, value.metadata),
+                                pickle.HIGHEST_PROTOCOL)
+            if self.blob_compression:
+                blob = _BLOB_COMPRESSED + zlib.compress(blob)
+            else:
+                blob = _BLOB_PICKLED + blob
+            return dict(_id=key, blob=blob, doc_date=doc_date)
+        ref = self._get_cache_entry(key, value.payload, value.metadata,
+                                    doc_date)
+        # pymongo does not have manipulator support so need to do
+        # conversion as part of input document
+        return self._data_manipulator.transform_incoming(ref, self)
+
+    def _get_cached_value(self, doc):
+        """Build the cached value of a document read without manipulator.
+
+        :returns: the value, or None if it is stored in another format.
+        """
+        if self.storage_format == 'blob':
+            blob = doc.get('blob')
+            if blob is None:
+                return None
+            blob = bytes(blob)
+            if blob[:1] == _BLOB_COMPRESSED:
+                blob = zlib.decompress(blob[1:])
+            else:
+                blob = blob[1:]
+            return api.CachedValue(*pickle.loads(blob))  # nosec
+        if 'meta' not in doc:
+            return None
+        return api.CachedValue(doc['value'], doc['meta'])
+
     def get(self, key):
         criteria = {'_id': key}
-        result = self.get_cache_collection().find_one(spec_or_id=criteria,
-                                                      **self.meth_kwargs)
+        collection = self.get_cache_collection()
+        if self._lean_reads():
+            projection = dict(_PROJECTIONS[self.storage_format], _id=False)
+            result = collection.find_one(criteria, projection=projection,
+                                         **self.find_kwargs)
+            if result:
+                return self._get_cached_value(result)
+            return None
+        result = collection.find_one(criteria, **self.find_kwargs)
         if result:
+            result = self._data_manipulator.transform_outgoing(result, self)
             return result['value']
         else:
             return None
 
     def get_multi(self, keys):
+        collection = self.get_cache_collection()
+        if self._lean_reads():
+            criteria = {'_id': {'$in': keys}}
+            db_results = collection.find(
+                criteria, projection=_PROJECTIONS[self.storage_format],
+                **self.find_kwargs)
+            values = {}
+            for doc in db_results:
+                value = self._get_cached_value(doc)
+                if value is not None:
+                    values[doc['_id']] = value
+            return values
         db_results = self._get_results_as_dict(keys)
         return {doc['_id']: doc['value'] for doc in six.itervalues(db_results)}
 
     def _get_results_as_dict(self, keys):
         criteria = {'_id': {'$in': keys}}
-        db_results = self.get_cache_collection().find(spec=criteria,
-                                                      **self.meth_kwargs)
-        return {doc['_id']: doc for doc in db_results}
+        db_results = self.get_cache_collection().find(criteria,
+                                                      **self.find_kwargs)
+        return {doc['_id']: self._data_manipulator.transform_outgoing(doc,
+                                                                      self)
+                for doc in db_results}
 
     def set(self, key, value):
-        doc_date = self._get_doc_date()
-        ref = self._get_cache_entry(key, value.payload, value.metadata,
-                                    doc_date)
+        ref = self._get_document(key, value, self._get_doc_date())
         spec = {'_id': key}
-        # find and modify does not have manipulator support
-        # so need to do conversion as part of input document
-        ref = self._data_manipulator.transform_incoming(ref, self)
-        self.get_cache_collection().find_and_modify(spec, ref, upsert=True,
-                                                    **self.meth_kwargs)
+        self.get_cache_collection().replace_one(spec, ref, upsert=True)
 
     def set_multi(self, mapping):
-        """Insert multiple documents specified as key, value pairs.
+        """Upsert multiple documents specified as key, value pairs.
 
-        In this case, multiple documents can be added via insert provided they
-        do not exist.
-        Update of multiple existing documents is done one by one
+        The documents are replaced, or inserted if they do not exist, by
+        unordered bulk writes of at most ``bulk_write_size`` documents, which
+        take a single round trip each.
         """
         doc_date = self._get_doc_date()
-        insert_refs = []
-        update_refs = []
-        existing_docs = self._get_results_as_dict(list(mapping.keys()))
+        collection = self.get_cache_collection()
+        requests = []
         for key, value in mapping.items():
-            ref = self._get_cache_entry(key, value.payload, value.metadata,
-                                        doc_date)
-            if key in existing_docs:
-                ref['_id'] = existing_docs[key]['_id']
-                update_refs.append(ref)
-            else:
-                insert_refs.append(ref)
-        if insert_refs:
-            self.get_cache_collection().insert(insert_refs, manipulate=True,
-                                               **self.meth_kwargs)
-        for upd_doc in update_refs:
-            self.get_cache_collection().save(upd_doc, manipulate=True,
-                                             **self.meth_kwargs)
+            ref = self._get_document(key, value, doc_date)
+            requests.append(pymongo.ReplaceOne({'_id': key}, ref,
+                                               upsert=True))
+            if len(requests) == self.bulk_write_size:
+                collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            collection.bulk_write(requests, ordered=False)
 
     def delete(self, key):
         criteria = {'_id': key}
-        self.get_cache_collection().remove(spec_or_id=criteria,
-                                           **self.meth_kwargs)
+        self.get_cache_collection().delete_one(criteria)
 
     def delete_multi(self, keys):
         criteria = {'_id': {'$in': keys}}
-        self.get_cache_collection().remove(spec_or_id=criteria,
-                                           **self.meth_kwargs)
+        self.get_cache_collection().delete_many(criteria)
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -547,8 +794,7 @@ class BaseTransform(AbstractManipulator):
     i.e. dogpile.cache.api.CachedValue
 
     Note: Custom manipulator needs to always override ``transform_incoming``
-    and ``transform_outgoing`` methods. MongoDB manipulator logic specifically
-    checks that overridden method in instance and its super are different.
+    and ``transform_outgoing`` methods.
     """
 
     def transform_incoming(self, son, collection):
@@ -0,0 +1,326 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""dogpile.cache backend that uses a memory mapped file for storage"""
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+
+from dogpile.cache import api
+from dogpile import util
+from oslo_cache._i18n import _
+from oslo_cache import core
+from oslo_cache import exception
+from oslo_log import log
+from oslo_utils import timeutils
+
+__all__ = [
+    'SharedMemoryCacheBackend',
+]
+
+LOG = log.getLogger(__name__)
+
+_NO_VALUE = core.NO_VALUE
+
+_MAGIC = b'OSLOSHM1'
+
+# Magic, number of slots and size of a slot.
+_HEADER = struct.Struct('<8sII')
+
+# Hash of the key, 0 for an empty slot, expiration and last use timestamps,
+# 0 for no expiration, length of the key and length of the value. The key
+# and the value follow.
+_SLOT_HEADER = struct.Struct('<QddHI')
+
+_MAX_KEY_LENGTH = 0xffff
+
+# Number of slots a key can be stored in. They are contiguous, so that they
+# are locked together.
+_WAYS = 4
+
+# NOTE: the file locks are owned by the process, they do not exclude its
+# threads from each other, including the ones of backends using the same
+# file. The locks of the files are garbage collected once no backend uses
+# them.
+_file_locks = util.NameRegistry(lambda file_id: threading.Lock())
+
+
+class SharedMemoryCacheBackend(api.CacheBackend):
+    """A cache backend shared by the processes of a host.
+
+    The keys and the pickled values are stored in a hash table of fixed
+    size slots in a memory mapped file. Every key can be stored in one of
+    :data:`_WAYS` slots chosen by its hash, the least recently used of which
+    is evicted when they are all used.
+
+    Arguments accepted in the arguments dictionary:
+
+    :param path: path of the file, created if it does not exist. The
+        processes sharing the cache use the same path, preferably on a
+        memory file system such as ``/dev/shm``. Required.
+    :type path: str
+    :param slots: number of slots, rounded up to a multiple of
+        :data:`_WAYS`. Default is 1024.
+    :type slots: int
+    :param slot_size: size in bytes of a slot, the keys and values which do
+        not fit in a slot are not cached. Default is 4096.
+    :type slot_size: int
+    :param expiration_time: interval in seconds to indicate maximum
+        time-to-live value for each key. Default is 0, keys never expire.
+    :type expiration_time: real
+
+    The processes sharing the file must use the same ``slots`` and
+    ``slot_size``. The file is created readable and writable by its owner
+    only: the values are unpickled, so the processes sharing it must trust
+    each other. An existing file is only used if it is owned by the user of
+    the process and not writable by the others, and ``path`` must not be a
+    symbolic link, so that another user cannot create the file in a shared
+    directory such as ``/dev/shm`` beforehand.
+    """
+
+    def __init__(self, arguments):
+        self.path = arguments.get('path')
+        if not self.path:
+            raise exception.ConfigurationError(
+                _('The path of the shared memory cache is required'))
+        self.slot_size = int(arguments.get('slot_size', 4096))
+        if self.slot_size <= _SLOT_HEADER.size:
+            raise exception.ConfigurationError(
+                _('The slot size must be greater than %s') %
+                _SLOT_HEADER.size)
+        slots = int(arguments.get('slots', 1024))
+        if slots < 1:
+            raise exception.ConfigurationError(
+                _('The number of slots must be positive: %s') % slots)
+        self.sets = -(-slots // _WAYS)
+        self.slots = self.sets * _WAYS
+        self.expiration_time = float(arguments.get('expiration_time', 0))
+        try:
+            self._fd = os.open(self.path,
+                               os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            raise exception.ConfigurationError(
+                _('Cannot open the shared memory cache %(path)s: %(error)s')
+                % {'path': self.path, 'error': e})
+        try:
+            file_stat = os.fstat(self._fd)
+            self._check_owner(file_stat)
+            self._lock = _file_locks.get((file_stat.st_dev,
+                                          file_stat.st_ino))
+            size = self._initialize()
+            self._mmap = mmap.mmap(self._fd, size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _check_owner(self, file_stat):
+        """Checks that only the user of the process can write the file."""
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise exception.ConfigurationError(
+                _('%s is not a regular file') % self.path)
+        if file_stat.st_uid != os.geteuid():
+            raise exception.ConfigurationError(
+                _('%(path)s is owned by the user %(uid)s') %
+                {'path': self.path, 'uid': file_stat.st_uid})
+        if file_stat.st_mode & 0o022:
+            raise exception.ConfigurationError(
+                _('%(path)s is writable by other users, its mode is %(mode)o')
+                % {'path': self.path, 'mode': stat.S_IMODE(file_stat.st_mode)})
+
+    def _initialize(self):
+        """Writes the header of a new file or checks the existing one."""
+        size = _HEADER.size + self.slots * self.slot_size
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(self._fd, _HEADER.size, 0)
+                # NOTE: a process may have stopped between sizing the file
+                # and writing its header.
+                if not header.strip(b'\0'):
+                    os.ftruncate(self._fd, size)
+                    os.pwrite(self._fd, _HEADER.pack(_MAGIC, self.slots,
+                                                     self.slot_size), 0)
+                    return size
+                if len(header) < _HEADER.size:
+                    magic = None
+                else:
+                    magic, slots, slot_size = _HEADER.unpack(header)
+                if magic != _MAGIC:
+                    raise exception.ConfigurationError(
+                        _('%s is not a shared memory cache') % self.path)
+                if (slots, slot_size) != (self.slots, self.slot_size):
+                    raise exception.ConfigurationError(
+                        _('%(path)s has %(slots)s slots of %(slot_size)s '
+                          'bytes') % {'path': self.path, 'slots': slots,
+                                      'slot_size': slot_size})
+                return size
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _locked(self, index):
+        """Locks the slots of a set against other threads and processes."""
+        length = _WAYS * self.slot_size
+        start = _HEADER.size + index * length
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield start
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _find(self, start, key_hash, key):
+        """Returns the offset of the slot of a key in a locked set."""
+        for way in range(_WAYS):
+            offset = start + way * self.slot_size
+            slot_hash, _expires, _used, key_length, _value_length = (
+                _SLOT_HEADER.unpack_from(self._mmap, offset))
+            if slot_hash != key_hash or key_length != len(key):
+                continue
+            key_offset = offset + _SLOT_HEADER.size
+            if self._mmap[key_offset:key_offset + key_length] == key:
+                return offset
+        return None
+
+    def get(self, key):
+        """Retrieves the value for a key.
+
+        :param key: key
+        :returns: value for a key or :data:`oslo_cache.core.NO_VALUE`
+            for nonexistent or expired keys.
+        """
+        key_hash, key = _hash(key)
+        now = timeutils.utcnow_ts(microsecond=True)
+        with self._locked(key_hash % self.sets) as start:
+            offset = self._find(start, key_hash, key)
+            if offset is None:
+                return _NO_VALUE
+            _key_hash, expires, _used, key_length, value_length = (
+                _SLOT_HEADER.unpack_from(self._mmap, offset))
+            if expires and now >= expires:
+                _clear_slot(self._mmap, offset)
+                return _NO_VALUE
+            _SLOT_HEADER.pack_into(self._mmap, offset, key_hash, expires,
+                                   now, key_length, value_length)
+            value_offset = offset + _SLOT_HEADER.size + key_length
+            value = self._mmap[value_offset:value_offset + value_length]
+        # NOTE: the file is only writable by the user of the process, see
+        # _check_owner().
+        return pickle.loads(value)  # nosec
+
+    def get_multi(self, keys):
+        """Retrieves the value for a list of keys."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        """Sets the value for a key.
+
+        Evicts the least recently used key stored in the same slots if they
+        are all used.
+
+        :param key: key
+        :param value: value associated with the key
+        """
+        key_hash, key = _hash(key)
+        try:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            LOG.debug('Not caching an unpicklable value: %s', e)
+            value = None
+        if value is not None and (
+                len(key) > _MAX_KEY_LENGTH or
+                _SLOT_HEADER.size + len(key) + len(value) > self.slot_size):
+            LOG.debug('Not caching a value of %d bytes', len(value))
+            value = None
+        now = timeutils.utcnow_ts(microsecond=True)
+        expires = 0
+        if self.expiration_time > 0:
+            expires = now + self.expiration_time
+        with self._locked(key_hash % self.sets) as start:
+            offset = self._find(start, key_hash, key)
+            if value is None:
+                # NOTE: the previous value of the key must not be returned.
+                if offset is not None:
+                    _clear_slot(self._mmap, offset)
+                return
+            if offset is None:
+                offset = self._choose(start, now)
+            _SLOT_HEADER.pack_into(self._mmap, offset, key_hash, expires,
+                                   now, len(key), len(value))
+            key_offset = offset + _SLOT_HEADER.size
+            value_offset = key_offset + len(key)
+            self._mmap[key_offset:value_offset] = key
+            self._mmap[value_offset:value_offset + len(value)] = value
+
+    def _choose(self, start, now):
+        """Returns the offset of a slot for a new key in a locked set.
+
+        The first empty or expired slot is chosen, otherwise the least
+        recently used one.
+        """
+        chosen = None
+        for way in range(_WAYS):
+            offset = start + way * self.slot_size
+            slot_hash, expires, used, _key_length, _value_length = (
+                _SLOT_HEADER.unpack_from(self._mmap, offset))
+            if not slot_hash or (expires and now >= expires):
+                return offset
+            if chosen is None or used < chosen[0]:
+                chosen = (used, offset)
+        return chosen[1]
+
+    def set_multi(self, mapping):
+        """Set multiple values in the cache."""
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        """Deletes the value associated with the key if it exists.
+
+        :param key: key
+        """
+        key_hash, key = _hash(key)
+        with self._locked(key_hash % self.sets) as start:
+            offset = self._find(start, key_hash, key)
+            if offset is not None:
+                _clear_slot(self._mmap, offset)
+
+    def delete_multi(self, keys):
+        """Deletes the value associated with each key in list if it exists.
+
+        :param keys: list of keys
+        """
+        for key in keys:
+            self.delete(key)
+
+
+def _hash(key):
+    """Returns the hash, the same in every process, and the bytes of a key.
+
+    The hash is never 0, which marks the empty slots.
+    """
+    if not isinstance(key, bytes):
+        key = str(key).encode('utf-8')
+    key_hash = int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), 'little')
+    return key_hash or 1, key
+
+
+def _clear_slot(mm, offset):
+    _SLOT_HEADER.pack_into(mm, offset, 0, 0, 0, 0, 0)
@@ -35,15 +35,23 @@ The library has special public value for nonexistent or expired keys called
     NO_VALUE = core.NO_VALUE
 """
 
+import hashlib
+import time
+
 import dogpile.cache
 from dogpile.cache import api
 from dogpile.cache import proxy
 from dogpile.cache import util
+from dogpile.util import compat
 from oslo_log import log
 from oslo_utils import importutils
 
 from oslo_cache._i18n import _
+from oslo_cache import _local_cache
 from oslo_cache import _opts
+from oslo_cache import _refresh
+from oslo_cache import _single_flight
+from oslo_cache import _stats
 from oslo_cache import exception
 
 
@@ -51,6 +59,7 @@ __all__ = [
     'configure',
     'configure_cache_region',
     'create_region',
+    'get_cache_stats',
     'get_memoization_decorator',
     'NO_VALUE',
 ]
@@ -99,6 +108,138 @@ class _DebugProxy(proxy.ProxyBackend):
         self.proxied.delete_multi(keys)
 
 
+class _StatsProxy(proxy.ProxyBackend):
+    """ProxyBackend counting the cache operations.
+
+    It is cheap enough to be always enabled: every operation costs a couple
+    of clock reads and a few short critical sections, see
+    ``tools/benchmarks/stats_proxy.py``.
+    """
+
+    def __init__(self):
+        super(_StatsProxy, self).__init__()
+        self.stats = _stats.CacheStats()
+        self.emitter = None
+
+    def _get(self, method, key):
+        start = time.monotonic()
+        value = method(key)
+        seconds = time.monotonic() - start
+        if value is NO_VALUE:
+            self.stats.record_get(seconds, (), 1)
+        else:
+            self.stats.record_get(seconds, (value,), 0)
+        return value
+
+    def _get_multi(self, method, keys):
+        start = time.monotonic()
+        values = method(keys)
+        seconds = time.monotonic() - start
+        found = [value for value in values if value is not NO_VALUE]
+        self.stats.record_get(seconds, found, len(values) - len(found))
+        return values
+
+    def _set(self, method, key, value):
+        start = time.monotonic()
+        method(key, value)
+        self.stats.record_set(time.monotonic() - start, (value,))
+
+    def _set_multi(self, method, mapping):
+        start = time.monotonic()
+        method(mapping)
+        self.stats.record_set(time.monotonic() - start, mapping.values())
+
+    def get(self, key):
+        return self._get(self.proxied.get, key)
+
+    def get_serialized(self, key):
+        return self._get(self.proxied.get_serialized, key)
+
+    def get_multi(self, keys):
+        return self._get_multi(self.proxied.get_multi, keys)
+
+    def get_serialized_multi(self, keys):
+        return self._get_multi(self.proxied.get_serialized_multi, keys)
+
+    def set(self, key, value):
+        self._set(self.proxied.set, key, value)
+
+    def set_serialized(self, key, value):
+        self._set(self.proxied.set_serialized, key, value)
+
+    def set_multi(self, mapping):
+        self._set_multi(self.proxied.set_multi, mapping)
+
+    def set_serialized_multi(self, mapping):
+        self._set_multi(self.proxied.set_serialized_multi, mapping)
+
+    def delete(self, key):
+        start = time.monotonic()
+        self.proxied.delete(key)
+        self.stats.record_delete(time.monotonic() - start, 1)
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        start = time.monotonic()
+        self.proxied.delete_multi(keys)
+        self.stats.record_delete(time.monotonic() - start, len(keys))
+
+
+def _find_proxy(region, proxy_class):
+    backend = region.backend
+    while isinstance(backend, proxy.ProxyBackend):
+        if isinstance(backend, proxy_class):
+            return backend
+        backend = backend.proxied
+    return None
+
+
+def get_cache_stats(region):
+    """Return the statistics of the operations of a cache region.
+
+    They are only collected if ``[cache] stats_enabled`` is set when the
+    region is configured, see :meth:`oslo_cache._stats.CacheStats.snapshot`
+    for their content. When ``[cache] local_cache_enabled`` is set, the
+    statistics of the local and remote tiers are given under ``tiers``, see
+    :meth:`oslo_cache._local_cache.LocalCacheProxy.get_stats`; the other
+    statistics then only count the operations which reach the backend.
+    When ``[cache] single_flight_enabled`` is set, the statistics of the
+    coalescing are given under ``single_flight``, see
+    :meth:`oslo_cache._single_flight.SingleFlightProxy.get_stats`, and the
+    other statistics only count the backend reads which were not coalesced.
+
+    :param region: region configured by :func:`configure_cache_region`.
+    :type region: dogpile.cache.region.CacheRegion
+    :returns: dict, or None if the statistics are not collected.
+    """
+    stats_proxy = _find_proxy(region, _StatsProxy)
+    local_cache_proxy = _find_proxy(region, _local_cache.LocalCacheProxy)
+    single_flight_proxy = _find_proxy(region,
+                                      _single_flight.SingleFlightProxy)
+    if (stats_proxy is None and local_cache_proxy is None and
+            single_flight_proxy is None):
+        return None
+    stats = {}
+    if stats_proxy is not None:
+        stats.update(stats_proxy.stats.snapshot())
+    if local_cache_proxy is not None:
+        stats['tiers'] = local_cache_proxy.get_stats()
+    if single_flight_proxy is not None:
+        stats['single_flight'] = single_flight_proxy.get_stats()
+    return stats
+
+
+def _log_cache_stats(snapshot):
+    _LOG.info('Cache statistics: hits %(hits)d, misses %(misses)d, '
+              'sets %(sets)d, deletes %(deletes)d, by namespace: '
+              '%(namespaces)s', snapshot)
+
+
+# Backends built on dogpile.cache's GenericMemcachedBackend.
+_MEMCACHED_BACKENDS = ('dogpile.cache.memcached', 'dogpile.cache.pylibmc',
+                       'dogpile.cache.bmemcached', 'oslo_cache.memcache_pool')
+
+
 def _build_cache_config(conf):
     """Build the cache region dictionary configuration.
 
@@ -141,9 +282,17 @@ def _build_cache_config(conf):
     conf_dict.setdefault('%s.arguments.url' % prefix,
                          conf.cache.memcache_servers)
     for arg in ('dead_retry', 'socket_timeout', 'pool_maxsize',
-                'pool_unused_timeout', 'pool_connection_get_timeout'):
+                'pool_unused_timeout', 'pool_connection_get_timeout',
+                'pool_min_size', 'pool_reap_interval', 'pool_implementation',
+                'pool_fanout', 'pool_per_server'):
         value = getattr(conf.cache, 'memcache_' + arg)
         conf_dict['%s.arguments.%s' % (prefix, arg)] = value
+    # NOTE: the other backends, such as redis, may accept the same
+    # arguments for their own locks.
+    if conf.cache.backend in _MEMCACHED_BACKENDS:
+        for arg in ('distributed_lock', 'lock_timeout'):
+            value = getattr(conf.cache, 'memcache_' + arg)
+            conf_dict['%s.arguments.%s' % (prefix, arg)] = value
 
     return conf_dict
 
@@ -163,6 +312,105 @@ def _sha1_mangle_key(key):
     return util.sha1_mangle_key(key)
 
 
+def _blake2b_mangle_key(key):
+    """Mangle a key into the hexdigest of its 128-bit BLAKE2b hash.
+
+    It is cheaper to compute than SHA1 and gives shorter keys.
+    """
+    try:
+        key = key.encode('utf-8', errors='xmlcharrefreplace')
+    except (UnicodeError, AttributeError):
+        # NOTE: if encoding fails just continue anyway, as _sha1_mangle_key.
+        pass
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+_KEY_MANGLERS = {
+    'sha1': _sha1_mangle_key,
+    'blake2b': _blake2b_mangle_key,
+}
+
+
+class _MangledKey(str):
+    """Mangled key remembering the key mangled by the fallback mangler."""
+
+    __slots__ = ('fallback_key',)
+
+
+def _fallback_key_mangler(key_mangler, fallback_key_mangler):
+    def mangle_key(key):
+        mangled_key = _MangledKey(key_mangler(key))
+        mangled_key.fallback_key = fallback_key_mangler(key)
+        return mangled_key
+    return mangle_key
+
+
+class _FallbackKeyProxy(proxy.ProxyBackend):
+    """ProxyBackend reading the keys of the fallback key mangler.
+
+    It lets the key mangler of a deployment be changed without flushing its
+    cache: a key missing from the cache is read again as mangled by the
+    previous key mangler and the value found is copied to the new key.
+    Deletes remove both keys, so that an invalidated value is not read back
+    from the previous key.
+    """
+
+    def _get(self, get, set, key):
+        value = get(key)
+        if value is NO_VALUE and isinstance(key, _MangledKey):
+            value = get(key.fallback_key)
+            if value is not NO_VALUE:
+                set(key, value)
+        return value
+
+    def _get_multi(self, get_multi, set_multi, keys):
+        keys = list(keys)
+        values = get_multi(keys)
+        missing = [index for index, (key, value) in enumerate(zip(keys,
+                                                                  values))
+                   if value is NO_VALUE and isinstance(key, _MangledKey)]
+        if missing:
+            found = {}
+            fallback_values = get_multi(
+                [keys[index].fallback_key for index in missing])
+            values = list(values)
+            for index, value in zip(missing, fallback_values):
+                if value is not NO_VALUE:
+                    values[index] = found[keys[index]] = value
+            if found:
+                set_multi(found)
+        return values
+
+    def get(self, key):
+        return self._get(self.proxied.get, self.proxied.set, key)
+
+    def get_serialized(self, key):
+        return self._get(self.proxied.get_serialized,
+                         self.proxied.set_serialized, key)
+
+    def get_multi(self, keys):
+        return self._get_multi(self.proxied.get_multi,
+                               self.proxied.set_multi, keys)
+
+    def get_serialized_multi(self, keys):
+        return self._get_multi(self.proxied.get_serialized_multi,
+                               self.proxied.set_serialized_multi, keys)
+
+    def delete(self, key):
+        if isinstance(key, _MangledKey):
+            self.proxied.delete_multi([key, key.fallback_key])
+        else:
+            self.proxied.delete(key)
+
+    def delete_multi(self, keys):
+        all_keys = []
+        for key in keys:
+            all_keys.append(key)
+            if isinstance(key, _MangledKey):
+                all_keys.append(key.fallback_key)
+        self.proxied.delete_multi(all_keys)
+
+
 def _key_generate_to_str(s):
     # NOTE(morganfainberg): Since we need to stringify all arguments, attempt
     # to stringify and handle the Unicode error explicitly as needed.
@@ -172,15 +420,88 @@ def _key_generate_to_str(s):
         return s.encode('utf-8')
 
 
+def _key_prefix(namespace, fn):
+    # NOTE: same namespace as the key generators of dogpile.cache.
+    if namespace is None:
+        return '%s:%s|' % (fn.__module__, fn.__name__)
+    return '%s:%s|%s|' % (fn.__module__, fn.__name__, namespace)
+
+
+def _join_key_arguments(arguments):
+    # NOTE: str() is what _key_generate_to_str calls, mapping it directly
+    # avoids a Python call per argument.
+    try:
+        return ' '.join(map(str, arguments))
+    except UnicodeEncodeError:
+        return ' '.join(map(_key_generate_to_str, arguments))
+
+
+def _compiled_function_key_generator(namespace, fn):
+    prefix = _key_prefix(namespace, fn)
+    argnames = compat.inspect_getargspec(fn)[0]
+    skip = 1 if argnames and argnames[0] in ('self', 'cls') else 0
+
+    def generate_key(*args, **kw):
+        if kw:
+            raise ValueError(
+                "dogpile.cache's default key creation "
+                "function does not accept keyword arguments.")
+        if skip:
+            args = args[1:]
+        if len(args) == 1 and type(args[0]) is str:
+            return prefix + args[0]
+        return prefix + _join_key_arguments(args)
+
+    return generate_key
+
+
+def _compiled_kwarg_function_key_generator(namespace, fn):
+    prefix = _key_prefix(namespace, fn)
+    argspec = compat.inspect_getargspec(fn)
+    argnames = argspec.args
+    defaults = argspec.defaults or ()
+    args_with_defaults = dict(zip(argnames[len(argnames) - len(defaults):],
+                                  defaults))
+    skip = 1 if argnames and argnames[0] in ('self', 'cls') else 0
+    # Order of the positional arguments in the key when all of them are
+    # passed, which is known once for all.
+    positional_order = sorted(range(skip, len(argnames)),
+                              key=argnames.__getitem__)
+
+    def generate_key(*args, **kwargs):
+        if not kwargs and len(args) == len(argnames):
+            values = [args[index] for index in positional_order]
+        else:
+            if len(args) > len(argnames):
+                # NOTE: same error as dogpile.cache for extra arguments.
+                raise IndexError('list index out of range')
+            # NOTE: the defaults are overridden by the arguments passed.
+            as_kwargs = dict(args_with_defaults)
+            as_kwargs.update(zip(argnames[skip:], args[skip:]))
+            as_kwargs.update(kwargs)
+            values = [as_kwargs[key] for key in sorted(as_kwargs)]
+        return prefix + _join_key_arguments(values)
+
+    return generate_key
+
+
 def function_key_generator(namespace, fn, to_str=_key_generate_to_str):
     # NOTE(morganfainberg): This wraps dogpile.cache's default
     # function_key_generator to change the default to_str mechanism.
+    if to_str is _key_generate_to_str:
+        # The keys are the same as dogpile.cache's, with the namespace
+        # prefix and the handling of self computed once.
+        return _compiled_function_key_generator(namespace, fn)
     return util.function_key_generator(namespace, fn, to_str=to_str)
 
 
 def kwarg_function_key_generator(namespace, fn, to_str=_key_generate_to_str):
     # NOTE(ralonsoh): This wraps dogpile.cache's default
     # kwarg_function_key_generator to change the default to_str mechanism.
+    if to_str is _key_generate_to_str:
+        # The keys are the same as dogpile.cache's, with the arguments
+        # sorted once when they are all passed positionally.
+        return _compiled_kwarg_function_key_generator(namespace, fn)
     return util.kwarg_function_key_generator(namespace, fn, to_str=to_str)
 
 
@@ -237,13 +558,37 @@ def configure_cache_region(conf, region):
         if conf.cache.debug_cache_backend:
             region.wrap(_DebugProxy)
 
+        if conf.cache.stats_enabled:
+            region.wrap(_StatsProxy)
+            if conf.cache.stats_emit_interval:
+                stats_proxy = _find_proxy(region, _StatsProxy)
+                stats_proxy.emitter = _stats.StatsEmitter(
+                    stats_proxy.stats, conf.cache.stats_emit_interval,
+                    _log_cache_stats).start()
+
         # NOTE(morganfainberg): if the backend requests the use of a
         # key_mangler, we should respect that key_mangler function.  If a
-        # key_mangler is not defined by the backend, use the sha1_mangle_key
-        # mangler provided by dogpile.cache. This ensures we always use a fixed
-        # size cache-key.
+        # key_mangler is not defined by the backend, use the configured
+        # mangler, sha1_mangle_key provided by dogpile.cache by default. This
+        # ensures we always use a fixed size cache-key.
         if region.key_mangler is None:
-            region.key_mangler = _sha1_mangle_key
+            key_mangler = _KEY_MANGLERS[conf.cache.key_mangler]
+            fallback = conf.cache.key_mangler_fallback
+            if fallback and fallback != conf.cache.key_mangler:
+                region.key_mangler = _fallback_key_mangler(
+                    key_mangler, _KEY_MANGLERS[fallback])
+                region.wrap(_FallbackKeyProxy)
+            else:
+                region.key_mangler = key_mangler
+
+        if conf.cache.single_flight_enabled:
+            region.wrap(_single_flight.SingleFlightProxy)
+
+        if conf.cache.local_cache_enabled:
+            region.wrap(_local_cache.LocalCacheProxy(
+                conf.cache.local_cache_expiration_time,
+                conf.cache.local_cache_max_entries,
+                conf.cache.local_cache_max_bytes))
 
         for class_path in conf.cache.proxies:
             # NOTE(morganfainberg): if we have any proxy wrappers, we should
@@ -311,7 +656,43 @@ def _get_expiration_time_fn(conf, group):
     return get_expiration_time
 
 
-def get_memoization_decorator(conf, region, group, expiration_group=None):
+def _get_refresh_pool_size_fn(conf, group):
+    """Build a function that returns a config group's refresh pool size.
+
+    The ``cache_refresh_pool_size`` option of the group, if it exists and is
+    set, overrides ``[cache] refresh_pool_size``.
+    """
+    def get_refresh_pool_size():
+        conf_group = getattr(conf, group)
+        size = getattr(conf_group, 'cache_refresh_pool_size', None)
+        return size or conf.cache.refresh_pool_size
+    return get_refresh_pool_size
+
+
+def _get_max_age_fn(conf, group, region, get_expiration_time):
+    """Build a function that returns the maximum age of the values returned.
+
+    It is the expiration time of the values plus the ``cache_max_staleness``
+    option of the group, if it exists and is set, or ``[cache]
+    max_staleness``, or None if there is no limit.
+    """
+    def get_max_age():
+        conf_group = getattr(conf, group)
+        max_staleness = getattr(conf_group, 'cache_max_staleness', None)
+        if max_staleness is None:
+            max_staleness = conf.cache.max_staleness
+        expiration_time = get_expiration_time()
+        if expiration_time is None:
+            expiration_time = region.expiration_time
+        if not max_staleness or expiration_time in (None, -1):
+            return None
+        return expiration_time + max_staleness
+    return get_max_age
+
+
+def get_memoization_decorator(conf, region, group, expiration_group=None,
+                              early_refresh_beta=None,
+                              stale_while_revalidate=False):
     """Build a function based on the `cache_on_arguments` decorator.
 
     The memoization decorator that gets created by this function is a
@@ -358,6 +739,23 @@ def get_memoization_decorator(conf, region, group, expiration_group=None):
                              using ``group`` if the value is unspecified or
                              ``None``
     :type expiration_group: string
+    :param early_refresh_beta: if set, the values are regenerated before they
+                               expire with a probability growing as their
+                               expiration approaches and with the time
+                               their last regeneration took, so that the
+                               regenerations of hot values are spread over
+                               time, see :mod:`oslo_cache._refresh`.
+                               ``1.0`` is the recommended value, greater
+                               values regenerate earlier.
+    :type early_refresh_beta: float
+    :param stale_while_revalidate: if True, the expired values are returned
+                                   at once and regenerated by a pool of
+                                   [`group`] ``cache_refresh_pool_size`` or
+                                   ``[cache] refresh_pool_size`` threads,
+                                   unless they expired for more than
+                                   [`group`] ``cache_max_staleness`` or
+                                   ``[cache] max_staleness`` seconds.
+    :type stale_while_revalidate: bool
     :rtype: function reference
     """
     if expiration_group is None:
@@ -365,14 +763,33 @@ def get_memoization_decorator(conf, region, group, expiration_group=None):
     should_cache = _get_should_cache_fn(conf, group)
     expiration_time = _get_expiration_time_fn(conf, expiration_group)
 
-    memoize = region.cache_on_arguments(should_cache_fn=should_cache,
-                                        expiration_time=expiration_time)
+    cache_on_arguments = region.cache_on_arguments(
+        should_cache_fn=should_cache, expiration_time=expiration_time)
+    refresher = get_max_age = None
+    if stale_while_revalidate:
+        # NOTE: the functions decorated share the pool of the group.
+        refresher = _refresh.Refresher(
+            _get_refresh_pool_size_fn(conf, group), should_cache)
+        get_max_age = _get_max_age_fn(conf, group, region, expiration_time)
+
+    def memoize(fn):
+        # NOTE: decorators are usually built before the configuration is
+        # loaded, so the cache operations are always attributed to the
+        # function for the statistics, at the cost of a thread local update.
+        # The namespace is the one starting the keys of the function.
+        namespace = '%s:%s' % (fn.__module__, fn.__name__)
+        decorated = _refresh.bind(region, cache_on_arguments(fn),
+                                  beta=early_refresh_beta,
+                                  refresher=refresher,
+                                  get_max_age=get_max_age)
+        return _stats.bind_namespace(namespace, decorated)
 
     # Make sure the actual "should_cache" and "expiration_time" methods are
     # available. This is potentially interesting/useful to pre-seed cache
     # values.
     memoize.should_cache = should_cache
     memoize.get_expiration_time = expiration_time
+    memoize.refresher = refresher
 
     return memoize
 
@@ -15,8 +15,10 @@
 
 import copy
 import time
+import uuid
 
 from dogpile.cache import proxy
+from dogpile.cache import util
 import mock
 from oslo_config import cfg
 from oslo_config import fixture as config_fixture
@@ -24,6 +26,7 @@ from oslo_utils import uuidutils
 from oslotest import base
 
 from oslo_cache import _opts
+from oslo_cache import _stats
 from oslo_cache import core as cache
 from oslo_cache import exception
 
@@ -288,6 +291,25 @@ class CacheRegionTest(BaseTestCase):
             _opts._DEFAULT_BACKEND,
             config_dict['test_prefix.backend'])
 
+    def test_cache_dictionary_config_builder_distributed_lock(self):
+        self.config_fixture.config(group='cache',
+                                   config_prefix='test_prefix',
+                                   backend='oslo_cache.memcache_pool',
+                                   memcache_distributed_lock=True,
+                                   memcache_lock_timeout=10)
+
+        config_dict = cache._build_cache_config(self.config_fixture.conf)
+        self.assertTrue(
+            config_dict['test_prefix.arguments.distributed_lock'])
+        self.assertEqual(10, config_dict['test_prefix.arguments.lock_timeout'])
+
+        # The other backends may have their own distributed lock
+        self.config_fixture.config(group='cache',
+                                   backend='dogpile.cache.redis')
+        config_dict = cache._build_cache_config(self.config_fixture.conf)
+        self.assertNotIn('test_prefix.arguments.distributed_lock',
+                         config_dict)
+
     def test_cache_debug_proxy(self):
         single_value = 'Test Value'
         single_key = 'testkey'
@@ -309,6 +331,75 @@ class CacheRegionTest(BaseTestCase):
         for value in self.region.get_multi(multi_values.keys()):
             self.assertEqual(NO_VALUE, value)
 
+    def test_cache_stats_disabled(self):
+        self.assertIsNone(cache.get_cache_stats(self.region))
+
+    def test_cache_stats(self):
+        self.config_fixture.config(group='cache', stats_enabled=True)
+        region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, region)
+
+        region.set('key', 'value')
+        region.get('key')
+        region.get('missing')
+        region.set_multi({'key1': 1, 'key2': 2})
+        region.get_multi(['key1', 'key2', 'key3'])
+        region.delete('key')
+        region.delete_multi(['key1', 'key2'])
+
+        stats = cache.get_cache_stats(region)
+        self.assertEqual(3, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertEqual(3, stats['sets'])
+        self.assertEqual(3, stats['deletes'])
+        self.assertEqual({'hits': 3, 'misses': 2, 'sets': 3, 'deletes': 3},
+                         stats['namespaces'][_stats.NO_NAMESPACE])
+        self.assertEqual(3, stats['latency']['get']['count'])
+        self.assertEqual(2, stats['latency']['set']['count'])
+        self.assertEqual(2, stats['latency']['delete']['count'])
+        self.assertEqual(6, stats['value_size']['count'])
+
+    def test_cache_stats_by_memoized_function(self):
+        self.config_fixture.config(group='cache', stats_enabled=True)
+        region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, region)
+        cacheable_function = self._get_cacheable_function(region=region)
+
+        cacheable_function(1)
+        cacheable_function(1)
+
+        namespace = '%s:cacheable_function' % __name__
+        stats = cache.get_cache_stats(region)
+        # The miss is read again under the dogpile lock before the value is
+        # created.
+        self.assertEqual({'hits': 1, 'misses': 2, 'sets': 1, 'deletes': 0},
+                         stats['namespaces'][namespace])
+        self.assertNotIn(_stats.NO_NAMESPACE, stats['namespaces'])
+        self.assertEqual(_stats.NO_NAMESPACE, _stats.current_namespace())
+
+        # The attributes of the memoized function are still available.
+        cacheable_function.invalidate(1)
+        self.assertEqual(1, cache.get_cache_stats(region)['deletes'])
+
+    def test_cache_stats_emitter(self):
+        self.config_fixture.config(group='cache', stats_enabled=True,
+                                   stats_emit_interval=1)
+        region = cache.create_region()
+        with mock.patch.object(_stats.StatsEmitter, 'start',
+                               autospec=True,
+                               side_effect=lambda emitter: emitter):
+            cache.configure_cache_region(self.config_fixture.conf, region)
+        emitter = cache._find_proxy(region, cache._StatsProxy).emitter
+        self.assertEqual(1, emitter._interval)
+
+        emitted = []
+        emitter._emit = emitted.append
+        emitter._stopped.wait = mock.Mock(side_effect=[False, True])
+        region.get('key')
+        emitter._run()
+        self.assertEqual(1, len(emitted))
+        self.assertEqual(1, emitted[0]['misses'])
+
     def test_configure_non_region_object_raises_error(self):
         self.assertRaises(exception.ConfigurationError,
                           cache.configure_cache_region,
@@ -342,6 +433,92 @@ class CacheRegionTest(BaseTestCase):
         self.assertTrue(cached_value.cached)
 
 
+class KeyGeneratorTests(BaseTestCase):
+
+    ARGUMENTS = [
+        (),
+        ('value',),
+        (u'fäké',),
+        (1,),
+        (uuid.UUID('f0ba4f5c-6e43-4ab6-a9d5-8f4e7e5e3f3e'),),
+        (('a', 1), None),
+        ('value', 2, ['list'], {'dict': True}),
+    ]
+
+    def _assert_same_keys(self, generator, dogpile_generator, fn, calls,
+                          namespace=None):
+        key_generator = generator(namespace, fn)
+        dogpile_key_generator = dogpile_generator(
+            namespace, fn, to_str=cache._key_generate_to_str)
+        for args, kwargs in calls:
+            self.assertEqual(dogpile_key_generator(*args, **kwargs),
+                             key_generator(*args, **kwargs))
+
+    def test_function_key_generator(self):
+        def function(*args):
+            pass
+
+        calls = [(args, {}) for args in self.ARGUMENTS]
+        self._assert_same_keys(cache.function_key_generator,
+                               util.function_key_generator, function, calls)
+        self._assert_same_keys(cache.function_key_generator,
+                               util.function_key_generator, function, calls,
+                               namespace='namespace')
+
+    def test_function_key_generator_method(self):
+        class Manager(object):
+            def method(self, arg1, arg2=None):
+                pass
+
+        calls = [((Manager(), 'value'), {}),
+                 ((Manager(), 'value', 2), {})]
+        self._assert_same_keys(cache.function_key_generator,
+                               util.function_key_generator, Manager.method,
+                               calls)
+
+    def test_function_key_generator_kwargs(self):
+        def function(arg1):
+            pass
+
+        self.assertRaises(ValueError,
+                          cache.function_key_generator(None, function),
+                          arg1='value')
+
+    def test_kwarg_function_key_generator(self):
+        class Manager(object):
+            def method(self, zeta, alpha, beta=2, gamma=None):
+                pass
+
+        manager = Manager()
+        calls = [((manager, 'z', 'a'), {}),
+                 ((manager, 'z', 'a', 3, u'fäké'), {}),
+                 ((manager, 'z'), {'alpha': 'a'}),
+                 ((manager,), {'gamma': (1, 2), 'zeta': 'z', 'alpha': 'a'})]
+        self._assert_same_keys(cache.kwarg_function_key_generator,
+                               util.kwarg_function_key_generator,
+                               Manager.method, calls)
+
+        def function(zeta, alpha=1, **kwargs):
+            pass
+
+        calls = [(('z', 2), {}), (('z',), {}), (('z',), {'extra': 1})]
+        self._assert_same_keys(cache.kwarg_function_key_generator,
+                               util.kwarg_function_key_generator, function,
+                               calls, namespace='namespace')
+        self.assertRaises(IndexError,
+                          cache.kwarg_function_key_generator(None, function),
+                          'z', 2, 3)
+
+    def test_custom_to_str(self):
+        def function(arg):
+            pass
+
+        key_generator = cache.function_key_generator(None, function,
+                                                     to_str=repr)
+        self.assertEqual('%s:function|%r' % (__name__, 'value'),
+                         key_generator('value'))
+
+
 class UTF8KeyManglerTests(BaseTestCase):
 
     def test_key_is_utf8_encoded(self):
@@ -358,3 +535,60 @@ class UTF8KeyManglerTests(BaseTestCase):
         key = 'fake'
         encoded = cache._sha1_mangle_key(key)
         self.assertIsNotNone(encoded)
+
+    def test_blake2b_key_mangler(self):
+        self.assertEqual(32, len(cache._blake2b_mangle_key(u'fäké1')))
+        self.assertNotEqual(cache._blake2b_mangle_key('fake'),
+                            cache._sha1_mangle_key('fake'))
+        self.assertEqual(
+            cache._blake2b_mangle_key(b'\xcf\x84o\xcf\x81\xce\xbdo\xcf\x82'),
+            cache._blake2b_mangle_key(u'τoρνoς'))
+
+    def test_configured_key_mangler(self):
+        self.config_fixture.config(group='cache', key_mangler='blake2b')
+        region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, region)
+        self.assertIs(cache._blake2b_mangle_key, region.key_mangler)
+
+    def _configure_fallback_region(self):
+        self.config_fixture.config(group='cache', key_mangler='sha1')
+        old_region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, old_region)
+        self.config_fixture.config(group='cache', key_mangler='blake2b',
+                                   key_mangler_fallback='sha1')
+        region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, region)
+        # NOTE: both regions share the backend of the old one, as two
+        # releases share the same memcached servers during a rollout.
+        backend = region.backend
+        while isinstance(backend.proxied, proxy.ProxyBackend):
+            backend = backend.proxied
+        backend.proxied = old_region.backend
+        return old_region, region
+
+    def test_key_mangler_fallback_get(self):
+        old_region, region = self._configure_fallback_region()
+        old_region.set('key', 'value')
+        self.assertEqual('value', region.get('key'))
+        # The value was copied to the new key
+        self.assertEqual(
+            'value',
+            old_region.backend.get(cache._blake2b_mangle_key('key')).payload)
+        self.assertEqual(NO_VALUE, region.get('missing'))
+
+    def test_key_mangler_fallback_get_multi(self):
+        old_region, region = self._configure_fallback_region()
+        old_region.set('key1', 'old value')
+        region.set('key2', 'new value')
+        self.assertEqual(['old value', 'new value', NO_VALUE],
+                         region.get_multi(['key1', 'key2', 'key3']))
+
+    def test_key_mangler_fallback_delete(self):
+        old_region, region = self._configure_fallback_region()
+        old_region.set_multi({'key1': 1, 'key2': 2})
+        region.get('key1')
+        region.delete('key1')
+        region.delete_multi(['key2'])
+        self.assertEqual(NO_VALUE, region.get('key1'))
+        self.assertEqual([NO_VALUE, NO_VALUE],
+                         old_region.get_multi(['key1', 'key2']))
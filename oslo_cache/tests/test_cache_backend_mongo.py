@@ -12,11 +12,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import collections
+import collections.abc
 import copy
 import functools
+import os
 
+from dogpile.cache import api
 from dogpile.cache import region as dp_region
+import mock
 from oslo_utils import uuidutils
 import six
 from six.moves import range
@@ -60,7 +63,6 @@ ks_cache = {
 
 
 COLLECTIONS = {}
-SON_MANIPULATOR = None
 NO_VALUE = core.NO_VALUE
 
 
@@ -109,36 +111,45 @@ class MockCollection(object):
         if name == 'database':
             return self._collection_database
 
-    def ensure_index(self, key_or_list, *args, **kwargs):
+    def create_index(self, keys, **kwargs):
         pass
 
     def index_information(self):
         return {}
 
-    def find_one(self, spec_or_id=None, *args, **kwargs):
-        if spec_or_id is None:
-            spec_or_id = {}
-        if not isinstance(spec_or_id, collections.Mapping):
-            spec_or_id = {'_id': spec_or_id}
+    def find_one(self, filter=None, *args, **kwargs):
+        if filter is None:
+            filter = {}
+        if not isinstance(filter, collections.abc.Mapping):
+            filter = {'_id': filter}
 
         try:
-            return next(self.find(spec_or_id, *args, **kwargs))
+            return next(self.find(filter, *args, **kwargs))
         except StopIteration:
             return None
 
-    def find(self, spec=None, *args, **kwargs):
-        return MockCursor(self, functools.partial(self._get_dataset, spec))
+    def find(self, filter=None, projection=None, **kwargs):
+        return MockCursor(self, functools.partial(
+            self._get_dataset, filter, projection))
 
-    def _get_dataset(self, spec):
+    def _get_dataset(self, spec, projection=None):
         dataset = (self._copy_doc(document, dict) for document in
-                   self._iter_documents(spec))
+                   self._iter_documents(spec, projection))
         return dataset
 
-    def _iter_documents(self, spec=None):
-        return (SON_MANIPULATOR.transform_outgoing(document, self) for
+    def _iter_documents(self, spec=None, projection=None):
+        return (self._project(document, projection) for
                 document in six.itervalues(self._documents)
                 if self._apply_filter(document, spec))
 
+    def _project(self, document, projection):
+        if not projection:
+            return document
+        fields = {k for k, v in six.iteritems(projection) if v}
+        if projection.get('_id', True):
+            fields.add('_id')
+        return {k: v for k, v in six.iteritems(document) if k in fields}
+
     def _apply_filter(self, document, query):
         for key, search in six.iteritems(query):
             doc_val = document.get(key)
@@ -167,14 +178,6 @@ class MockCollection(object):
         else:
             return copy.copy(obj)
 
-    def insert(self, data, manipulate=True, **kwargs):
-        if isinstance(data, list):
-            return [self._insert(element) for element in data]
-        return self._insert(data)
-
-    def save(self, data, manipulate=True, **kwargs):
-        return self._insert(data)
-
     def _insert(self, data):
         if '_id' not in data:
             data['_id'] = uuidutils.generate_uuid(dashed=False)
@@ -182,10 +185,10 @@ class MockCollection(object):
         self._documents[object_id] = self._internalize_dict(data)
         return object_id
 
-    def find_and_modify(self, spec, document, upsert=False, **kwargs):
-        self.update(spec, document, upsert, **kwargs)
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        self._replace(filter, replacement, upsert)
 
-    def update(self, spec, document, upsert=False, **kwargs):
+    def _replace(self, spec, document, upsert=False, **kwargs):
 
         existing_docs = [doc for doc in six.itervalues(self._documents)
                          if self._apply_filter(doc, spec)]
@@ -198,64 +201,59 @@ class MockCollection(object):
         elif upsert:
             existing_doc = self._documents[self._insert(document)]
 
+    def with_options(self, **kwargs):
+        return self
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        for request in requests:
+            self._replace(request._filter, request._doc,
+                          upsert=request._upsert)
+
     def _internalize_dict(self, d):
         return {k: copy.deepcopy(v) for k, v in six.iteritems(d)}
 
-    def remove(self, spec_or_id=None, search_filter=None):
-        """Remove objects matching spec_or_id from the collection."""
-        if spec_or_id is None:
-            spec_or_id = search_filter if search_filter else {}
-        if not isinstance(spec_or_id, dict):
-            spec_or_id = {'_id': spec_or_id}
-        to_delete = list(self.find(spec=spec_or_id))
-        for doc in to_delete:
-            doc_id = doc['_id']
-            del self._documents[doc_id]
-
-        return {
-            "connectionId": uuidutils.generate_uuid(dashed=False),
-            "n": len(to_delete),
-            "ok": 1.0,
-            "err": None,
-        }
+    def delete_one(self, filter, **kwargs):
+        self.delete_many(filter)
+
+    def delete_many(self, filter, **kwargs):
+        """Remove objects matching filter from the collection."""
+        for doc in list(self.find(filter)):
+            del self._documents[doc['_id']]
 
 
 class MockMongoDB(object):
-    def __init__(self, dbname):
+    def __init__(self, dbname, client=None):
         self._dbname = dbname
+        self.client = client
 
-    def authenticate(self, username, password):
-        pass
-
-    def add_son_manipulator(self, manipulator):
-        global SON_MANIPULATOR
-        SON_MANIPULATOR = manipulator
+    def command(self, command, **kwargs):
+        self.client.commands.append(command)
 
     def __getattr__(self, name):
-        if name == 'authenticate':
-            return self.authenticate
-        elif name == 'name':
+        if name == 'name':
             return self._dbname
-        elif name == 'add_son_manipulator':
-            return self.add_son_manipulator
         else:
-            return get_collection(self._dbname, name)
+            return MockCollection(self, name)
 
     def __getitem__(self, name):
-        return get_collection(self._dbname, name)
+        return MockCollection(self, name)
 
 
 class MockMongoClient(object):
     def __init__(self, *args, **kwargs):
-        pass
+        self.args = args
+        self.kwargs = kwargs
+        self.commands = []
+        self.closed = False
 
-    def __getattr__(self, dbname):
-        return MockMongoDB(dbname)
+    def close(self):
+        self.closed = True
 
+    def __getattr__(self, dbname):
+        return MockMongoDB(dbname, self)
 
-def get_collection(db_name, collection_name):
-    mongo_collection = MockCollection(MockMongoDB(db_name), collection_name)
-    return mongo_collection
+    def __getitem__(self, dbname):
+        return MockMongoDB(dbname, self)
 
 
 def pymongo_override():
@@ -263,8 +261,6 @@ def pymongo_override():
     import pymongo
     if pymongo.MongoClient is not MockMongoClient:
         pymongo.MongoClient = MockMongoClient
-    if pymongo.MongoReplicaSetClient is not MockMongoClient:
-        pymongo.MongoClient = MockMongoClient
 
 
 class MyTransformer(mongo.BaseTransform):
@@ -447,6 +443,117 @@ class MongoCache(test_cache.BaseTestCase):
         region1.set(random_key1, "dummyValue22")
         self.assertEqual("dummyValue22", region1.get(random_key1))
 
+    def test_backend_get_lean_reads(self):
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', {'nested': {'value': 1}})
+        region.set('key2', 'dummyValue2')
+        collection = region.backend.api.get_cache_collection()
+
+        with mock.patch.object(mongo.BaseTransform, 'transform_outgoing',
+                               side_effect=AssertionError) as outgoing, \
+                mock.patch.object(collection, 'find',
+                                  wraps=collection.find) as find:
+            self.assertEqual({'nested': {'value': 1}}, region.get('key1'))
+            self.assertEqual([{'nested': {'value': 1}}, 'dummyValue2',
+                              NO_VALUE],
+                             region.get_multi(['key1', 'key2', 'key3']))
+        outgoing.assert_not_called()
+        for call in find.call_args_list:
+            self.assertNotIn('doc_date', call[1]['projection'])
+
+        value = region.backend.get('key2')
+        self.assertIsInstance(value, api.CachedValue)
+        self.assertEqual('dummyValue2', value.payload)
+        self.assertIn('ct', value.metadata)
+
+    def test_backend_get_custom_manipulator(self):
+        self.arguments['son_manipulator'] = '%s.%s' % (
+            MyTransformer.__module__, 'MyTransformer')
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', 'dummyValue1')
+
+        with mock.patch.object(
+                MyTransformer, 'transform_outgoing', autospec=True,
+                side_effect=MyTransformer.transform_outgoing) as outgoing:
+            self.assertEqual('dummyValue1', region.get('key1'))
+            self.assertEqual(['dummyValue1'], region.get_multi(['key1']))
+        self.assertEqual(2, outgoing.call_count)
+
+    def test_backend_blob_storage_format(self):
+        for compression in (False, True):
+            self.arguments['storage_format'] = 'blob'
+            self.arguments['blob_compression'] = compression
+            self.arguments['cache_collection'] = 'cache_%s' % compression
+            region = dp_region.make_region().configure(
+                'oslo_cache.mongo',
+                arguments=dict(self.arguments)
+            )
+            payload = {'nested': {'value': 1}, 'list': [1, 2]}
+            with mock.patch.object(mongo.BaseTransform, 'transform_incoming',
+                                   side_effect=AssertionError), \
+                    mock.patch.object(mongo.BaseTransform,
+                                      'transform_outgoing',
+                                      side_effect=AssertionError):
+                region.set('key1', payload)
+                region.set_multi({'key2': 'dummyValue2', 'key3': None})
+                self.assertEqual(payload, region.get('key1'))
+                self.assertEqual([payload, 'dummyValue2', None, NO_VALUE],
+                                 region.get_multi(['key1', 'key2', 'key3',
+                                                   'key4']))
+
+            collection = region.backend.api.get_cache_collection()
+            document = collection._documents['key1']
+            self.assertEqual({'_id', 'blob', 'doc_date'}, set(document))
+            self.assertEqual(b'z' if compression else b'p',
+                             document['blob'][:1])
+
+    def test_backend_blob_storage_format_ignores_documents(self):
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=dict(self.arguments)
+        )
+        region.set('key1', 'dummyValue1')
+
+        # the collection is shared with the first region
+        self.arguments['storage_format'] = 'blob'
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        self.assertEqual(NO_VALUE, region.get('key1'))
+        self.assertEqual([NO_VALUE], region.get_multi(['key1']))
+
+    def test_incorrect_storage_format(self):
+        self.arguments['storage_format'] = 'bson'
+        region = dp_region.make_region()
+        self.assertRaises(exception.ConfigurationError, region.configure,
+                          'oslo_cache.mongo',
+                          arguments=self.arguments)
+
+    def test_regions_sharing_collection(self):
+        for son_manipulator in (None, '%s.%s' % (MyTransformer.__module__,
+                                                 'MyTransformer')):
+            mongo.MongoApi._MONGO_COLLS = {}
+            arguments = dict(self.arguments)
+            if son_manipulator:
+                arguments['son_manipulator'] = son_manipulator
+            region1 = dp_region.make_region().configure(
+                'oslo_cache.mongo', arguments=dict(arguments))
+            region2 = dp_region.make_region().configure(
+                'oslo_cache.mongo', arguments=dict(arguments))
+
+            region1.set('key1', 'dummyValue1')
+            self.assertEqual('dummyValue1', region2.get('key1'))
+            self.assertEqual(['dummyValue1'], region2.get_multi(['key1']))
+            region2.set('key2', 'dummyValue2')
+            self.assertEqual('dummyValue2', region1.get('key2'))
+
     def test_typical_configuration(self):
 
         dp_region.make_region().configure(
@@ -609,6 +716,191 @@ class MongoCache(test_cache.BaseTestCase):
         self.assertEqual("dummyValue5", region.get(random_key2))
         self.assertEqual("dummyValue3", region.get(random_key3))
 
+    def test_backend_multi_set_bulk_write(self):
+        self.arguments['bulk_write_size'] = 2
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', 'dummyValue')
+        collection = region.backend.api.get_cache_collection()
+        mapping = {'key1': 'dummyValue1',
+                   'key2': 'dummyValue2',
+                   'key3': 'dummyValue3'}
+        with mock.patch.object(collection, 'bulk_write',
+                               wraps=collection.bulk_write) as bulk_write, \
+                mock.patch.object(collection, 'find') as find:
+            region.set_multi(mapping)
+
+        # existing documents are not read, the mapping is written in batches
+        find.assert_not_called()
+        self.assertEqual([2, 1], [len(call[0][0]) for call in
+                                  bulk_write.call_args_list])
+        for call in bulk_write.call_args_list:
+            self.assertEqual({'ordered': False}, call[1])
+            for request in call[0][0]:
+                self.assertTrue(request._upsert)
+        self.assertEqual(['dummyValue1', 'dummyValue2', 'dummyValue3'],
+                         region.get_multi(['key1', 'key2', 'key3']))
+
+    def test_collection_options(self):
+        self.arguments['w'] = 2
+        self.arguments['j'] = True
+        self.arguments['read_preference'] = 'secondaryPreferred'
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        with mock.patch.object(MockCollection, 'with_options', autospec=True,
+                               side_effect=lambda coll, **kw: coll) as opts:
+            region.set('key1', 'dummyValue1')
+
+        options = opts.call_args[1]
+        self.assertEqual({'w': 2, 'j': True},
+                         options['write_concern'].document)
+        self.assertEqual(3, options['read_preference'].mode)
+        self.assertEqual({}, region.backend.api.find_kwargs)
+        self.assertEqual('dummyValue1', region.get('key1'))
+
+    def test_client_arguments(self):
+        self.arguments.update(use_replica=True, replicaset_name='my_replica',
+                              min_pool_size='2', max_idle_time_ms='60000',
+                              wait_queue_timeout_ms=1000,
+                              compressors='zstd,zlib',
+                              zlib_compression_level='6',
+                              ssl=True, ssl_certfile='/cert.pem',
+                              ssl_ca_certs='/ca.pem', ssl_cert_reqs='none')
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', 'dummyValue1')
+
+        client = mongo.MongoApi._DB[region.backend.api._get_db_key()].client
+        self.assertEqual({'host': 'localhost:27017',
+                          'replicaSet': 'my_replica',
+                          'username': 'test_user',
+                          'password': 'test_password',
+                          'authSource': 'ks_cache',
+                          'maxPoolSize': 10,
+                          'minPoolSize': 2,
+                          'maxIdleTimeMS': 60000,
+                          'waitQueueTimeoutMS': 1000,
+                          'compressors': 'zstd,zlib',
+                          'zlibCompressionLevel': 6,
+                          'ssl': True,
+                          'tlsCertificateKeyFile': '/cert.pem',
+                          'tlsCAFile': '/ca.pem',
+                          'tlsAllowInvalidCertificates': True},
+                         client.kwargs)
+
+    def test_incorrect_pool_arguments(self):
+        for arg in ('max_pool_size', 'min_pool_size', 'max_idle_time_ms',
+                    'wait_queue_timeout_ms', 'zlib_compression_level'):
+            arguments = dict(self.arguments)
+            arguments[arg] = 'many'
+            region = dp_region.make_region()
+            self.assertRaises(exception.ConfigurationError, region.configure,
+                              'oslo_cache.mongo', arguments=arguments)
+
+    def test_client_shared_per_pool_arguments(self):
+        regions = []
+        for collection, pool_size in (('cache1', 10), ('cache2', 10),
+                                      ('cache3', 20)):
+            arguments = dict(self.arguments, cache_collection=collection,
+                             max_pool_size=pool_size)
+            regions.append(dp_region.make_region().configure(
+                'oslo_cache.mongo', arguments=arguments))
+            regions[-1].set('key1', 'dummyValue1')
+
+        db_keys = [region.backend.api._get_db_key() for region in regions]
+        self.assertEqual(db_keys[0], db_keys[1])
+        self.assertNotEqual(db_keys[0], db_keys[2])
+        self.assertEqual(2, len(mongo.MongoApi._DB))
+
+    def test_warm_up(self):
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.backend.warm_up()
+        client = mongo.MongoApi._DB[region.backend.api._get_db_key()].client
+        self.assertEqual(['ping'], client.commands)
+
+    def test_close(self):
+        arguments = dict(self.arguments)
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        other = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=dict(arguments, cache_collection='other')
+        )
+        region.set('key1', 'dummyValue1')
+        other.set('key1', 'dummyValue1')
+        client = mongo.MongoApi._DB[region.backend.api._get_db_key()].client
+
+        region.backend.close()
+        self.assertTrue(client.closed)
+        self.assertEqual({}, mongo.MongoApi._DB)
+        self.assertEqual({}, mongo.MongoApi._MONGO_COLLS)
+        # the regions sharing the client get a new one
+        self.assertEqual(NO_VALUE, other.get('key1'))
+        self.assertEqual(1, len(mongo.MongoApi._DB))
+        region.backend.close()
+
+    def test_clients_not_shared_with_forked_processes(self):
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', 'dummyValue1')
+        db_key = region.backend.api._get_db_key()
+        parent_client = mongo.MongoApi._DB[db_key].client
+        self.addCleanup(setattr, mongo.MongoApi, '_PID', os.getpid())
+
+        with mock.patch.object(mongo.os, 'getpid',
+                               return_value=os.getpid() + 1):
+            self.assertEqual(NO_VALUE, region.get('key1'))
+            child_client = mongo.MongoApi._DB[db_key].client
+            self.assertIsNot(parent_client, child_client)
+            self.assertFalse(parent_client.closed)
+
+            region.set('key1', 'dummyValue2')
+            self.assertEqual('dummyValue2', region.get('key1'))
+            self.assertIs(child_client, mongo.MongoApi._DB[db_key].client)
+
+    def test_read_preference_after_fork(self):
+        self.arguments['read_preference'] = 'secondaryPreferred'
+        region = dp_region.make_region().configure(
+            'oslo_cache.mongo',
+            arguments=self.arguments
+        )
+        region.set('key1', 'dummyValue1')
+        self.addCleanup(setattr, mongo.MongoApi, '_PID', os.getpid())
+
+        with mock.patch.object(mongo.os, 'getpid',
+                               return_value=os.getpid() + 1):
+            with mock.patch.object(
+                    MockCollection, 'with_options', autospec=True,
+                    side_effect=lambda coll, **kw: coll) as opts:
+                region.set('key1', 'dummyValue2')
+            self.assertEqual(3, opts.call_args[1]['read_preference'].mode)
+            self.assertEqual('dummyValue2', region.get('key1'))
+
+            region.backend.close()
+            region.set('key1', 'dummyValue3')
+            self.assertEqual('dummyValue3', region.get('key1'))
+
+    def test_incorrect_bulk_write_size(self):
+        for size in ('many', 0):
+            self.arguments['bulk_write_size'] = size
+            region = dp_region.make_region()
+            self.assertRaises(exception.ConfigurationError, region.configure,
+                              'oslo_cache.mongo',
+                              arguments=dict(self.arguments))
+
     def test_backend_multi_set_get_with_blanks_none(self):
 
         region = dp_region.make_region().configure(
@@ -10,15 +10,24 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from concurrent import futures
+import contextlib
+import socket
+import threading
 import time
 
+import fixtures
 import mock
+from pymemcache.client import base as pymemcache_base
 from pymemcache.client import hash as pymemcache_hash
+from pymemcache import serde
+from pymemcache.test import utils as pymemcache_utils
 from six.moves import queue
 import testtools
 from testtools import matchers
 
 from oslo_cache import _memcache_pool
+from oslo_cache.backends import memcache_pool
 from oslo_cache import exception
 from oslo_cache.tests import test_cache
 
@@ -131,6 +140,302 @@ class TestConnectionPool(test_cache.BaseTestCase):
         connection_pool.put_nowait(conn)
         _acquire_connection()
 
+    def test_stats(self):
+        events = []
+        self.connection_pool.add_listener(
+            lambda pool, event, value: events.append((event, value)))
+        with self.connection_pool.acquire():
+            with self.connection_pool.acquire():
+                pass
+        stats = self.connection_pool.get_stats()
+        self.assertEqual(2, stats['maxsize'])
+        self.assertEqual(0, stats['acquired'])
+        self.assertEqual(2, stats['idle'])
+        self.assertEqual(2, stats['created'])
+        self.assertEqual(0, stats['destroyed'])
+        self.assertEqual(2, stats['acquire_wait']['count'])
+        self.assertEqual(['created', 'acquire_wait'] * 2,
+                         [event for event, _ in events])
+
+        newtime = time.time() + self.unused_timeout * 2
+        with mock.patch.object(time, 'time', return_value=newtime):
+            self.connection_pool._drop_expired_connections()
+        stats = self.connection_pool.get_stats()
+        self.assertEqual(2, stats['destroyed'])
+        self.assertEqual(2, stats['reaped'])
+        self.assertEqual(0, stats['idle'])
+
+    def test_stats_queue_empty(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=1,
+            unused_timeout=self.unused_timeout,
+            conn_get_timeout=0)
+        listener = mock.Mock()
+        connection_pool.add_listener(listener)
+        with connection_pool.acquire():
+            self.assertEqual(1, connection_pool.get_stats()['acquired'])
+            with testtools.ExpectedException(exception.QueueEmpty):
+                with connection_pool.acquire():
+                    pass
+        self.assertEqual(1, connection_pool.get_stats()['queue_empty'])
+        listener.assert_any_call(connection_pool, 'queue_empty', 1)
+
+        connection_pool.remove_listener(listener)
+        listener.reset_mock()
+        with connection_pool.acquire():
+            pass
+        listener.assert_not_called()
+
+    def test_listener_errors_are_ignored(self):
+        self.connection_pool.add_listener(mock.Mock(side_effect=ValueError))
+        with self.connection_pool.acquire():
+            pass
+        self.assertEqual(1, self.connection_pool.get_stats()['created'])
+
+    def _wait_for(self, predicate):
+        deadline = time.time() + 10
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(predicate())
+
+    def test_reaper_drops_expired_connections(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=0,
+            reap_interval=0.01)
+        self.addCleanup(connection_pool.shutdown)
+        with mock.patch.object(connection_pool,
+                               '_drop_expired_connections') as drop:
+            with connection_pool.acquire() as conn:
+                pass
+        drop.assert_not_called()
+        self._wait_for(lambda: not connection_pool.queue)
+        conn.assert_has_calls(
+            [mock.call(connection_pool.destroyed_value)])
+
+    def test_reaper_restarted_after_fork(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            reap_interval=60)
+        self.addCleanup(connection_pool.shutdown)
+        with connection_pool.acquire():
+            pass
+        reaper = connection_pool._reaper
+        self.assertTrue(reaper.is_alive())
+        with connection_pool.acquire():
+            pass
+        self.assertIs(reaper, connection_pool._reaper)
+        with mock.patch('os.getpid', return_value=-1):
+            with connection_pool.acquire():
+                pass
+        self.assertIsNot(reaper, connection_pool._reaper)
+        self.assertEqual(-1, connection_pool._pid)
+
+    def test_shutdown(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            reap_interval=60)
+        with connection_pool.acquire() as conn:
+            pass
+        reaper = connection_pool._reaper
+        connection_pool.shutdown()
+        self.assertFalse(reaper.is_alive())
+        self.assertThat(connection_pool.queue, matchers.HasLength(0))
+        conn.assert_has_calls(
+            [mock.call(connection_pool.destroyed_value)])
+        # The pool is still usable, expiring connections inline
+        with connection_pool.acquire():
+            pass
+        self.assertIsNone(connection_pool._reaper)
+
+    def test_prewarm(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            min_size=5)
+        with mock.patch.object(connection_pool, '_connect') as connect:
+            connection_pool.prewarm()
+        # min_size is capped by maxsize
+        self.assertThat(connection_pool.queue, matchers.HasLength(2))
+        connect.assert_has_calls(
+            [mock.call(item.connection) for item in connection_pool.queue],
+            any_order=True)
+        # Warming up again does not go beyond min_size
+        connection_pool.prewarm()
+        self.assertThat(connection_pool.queue, matchers.HasLength(2))
+        with connection_pool.acquire() as conn:
+            self.assertEqual(1, len(connection_pool.queue))
+        self.assertIn(conn, [item.connection
+                             for item in connection_pool.queue])
+
+    def test_prewarm_ignores_connection_errors(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            min_size=1)
+        with mock.patch.object(connection_pool, '_connect',
+                               side_effect=IOError):
+            connection_pool.prewarm()
+        self.assertThat(connection_pool.queue, matchers.HasLength(1))
+
+    def test_min_size_connections_are_not_reaped(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            min_size=1)
+        with connection_pool.acquire() as conn1:
+            with connection_pool.acquire() as conn2:
+                pass
+        newtime = time.time() + self.unused_timeout * 2
+        with mock.patch.object(time, 'time', return_value=newtime):
+            with connection_pool.acquire() as conn:
+                self.assertIs(conn1, conn)
+                self.assertThat(connection_pool.queue, matchers.HasLength(0))
+        conn2.assert_has_calls(
+            [mock.call(connection_pool.destroyed_value)])
+        self.assertEqual(0, conn1.call_count)
+
+    def test_fork_drops_inherited_connections(self):
+        connection_pool = _TestConnectionPool(
+            maxsize=self.maxsize,
+            unused_timeout=self.unused_timeout,
+            min_size=1)
+        connection_pool.prewarm()
+        inherited = connection_pool.queue[0].connection
+        with mock.patch('os.getpid', return_value=-1):
+            with connection_pool.acquire() as conn:
+                self.assertIsNot(inherited, conn)
+        inherited.assert_has_calls(
+            [mock.call(connection_pool.destroyed_value)])
+        self.assertThat(connection_pool.queue, matchers.HasLength(1))
+
+
+class _TestLifoConnectionPool(_memcache_pool.LifoConnectionPool):
+    destroyed_value = 'destroyed'
+
+    def _create_connection(self):
+        return mock.MagicMock()
+
+    def _destroy_connection(self, conn):
+        conn(self.destroyed_value)
+
+
+class TestLifoConnectionPool(test_cache.BaseTestCase):
+    def setUp(self):
+        super(TestLifoConnectionPool, self).setUp()
+        self.unused_timeout = 10
+        self.connection_pool = _TestLifoConnectionPool(
+            maxsize=2,
+            unused_timeout=self.unused_timeout,
+            conn_get_timeout=0)
+
+    def test_get_context_manager(self):
+        self.assertThat(self.connection_pool.queue, matchers.HasLength(0))
+        with self.connection_pool.acquire() as conn:
+            self.assertEqual(1, self.connection_pool._acquired)
+        self.assertEqual(0, self.connection_pool._acquired)
+        self.assertThat(self.connection_pool.queue, matchers.HasLength(1))
+        self.assertEqual(conn, self.connection_pool.queue[0].connection)
+
+    def test_most_recently_used_connection_first(self):
+        with self.connection_pool.acquire() as conn1:
+            with self.connection_pool.acquire() as conn2:
+                pass
+        # conn1 was released last
+        with self.connection_pool.acquire() as conn:
+            self.assertIs(conn1, conn)
+            with self.connection_pool.acquire() as conn:
+                self.assertIs(conn2, conn)
+
+    def test_cleanup_pool(self):
+        self.test_get_context_manager()
+        newtime = time.time() + self.unused_timeout * 2
+        non_expired_connection = _memcache_pool._PoolItem(
+            ttl=(newtime * 2),
+            connection=mock.MagicMock())
+        self.connection_pool.queue.append(non_expired_connection)
+        with mock.patch.object(time, 'time', return_value=newtime):
+            conn = self.connection_pool.queue[0].connection
+            with self.connection_pool.acquire() as acquired:
+                self.assertIs(non_expired_connection.connection, acquired)
+            conn.assert_has_calls(
+                [mock.call(self.connection_pool.destroyed_value)])
+        self.assertThat(self.connection_pool.queue, matchers.HasLength(1))
+        self.assertEqual(0, non_expired_connection.connection.call_count)
+
+    def test_acquire_conn_exception_returns_permit(self):
+        class TestException(Exception):
+            pass
+
+        with mock.patch.object(_TestLifoConnectionPool, '_create_connection',
+                               side_effect=TestException):
+            with testtools.ExpectedException(TestException):
+                with self.connection_pool.acquire():
+                    pass
+        self.assertEqual(0, self.connection_pool._acquired)
+
+    def test_connection_pool_limits_maximum_connections(self):
+        with self.connection_pool.acquire():
+            with self.connection_pool.acquire():
+                def _acquire_connection():
+                    with self.connection_pool.acquire():
+                        pass
+
+                self.assertRaises(exception.QueueEmpty, _acquire_connection)
+        with self.connection_pool.acquire():
+            pass
+
+    def test_stats(self):
+        with self.connection_pool.acquire():
+            with self.connection_pool.acquire():
+                self.assertEqual(2,
+                                 self.connection_pool.get_stats()['acquired'])
+                self.assertRaises(exception.QueueEmpty,
+                                  self.connection_pool._take_permit)
+        stats = self.connection_pool.get_stats()
+        self.assertEqual(0, stats['acquired'])
+        self.assertEqual(2, stats['idle'])
+        self.assertEqual(2, stats['created'])
+        self.assertEqual(1, stats['queue_empty'])
+        self.assertEqual(2, stats['acquire_wait']['count'])
+
+    def test_waiter_is_woken_up_on_release(self):
+        connection_pool = _TestLifoConnectionPool(
+            maxsize=1,
+            unused_timeout=self.unused_timeout,
+            conn_get_timeout=10)
+        acquired = []
+
+        def _acquire_connection():
+            with connection_pool.acquire() as conn:
+                acquired.append(conn)
+
+        with connection_pool.acquire() as conn:
+            waiter = threading.Thread(target=_acquire_connection)
+            waiter.start()
+            while not connection_pool._waiters:
+                time.sleep(0.01)
+        waiter.join(10)
+        self.assertEqual([conn], acquired)
+        self.assertEqual(0, connection_pool._acquired)
+
+    def test_reaper_drops_expired_connections(self):
+        connection_pool = _TestLifoConnectionPool(
+            maxsize=2,
+            unused_timeout=0,
+            reap_interval=0.01)
+        self.addCleanup(connection_pool.shutdown)
+        with connection_pool.acquire() as conn:
+            pass
+        deadline = time.time() + 10
+        while connection_pool.queue and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertThat(connection_pool.queue, matchers.HasLength(0))
+        conn.assert_has_calls(
+            [mock.call(connection_pool.destroyed_value)])
+
 
 class TestMemcacheClientPool(test_cache.BaseTestCase):
 
@@ -163,3 +468,370 @@ class TestMemcacheClientPool(test_cache.BaseTestCase):
         self.assertTrue("https://[2620:52:0:13b8:5054:ff:fe3e:1]:11211" in
                         mc.clients)
         self.assertTrue("https://[::192.9.5.5]:11211" in mc.clients)
+
+    def test_lifo_memcache_client_pool_create_connection(self):
+        mcp = _memcache_pool.LifoMemcacheClientPool(urls=['foo'],
+                                                    arguments={},
+                                                    maxsize=10,
+                                                    unused_timeout=10)
+        mc = mcp._create_connection()
+        self.assertTrue(type(mc) is pymemcache_hash.HashClient)
+        self.assertTrue("foo:11211" in mc.clients)
+
+    def test_memcache_client_pool_prewarm(self):
+        mcp = _memcache_pool.MemcacheClientPool(urls=['foo', 'bar'],
+                                                arguments={},
+                                                maxsize=10,
+                                                unused_timeout=10,
+                                                min_size=2)
+        with mock.patch('pymemcache.client.base.Client._connect') as connect:
+            mcp.prewarm()
+        self.assertThat(mcp.queue, matchers.HasLength(2))
+        self.assertEqual(4, connect.call_count)
+
+
+class _TestClientPool(object):
+    def __init__(self, client):
+        self.client = client
+
+    @contextlib.contextmanager
+    def acquire(self):
+        yield self.client
+
+
+class TestClientProxyFanout(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(TestClientProxyFanout, self).setUp()
+        self.client = pymemcache_hash.HashClient(
+            [('host1', 11211), ('host2', 11211), ('host3', 11211)])
+        for name in list(self.client.clients):
+            server = mock.MagicMock(name=name)
+            server.server = name
+            server.get_many.side_effect = (
+                lambda keys: {key: key.upper() for key in keys})
+            server.set_many.return_value = []
+            self.client.clients[name] = server
+        self.executor = futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.proxy = memcache_pool.ClientProxy(
+            _TestClientPool(self.client), self.executor)
+        self.keys = ['key%d' % i for i in range(30)]
+
+    def _servers(self):
+        return [server for server in self.client.clients.values()
+                if server.get_many.called or server.set_many.called or
+                server.delete_many.called]
+
+    def test_get_multi_merges_server_batches(self):
+        values = self.proxy.get_multi(self.keys)
+        self.assertEqual({key: key.upper() for key in self.keys}, values)
+        servers = self._servers()
+        self.assertEqual(3, len(servers))
+        batched = []
+        for server in servers:
+            self.assertEqual(1, server.get_many.call_count)
+            batch = server.get_many.call_args[0][0]
+            for key in batch:
+                self.assertIs(server, self.client._get_client(key))
+            batched.extend(batch)
+        self.assertEqual(sorted(self.keys), sorted(batched))
+
+    def test_set_multi_returns_failed_keys(self):
+        failing = self.client._get_client(self.keys[0])
+        failing.set_many.side_effect = lambda batch, *a, **kw: list(batch)
+        mapping = {key: 'value' for key in self.keys}
+        failed = self.proxy.set_multi(mapping, expire=10)
+        self.assertEqual(
+            sorted(key for key in self.keys
+                   if self.client._get_client(key) is failing),
+            sorted(failed))
+        for server in self._servers():
+            self.assertEqual(10, server.set_many.call_args[1]['expire'])
+
+    def test_delete_multi_one_call_per_server(self):
+        self.assertTrue(self.proxy.delete_multi(self.keys))
+        for server in self.client.clients.values():
+            self.assertEqual(1, server.delete_many.call_count)
+
+    def test_batch_error_is_raised(self):
+        failing = self.client._get_client(self.keys[0])
+        failing.get_many.side_effect = ValueError
+        self.assertRaises(ValueError, self.proxy.get_multi, self.keys)
+
+    def test_hash_client_internals(self):
+        # The HashClient methods used by the fan-out, on servers storing the
+        # values
+        for name in list(self.client.clients):
+            self.client.clients[name] = pymemcache_utils.MockMemcacheClient(
+                server=name, serde=serde.pickle_serde)
+        mapping = {key: {'value': key} for key in self.keys}
+        self.assertEqual([], self.proxy.set_multi(mapping, noreply=False))
+        for server in self.client.clients.values():
+            self.assertTrue(server._contents)
+        self.assertEqual(mapping, self.proxy.get_multi(self.keys))
+        self.assertEqual(mapping, self.client.get_multi(self.keys))
+
+        self.assertTrue(self.proxy.delete_multi(self.keys[:10]))
+        self.assertEqual({key: mapping[key] for key in self.keys[10:]},
+                         self.proxy.get_multi(self.keys))
+
+    def test_client_without_internals_not_fanned_out(self):
+        self.useFixture(fixtures.MockPatchObject(
+            memcache_pool, '_fanout_support', {}))
+        warning = self.useFixture(fixtures.MockPatchObject(
+            memcache_pool.LOG, 'warning')).mock
+        client = pymemcache_utils.MockMemcacheClient(serde=serde.pickle_serde)
+        proxy = memcache_pool.ClientProxy(_TestClientPool(client),
+                                          self.executor)
+        mapping = {key: {'value': key} for key in self.keys}
+        self.assertEqual([], proxy.set_multi(mapping, noreply=False))
+        self.assertEqual(mapping, proxy.get_multi(self.keys))
+        self.assertTrue(proxy.delete_multi(self.keys))
+        self.assertEqual({}, proxy.get_multi(self.keys))
+        # The lack of support is only logged once
+        self.assertEqual(1, warning.call_count)
+
+    def test_no_executor_uses_client(self):
+        proxy = memcache_pool.ClientProxy(_TestClientPool(self.client))
+        with mock.patch.object(self.client, 'get_multi',
+                               return_value={}) as get_multi:
+            self.assertEqual({}, proxy.get_multi(self.keys))
+        get_multi.assert_called_once_with(self.keys)
+
+
+class TestMemcachedLock(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(TestMemcachedLock, self).setUp()
+        self.client = mock.Mock()
+        self.lock = memcache_pool._MemcachedLock(self.client, 'key', 30)
+        self.sleep = self.useFixture(fixtures.MockPatch(
+            'oslo_cache.backends.memcache_pool.time.sleep')).mock
+
+    def _token(self):
+        return self.client.add.call_args[0][1]
+
+    def test_acquire_adds_key(self):
+        self.client.add.return_value = True
+        self.assertTrue(self.lock.acquire())
+        self.client.add.assert_called_once_with('_lockkey', mock.ANY, 30,
+                                                noreply=False)
+        self.client.gets.return_value = (self._token(), b'1')
+        self.lock.release()
+        # The key is expired only if it was not changed since read
+        self.client.gets.assert_called_once_with('_lockkey')
+        self.client.cas.assert_called_once_with(
+            '_lockkey', self._token(), b'1', expire=-1, noreply=False)
+        self.client.delete.assert_not_called()
+
+    def test_tokens_unique(self):
+        self.client.add.return_value = True
+        self.lock.acquire()
+        token = self._token()
+        self.lock.acquire()
+        self.assertNotEqual(token, self._token())
+
+    def test_release_other_token_not_released(self):
+        # The key expired and was added by another process
+        self.client.add.return_value = True
+        self.assertTrue(self.lock.acquire())
+        self.client.gets.return_value = ('other-token', b'2')
+        self.lock.release()
+        self.client.cas.assert_not_called()
+        self.client.delete.assert_not_called()
+
+    def test_ownership_by_thread(self):
+        # dogpile.cache shares the mutex between the threads
+        self.client.add.return_value = True
+        self.assertTrue(self.lock.acquire())
+        token = self._token()
+        self.client.gets.return_value = (token, b'1')
+
+        def give_up():
+            self.client.add.return_value = False
+            with mock.patch(
+                    'oslo_cache.backends.memcache_pool.time.monotonic',
+                    side_effect=[0, 30]):
+                self.assertTrue(self.lock.acquire())
+            self.lock.release()
+
+        thread = threading.Thread(target=give_up)
+        thread.start()
+        thread.join()
+        # The thread which gave up did not release the lock
+        self.client.gets.assert_not_called()
+
+        self.lock.release()
+        self.client.cas.assert_called_once_with(
+            '_lockkey', token, b'1', expire=-1, noreply=False)
+
+    def test_acquire_no_wait(self):
+        self.client.add.return_value = False
+        self.assertFalse(self.lock.acquire(False))
+        self.sleep.assert_not_called()
+
+    def test_acquire_waits_with_backoff(self):
+        self.client.add.side_effect = [False, False, False, True]
+        self.assertTrue(self.lock.acquire())
+        delays = [call[0][0] for call in self.sleep.call_args_list]
+        self.assertEqual(3, len(delays))
+        for delay, expected in zip(delays, (0.01, 0.02, 0.04)):
+            self.assertThat(delay, matchers.GreaterThan(expected * 0.49))
+            self.assertThat(delay, matchers.LessThan(expected * 1.51))
+
+    def test_acquire_gives_up_after_timeout(self):
+        self.client.add.return_value = False
+        with mock.patch('oslo_cache.backends.memcache_pool.time.monotonic',
+                        side_effect=[0, 10, 20, 30]):
+            self.assertTrue(self.lock.acquire())
+        self.assertEqual(3, self.client.add.call_count)
+
+        # The lock held by another process is not released
+        self.lock.release()
+        self.client.gets.assert_not_called()
+        self.client.cas.assert_not_called()
+        self.client.delete.assert_not_called()
+
+    def test_zero_timeout_rejected(self):
+        self.assertRaises(exception.ConfigurationError,
+                          memcache_pool._MemcachedLock, self.client, 'key', 0)
+        self.useFixture(fixtures.MockPatchObject(
+            memcache_pool.memcached_backend.MemcachedBackend, '_imports'))
+        self.assertRaises(exception.ConfigurationError,
+                          memcache_pool.PooledMemcachedBackend,
+                          {'url': 'localhost:11211',
+                           'distributed_lock': True,
+                           'lock_timeout': 0})
+        self.assertRaises(ValueError, self.config_fixture.config,
+                          group='cache', memcache_lock_timeout=0)
+
+    def test_backend_get_mutex(self):
+        backend = mock.Mock(distributed_lock=True, lock_timeout=5)
+        lock = memcache_pool.PooledMemcachedBackend.get_mutex(backend, 'key')
+        self.assertIsInstance(lock, memcache_pool._MemcachedLock)
+        self.assertIs(backend.client, lock.client)
+        self.assertEqual(5, lock.timeout)
+
+        backend.distributed_lock = False
+        self.assertIsNone(
+            memcache_pool.PooledMemcachedBackend.get_mutex(backend, 'key'))
+
+
+class TestMemcacheServerPools(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(TestMemcacheServerPools, self).setUp()
+        self.servers = {}
+        patcher = mock.patch.object(pymemcache_base, 'Client',
+                                    side_effect=self._create_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pools = _memcache_pool.MemcacheServerPools(
+            ['host1', 'host2', 'host3'],
+            arguments={'socket_timeout': 2},
+            maxsize=2, unused_timeout=10)
+        self.keys = ['key%d' % i for i in range(30)]
+
+    def _create_client(self, server, **kwargs):
+        client = mock.MagicMock(name='%s:%s' % server)
+        client.server = server
+        client.kwargs = kwargs
+        client.get_many.side_effect = (
+            lambda keys: {key: key.upper() for key in keys})
+        client.set_many.return_value = []
+        self.servers.setdefault('%s:%s' % server, []).append(client)
+        return client
+
+    def test_same_routing_as_hash_client(self):
+        client = pymemcache_hash.HashClient(
+            [('host1', 11211), ('host2', 11211), ('host3', 11211)])
+        for key in self.keys:
+            self.assertEqual(client.hasher.get_node(key),
+                             self.pools._server(key))
+
+    def test_single_server_clients(self):
+        self.pools.get('key')
+        name = self.pools._server('key')
+        self.assertEqual([name], list(self.servers))
+        client = self.servers[name][0]
+        client.get.assert_called_once_with('key')
+        self.assertEqual(2, client.kwargs['connect_timeout'])
+        self.assertEqual(2, client.kwargs['timeout'])
+        self.assertEqual(_memcache_pool.DEFAULT_SERIALIZER,
+                         client.kwargs['serializer'])
+
+    def test_get_multi_one_call_per_server(self):
+        values = self.pools.get_multi(self.keys)
+        self.assertEqual({key: key.upper() for key in self.keys}, values)
+        self.assertEqual(3, len(self.servers))
+        for name, clients in self.servers.items():
+            self.assertEqual(1, len(clients))
+            batch = clients[0].get_many.call_args[0][0]
+            for key in batch:
+                self.assertEqual(name, self.pools._server(key))
+
+    def test_get_multi_with_executor(self):
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        self.pools.executor = executor
+        values = self.pools.get_multi(self.keys)
+        self.assertEqual({key: key.upper() for key in self.keys}, values)
+
+    def test_set_multi_returns_failed_keys(self):
+        self.pools.get('key0')
+        failing = self.servers[self.pools._server('key0')][0]
+        failing.set_many.side_effect = lambda batch, *a, **kw: list(batch)
+        failed = self.pools.set_multi({key: 'value' for key in self.keys},
+                                      expire=10)
+        self.assertEqual(
+            sorted(key for key in self.keys
+                   if self.pools._server(key) == self.pools._server('key0')),
+            sorted(failed))
+
+    def test_dead_server_is_left_out(self):
+        name = self.pools._server('key')
+        self.pools.get('key')
+        client = self.servers[name][0]
+        client.get.side_effect = socket.error
+        self.assertRaises(socket.error, self.pools.get, 'key')
+        client.close.assert_called_once_with()
+        self.assertIn(name, self.pools._dead_until)
+        for key in self.keys:
+            self.assertNotEqual(name, self.pools._server(key))
+
+        self.pools._dead_until[name] = time.time() - 1
+        self.assertEqual(name, self.pools._server('key'))
+        self.assertNotIn(name, self.pools._dead_until)
+
+    def test_dead_server_stats(self):
+        listener = mock.Mock()
+        self.pools.add_listener(listener)
+        name = self.pools._server('key')
+        self.pools._mark_dead(name)
+        stats = self.pools.get_stats()
+        self.assertEqual(sorted(self.pools.pools), sorted(stats))
+        self.assertEqual({name: 1}, stats[name]['dead_hosts'])
+        listener.assert_called_once_with(self.pools.pools[name], 'dead_host',
+                                         name)
+
+    def test_all_servers_dead_are_revived(self):
+        for name in list(self.pools.pools):
+            self.pools._mark_dead(name)
+        self.assertEqual({}, self.pools._dead_until)
+        self.assertEqual(3, len(self.pools._hasher.nodes))
+
+    def test_prewarm_and_shutdown(self):
+        pools = _memcache_pool.MemcacheServerPools(
+            ['host1', 'host2'], arguments={}, maxsize=2, unused_timeout=10,
+            min_size=2)
+        pools.prewarm()
+        for name in ('host1:11211', 'host2:11211'):
+            self.assertEqual(2, len(self.servers[name]))
+            self.assertEqual(2, len(pools.pools[name].queue))
+            for client in self.servers[name]:
+                client._connect.assert_called_once_with()
+        pools.shutdown()
+        for clients in self.servers.values():
+            for client in clients:
+                client.close.assert_called_once_with()
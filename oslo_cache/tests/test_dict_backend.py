@@ -12,9 +12,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import threading
+
 from dogpile.cache import region as dp_region
+import mock
+from oslo_utils import timeutils
 
+from oslo_cache.backends import dictionary
 from oslo_cache import core
+from oslo_cache import exception
 from oslo_cache.tests import test_cache
 from oslo_config import fixture as config_fixture
 from oslo_utils import fixture as time_fixture
@@ -113,3 +119,248 @@ class CacheDictBackendTest(test_cache.BaseTestCase):
         self.region.set(KEY, 'value1')
         self.region.set(KEY, 'value2')
         self.assertEqual('value2', self.region.get(KEY))
+
+    def test_dict_backend_max_entries(self):
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.dict', arguments={'max_entries': 2})
+
+        self.region.set('key1', 'value1')
+        self.region.set('key2', 'value2')
+        self.assertEqual('value1', self.region.get('key1'))
+        self.region.set('key3', 'value3')
+
+        self.assertEqual(2, len(self.region.backend.cache))
+        self.assertIs(NO_VALUE, self.region.get('key2'))
+        self.assertEqual('value1', self.region.get('key1'))
+        self.assertEqual('value3', self.region.get('key3'))
+
+        self.region.set_multi({'key4': 4, 'key5': 5, 'key6': 6})
+        self.assertEqual(['key5', 'key6'], sorted(self.region.backend.cache))
+
+    def test_dict_backend_max_bytes(self):
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.dict', arguments={'max_bytes': 1000})
+        backend = self.region.backend
+
+        self.region.set('key1', 'x' * 400)
+        self.region.set('key2', 'x' * 400)
+        self.assertEqual(2, len(backend.cache))
+        self.assertEqual(sum(backend._sizes.values()), backend._bytes)
+
+        self.region.set('key1', 'x' * 500)
+        self.assertEqual(['key1'], list(backend.cache))
+        self.assertEqual(backend._sizes['key1'], backend._bytes)
+
+        self.region.delete('key1')
+        self.assertEqual(0, backend._bytes)
+        self.assertEqual({}, backend._sizes)
+
+    def test_dict_backend_expunge_is_bounded(self):
+        self.region.set_multi({'key%d' % i: i for i in range(100)})
+        self.time_fixture.advance_time_seconds(1)
+        backend = self.region.backend
+
+        self.region.set('key', VALUE)
+        # Only a bounded number of expired keys are expunged by a set
+        expunged = 1 + dictionary._EXPUNGE_BATCH
+        self.assertEqual(100 - expunged + 1, len(backend.cache))
+
+        backend._clear()
+        self.assertEqual(['key'], list(backend.cache))
+        self.assertEqual(1, len(backend._timeouts))
+
+    def test_dict_backend_expunge_rewritten_key(self):
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.dict', arguments={'expiration_time': 2})
+        self.region.set(KEY, 'value1')
+        self.time_fixture.advance_time_seconds(1)
+        self.region.set(KEY, 'value2')
+        self.time_fixture.advance_time_seconds(1)
+
+        # The timeout of the first value is queued but the key was set again
+        self.region.backend._clear()
+        self.assertEqual('value2', self.region.get(KEY))
+        self.assertEqual(1, len(self.region.backend._timeouts))
+
+    def test_dict_backend_timeouts_bounded(self):
+        backend = dictionary.DictCacheBackend({'expiration_time': 3600,
+                                               'max_entries': 10})
+        for i in range(1000):
+            backend.set('key%d' % (i % 20), i)
+            self.assertLessEqual(len(backend._timeouts),
+                                 2 * 10 + dictionary._EXPUNGE_BATCH)
+        self.assertEqual(10, len(backend.cache))
+
+        backend = dictionary.DictCacheBackend({'expiration_time': 3600})
+        for i in range(1000):
+            backend.set_multi({'key1': i, 'key2': i})
+            backend.delete('key2')
+        self.assertLessEqual(len(backend._timeouts),
+                             2 + dictionary._EXPUNGE_BATCH + 2)
+        self.assertEqual(i, backend.get('key1'))
+
+        # The keys set again still expire
+        self.time_fixture.advance_time_seconds(3600)
+        backend._clear()
+        self.assertEqual({}, dict(backend.cache))
+        self.assertEqual(0, len(backend._timeouts))
+
+    def test_dict_backend_get_multi_expired(self):
+        backend = self.region.backend
+        backend.set('key1', 'value1')
+        self.time_fixture.advance_time_seconds(1)
+        backend.set('key2', 'value2')
+
+        with mock.patch.object(timeutils, 'utcnow_ts',
+                               wraps=timeutils.utcnow_ts) as utcnow_ts:
+            self.assertEqual(
+                [NO_VALUE, 'value2', NO_VALUE],
+                backend.get_multi(['key1', 'key2', 'key3']))
+        # The clock is read once for all the keys
+        self.assertEqual(1, utcnow_ts.call_count)
+        self.assertEqual(['key2'], list(backend.cache))
+
+    def test_dict_backend_get_multi_moves_keys(self):
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.dict', arguments={'max_entries': 3})
+        backend = self.region.backend
+        backend.set_multi({'key1': 1, 'key2': 2, 'key3': 3})
+
+        self.assertEqual([1, NO_VALUE, 2],
+                         backend.get_multi(['key1', 'key4', 'key2']))
+        self.assertEqual(['key3', 'key1', 'key2'], list(backend.cache))
+        backend.set('key4', 4)
+        self.assertEqual(['key1', 'key2', 'key4'], list(backend.cache))
+
+    def test_dict_backend_monotonic_clock(self):
+        timeutils.clear_time_override()
+        backend = dictionary.DictCacheBackend({'expiration_time': 0.5})
+
+        with mock.patch.object(dictionary.time, 'monotonic',
+                               return_value=100.0) as monotonic:
+            backend.set(KEY, VALUE)
+            monotonic.return_value = 100.4
+            self.assertEqual(VALUE, backend.get(KEY))
+            monotonic.return_value = 100.5
+            self.assertIs(NO_VALUE, backend.get(KEY))
+
+    def test_dict_backend_coarse_clock(self):
+        timeutils.clear_time_override()
+        backend = dictionary.DictCacheBackend(
+            {'expiration_time': 0.5, 'clock': 'coarse'})
+        self.assertIs(dictionary._coarse_clock, backend._coarse_clock)
+        backend._coarse_clock = mock.Mock(now=100.0)
+
+        with mock.patch.object(dictionary.time, 'monotonic') as monotonic:
+            backend.set(KEY, VALUE)
+            self.assertEqual([VALUE], backend.get_multi([KEY]))
+            backend._coarse_clock.now = 100.5
+            self.assertIs(NO_VALUE, backend.get(KEY))
+        monotonic.assert_not_called()
+
+    def test_dict_backend_time_override_changed(self):
+        timeutils.clear_time_override()
+        backend = dictionary.DictCacheBackend({'expiration_time': 1})
+        with mock.patch.object(dictionary.time, 'monotonic',
+                               return_value=100.0) as monotonic:
+            backend.set('key1', VALUE)
+
+            # The keys keep the time-to-live left when the time is
+            # overridden
+            timeutils.set_time_override()
+            self.assertEqual(VALUE, backend.get('key1'))
+            timeutils.advance_time_seconds(0.5)
+            backend.set('key2', VALUE)
+            self.assertEqual(VALUE, backend.get('key1'))
+            timeutils.advance_time_seconds(0.6)
+            self.assertIs(NO_VALUE, backend.get('key1'))
+
+            # and when it is restored
+            timeutils.clear_time_override()
+            self.assertEqual(VALUE, backend.get('key2'))
+            monotonic.return_value = 100.5
+            self.assertIs(NO_VALUE, backend.get('key2'))
+
+    def test_dict_backend_invalid_clock(self):
+        self.assertRaises(exception.ConfigurationError,
+                          dictionary.DictCacheBackend, {'clock': 'wall'})
+
+
+class CacheShardedDictBackendTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(CacheShardedDictBackendTest, self).setUp()
+        self.time_fixture = self.useFixture(time_fixture.TimeFixture())
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.sharded_dict',
+            arguments={'expiration_time': 0.5, 'shards': 4})
+
+    def test_sharded_dict_backend(self):
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+        self.region.set(KEY, VALUE)
+        self.assertEqual(VALUE, self.region.get(KEY))
+        shard = self.region.backend._shard(KEY)
+        self.assertIn(KEY, shard.cache)
+
+        self.region.delete(KEY)
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+    def test_sharded_dict_backend_multi_keys(self):
+        mapping = {'key%d' % i: i for i in range(20)}
+        keys = sorted(mapping) + ['missing']
+        self.region.set_multi(mapping)
+        self.assertEqual([mapping[key] for key in keys[:-1]] + [NO_VALUE],
+                         self.region.get_multi(keys))
+        self.assertLess(1, len([shard for shard in self.region.backend.shards
+                                if shard.cache]))
+
+        self.region.delete_multi(keys[:10])
+        self.assertEqual([NO_VALUE] * 10 + [mapping[key]
+                                            for key in keys[10:-1]],
+                         self.region.get_multi(keys[:-1]))
+
+    def test_sharded_dict_backend_expiration_time(self):
+        self.region.set(KEY, VALUE)
+        self.time_fixture.advance_time_seconds(1)
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+    def test_sharded_dict_backend_limits(self):
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.sharded_dict',
+            arguments={'shards': 4, 'max_entries': 10, 'max_bytes': 1})
+        for shard in self.region.backend.shards:
+            self.assertEqual(3, shard.max_entries)
+            self.assertEqual(1, shard.max_bytes)
+
+    def test_sharded_dict_backend_invalid_shards(self):
+        self.assertRaises(exception.ConfigurationError,
+                          dictionary.ShardedDictCacheBackend, {'shards': 0})
+
+    def test_sharded_dict_backend_threads(self):
+        errors = []
+
+        def worker(worker_id):
+            try:
+                for i in range(200):
+                    key = 'key%d' % (i % 50)
+                    self.region.set(key, worker_id)
+                    self.region.get(key)
+                    if i % 10 == 0:
+                        self.region.delete(key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
@@ -0,0 +1,135 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+import mock
+
+from oslo_cache import _local_cache
+from oslo_cache import core as cache
+from oslo_cache.tests import test_cache
+
+
+NO_VALUE = cache.NO_VALUE
+
+
+class LocalCacheTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(LocalCacheTest, self).setUp()
+        self.local_cache = _local_cache.LocalCache(
+            expiration_time=5, max_entries=3, max_bytes=10)
+
+    def test_get_set_delete(self):
+        self.assertIs(NO_VALUE, self.local_cache.get('key'))
+        self.local_cache.set('key', b'value')
+        self.assertEqual(b'value', self.local_cache.get('key'))
+        self.local_cache.delete('key')
+        self.assertIs(NO_VALUE, self.local_cache.get('key'))
+        self.assertEqual({'hits': 1, 'misses': 2, 'evictions': 0,
+                          'expirations': 0, 'entries': 0, 'bytes': 0},
+                         self.local_cache.get_stats())
+
+    def test_expiration(self):
+        self.local_cache.set('key', b'value')
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 5):
+            self.assertIs(NO_VALUE, self.local_cache.get('key'))
+        stats = self.local_cache.get_stats()
+        self.assertEqual(1, stats['expirations'])
+        self.assertEqual(0, stats['entries'])
+
+    def test_max_entries_evicts_least_recently_used(self):
+        for key in ('key1', 'key2', 'key3'):
+            self.local_cache.set(key, b'v')
+        self.local_cache.get('key1')
+        self.local_cache.set('key4', b'v')
+        self.assertIs(NO_VALUE, self.local_cache.get('key2'))
+        for key in ('key1', 'key3', 'key4'):
+            self.assertEqual(b'v', self.local_cache.get(key))
+        self.assertEqual(1, self.local_cache.get_stats()['evictions'])
+
+    def test_max_bytes(self):
+        self.local_cache.set('key1', b'12345')
+        self.local_cache.set('key2', b'12345')
+        self.assertEqual(10, self.local_cache.get_stats()['bytes'])
+        self.local_cache.set('key2', b'123456')
+        self.assertIs(NO_VALUE, self.local_cache.get('key1'))
+        self.assertEqual(6, self.local_cache.get_stats()['bytes'])
+        # A value larger than the cache is not kept
+        self.local_cache.set('key2', b'12345678901')
+        self.assertIs(NO_VALUE, self.local_cache.get('key2'))
+        self.assertEqual(0, self.local_cache.get_stats()['bytes'])
+
+
+class LocalCacheProxyTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(LocalCacheProxyTest, self).setUp()
+        self.config_fixture.config(group='cache', local_cache_enabled=True)
+        self.region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, self.region)
+        self.proxy = cache._find_proxy(self.region,
+                                       _local_cache.LocalCacheProxy)
+        self.backend = self.proxy.proxied
+
+    def test_hot_key_read_locally(self):
+        self.region.set('key', {'value': 1})
+        with mock.patch.object(self.backend, 'get') as get:
+            value = self.region.get('key')
+            self.assertEqual({'value': 1}, value)
+            get.assert_not_called()
+        # Every reader gets its own copy
+        value['value'] = 2
+        self.assertEqual({'value': 1}, self.region.get('key'))
+
+    def test_remote_value_kept_locally(self):
+        self.backend.set(self.region.key_mangler('key'),
+                         self.region._value('value'))
+        self.assertEqual('value', self.region.get('key'))
+        self.backend.delete(self.region.key_mangler('key'))
+        self.assertEqual('value', self.region.get('key'))
+        stats = cache.get_cache_stats(self.region)['tiers']
+        self.assertEqual({'hits': 1, 'misses': 0}, stats['remote'])
+        self.assertEqual(1, stats['local']['hits'])
+
+    def test_get_multi(self):
+        self.region.set('key1', 1)
+        self.backend.set(self.region.key_mangler('key2'),
+                         self.region._value(2))
+        self.assertEqual([1, 2, NO_VALUE],
+                         self.region.get_multi(['key1', 'key2', 'key3']))
+        stats = cache.get_cache_stats(self.region)['tiers']
+        self.assertEqual({'hits': 1, 'misses': 1}, stats['remote'])
+        self.assertEqual(2, stats['local']['entries'])
+
+    def test_delete(self):
+        self.region.set_multi({'key1': 1, 'key2': 2, 'key3': 3})
+        self.region.delete('key1')
+        self.region.delete_multi(['key2'])
+        self.assertEqual([NO_VALUE, NO_VALUE, 3],
+                         self.region.get_multi(['key1', 'key2', 'key3']))
+        self.assertEqual(
+            NO_VALUE, self.backend.get(self.region.key_mangler('key1')))
+
+    def test_serialized_values(self):
+        get_serialized = self.backend.get_serialized
+        self.proxy.set_serialized('key', b'value')
+        with mock.patch.object(self.backend, 'get_serialized') as get:
+            self.assertEqual(b'value', self.proxy.get_serialized('key'))
+            get.assert_not_called()
+        self.assertEqual(b'value', get_serialized('key'))
+
+    def test_unpicklable_value(self):
+        self.region.set('key', lambda: None)
+        self.assertEqual(0, self.proxy.local_cache.get_stats()['entries'])
+        self.assertIsNotNone(self.region.get('key'))
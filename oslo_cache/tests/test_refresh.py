@@ -0,0 +1,270 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import os
+import threading
+import time
+
+import fixtures
+import mock
+
+from oslo_cache import _refresh
+from oslo_cache import core as cache
+from oslo_cache.tests import test_cache
+
+
+class EarlyRefreshTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(EarlyRefreshTest, self).setUp()
+        self.config_fixture.config(group='cache', expiration_time=300)
+        self.region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, self.region)
+        self.calls = []
+        # Every reading of the clock is 10 seconds after the previous one,
+        # the regenerations take 10 seconds.
+        self.useFixture(fixtures.MockPatchObject(
+            _refresh.time, 'monotonic',
+            side_effect=itertools.count(0, 10)))
+
+    def _memoize(self, **kwargs):
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache', **kwargs)
+
+        @memoize
+        def function(arg):
+            self.calls.append(arg)
+            return arg * 2
+        return function
+
+    def _metadata(self, function, arg):
+        key = self.region.key_mangler(
+            self.region.function_key_generator(None, function.original)(arg))
+        return self.region.backend.proxied.get(key).metadata
+
+    def test_regeneration_time_stored(self):
+        function = self._memoize(early_refresh_beta=1.0)
+        self.assertEqual(4, function(2))
+        self.assertEqual(10, self._metadata(function, 2)['d'])
+
+    def test_regenerated_early(self):
+        function = self._memoize(early_refresh_beta=1.0)
+        function(2)
+
+        # -log(1 - random()) is about 34, so the value created 340 seconds
+        # ago has expired.
+        with mock.patch.object(_refresh.random, 'random',
+                               return_value=1 - 1e-15):
+            self.assertEqual(4, function(2))
+        self.assertEqual([2, 2], self.calls)
+
+        with mock.patch.object(_refresh.random, 'random',
+                               return_value=0.5):
+            self.assertEqual(4, function(2))
+        self.assertEqual([2, 2], self.calls)
+
+    def test_beta(self):
+        function = self._memoize(early_refresh_beta=0.5)
+        function(2)
+
+        with mock.patch.object(_refresh.random, 'random',
+                               return_value=1 - 1e-15):
+            self.assertEqual(4, function(2))
+        self.assertEqual([2], self.calls)
+
+    def test_disabled(self):
+        function = self._memoize()
+        function(2)
+        self.assertIsNone(cache._find_proxy(self.region,
+                                            _refresh.RefreshProxy))
+
+        early = self._memoize(early_refresh_beta=1.0)
+        early(3)
+        function(4)
+        self.assertNotIn('d', self._metadata(function, 4))
+        with mock.patch.object(_refresh.random, 'random',
+                               return_value=1 - 1e-15):
+            function(4)
+        self.assertEqual([2, 3, 4], self.calls)
+
+    def test_nested_function_not_refreshed_early(self):
+        inner = self._memoize()
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache',
+            early_refresh_beta=1.0)
+
+        @memoize
+        def outer(arg):
+            return inner(arg + 1)
+
+        self.assertEqual(6, outer(2))
+        self.assertNotIn('d', self._metadata(inner, 3))
+        self.assertEqual(10, self._metadata(outer, 2)['d'])
+
+        outer.invalidate(2)
+        with mock.patch.object(_refresh.random, 'random',
+                               return_value=1 - 1e-15):
+            self.assertEqual(6, outer(2))
+        self.assertEqual([3], self.calls)
+
+    def test_proxy_wrapped_once(self):
+        self._memoize(early_refresh_beta=1.0)(2)
+        self._memoize(early_refresh_beta=1.0)(3)
+        backend = self.region.backend
+        count = 0
+        while hasattr(backend, 'proxied'):
+            count += isinstance(backend, _refresh.RefreshProxy)
+            backend = backend.proxied
+        self.assertEqual(1, count)
+
+
+class StaleWhileRevalidateTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(StaleWhileRevalidateTest, self).setUp()
+        self.config_fixture.config(group='cache', expiration_time=300)
+        self.region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, self.region)
+        self.now = 1000.0
+        self.useFixture(fixtures.MockPatch('time.time',
+                                           side_effect=lambda: self.now))
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def _memoize(self, **kwargs):
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache', **kwargs)
+
+        @memoize
+        def function(arg):
+            self.calls.append(arg)
+            self.release.wait(5)
+            return '%s-%d' % (arg, len(self.calls))
+        return function, memoize.refresher
+
+    def _wait_for(self, refresher, **stats):
+        deadline = time.monotonic() + 5
+        while not stats.items() <= refresher.get_stats().items():
+            if time.monotonic() > deadline:
+                raise AssertionError('Timed out')
+            time.sleep(0.001)
+
+    def test_stale_value_returned(self):
+        function, refresher = self._memoize(stale_while_revalidate=True)
+        self.assertEqual('a-1', function('a'))
+
+        self.now += 400
+        self.assertEqual('a-1', function('a'))
+        self._wait_for(refresher, refreshes=1)
+        self.assertEqual('a-2', function('a'))
+        self.assertEqual(['a', 'a'], self.calls)
+        self.assertEqual({'refreshes': 1, 'skipped': 0, 'errors': 0},
+                         refresher.get_stats())
+
+    def test_refresh_skipped_when_pool_busy(self):
+        self.config_fixture.config(group='cache', refresh_pool_size=1)
+        function, refresher = self._memoize(stale_while_revalidate=True)
+        function('a')
+        function('b')
+
+        self.now += 400
+        self.release.clear()
+        self.assertEqual('a-1', function('a'))
+        self.assertEqual('b-2', function('b'))
+        self._wait_for(refresher, skipped=1)
+        self.release.set()
+        self._wait_for(refresher, refreshes=1)
+        self.assertEqual('b-2', function('b'))
+        self._wait_for(refresher, refreshes=2)
+        self.assertEqual(['a', 'b', 'a', 'b'], self.calls)
+
+    def test_refresh_error(self):
+        function, refresher = self._memoize(stale_while_revalidate=True)
+        function('a')
+
+        self.now += 400
+        self.calls = None
+        self.assertEqual('a-1', function('a'))
+        self._wait_for(refresher, errors=1)
+
+    def test_max_staleness(self):
+        self.config_fixture.config(group='cache', max_staleness=100)
+        function, refresher = self._memoize(stale_while_revalidate=True)
+        function('a')
+
+        self.now += 350
+        self.assertEqual('a-1', function('a'))
+        self._wait_for(refresher, refreshes=1)
+
+        # The value is regenerated before returning once too old
+        self.now += 500
+        self.assertEqual('a-3', function('a'))
+        self.assertEqual({'refreshes': 1, 'skipped': 0, 'errors': 0},
+                         refresher.get_stats())
+
+    def test_nested_function_not_stale(self):
+        inner = self._memoize()[0]
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache',
+            stale_while_revalidate=True)
+
+        @memoize
+        def outer(arg):
+            return inner(arg)
+
+        self.assertEqual('a-1', outer('a'))
+        self.now += 400
+        outer.invalidate('a')
+
+        # The expired value of inner is regenerated before returning
+        self.assertEqual('a-2', outer('a'))
+        self.assertEqual({'refreshes': 0, 'skipped': 0, 'errors': 0},
+                         memoize.refresher.get_stats())
+
+    def test_refresh_in_flight_dropped_after_fork(self):
+        refresher = _refresh.Refresher(lambda: 1, lambda value: True)
+        region = mock.Mock()
+        mutex = threading.Lock()
+        mutex.acquire()
+        self.release.clear()
+        refresher.submit(region, 'key', lambda: self.release.wait(5), mutex)
+
+        pid = os.fork()
+        if not pid:
+            # NOTE: the child exits without running the test runner.
+            status = 1
+            try:
+                # The mutex of the refresh in flight in the parent is
+                # released and the child refreshes the values itself.
+                if mutex.acquire(False):
+                    refreshed = threading.Event()
+                    refresher.submit(region, 'key', refreshed.set, mutex)
+                    if refreshed.wait(5):
+                        status = 0
+            finally:
+                os._exit(status)
+        _pid, status = os.waitpid(pid, 0)
+        self.release.set()
+        self.assertEqual(0, status)
+        self._wait_for(refresher, refreshes=1)
+
+    def test_disabled(self):
+        function, refresher = self._memoize()
+        self.assertIsNone(refresher)
+        swr_function = self._memoize(stale_while_revalidate=True)[0]
+        swr_function('a')
+        function('b')
+
+        self.now += 400
+        self.assertEqual('b-3', function('b'))
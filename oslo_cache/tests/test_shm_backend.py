@@ -0,0 +1,200 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+from dogpile.cache import region as dp_region
+import fixtures
+from oslo_utils import fixture as time_fixture
+
+from oslo_cache.backends import shm
+from oslo_cache import core
+from oslo_cache import exception
+from oslo_cache.tests import test_cache
+
+
+NO_VALUE = core.NO_VALUE
+KEY = 'test_key'
+VALUE = 'test_value'
+
+
+class CacheSharedMemoryBackendTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(CacheSharedMemoryBackendTest, self).setUp()
+        self.time_fixture = self.useFixture(time_fixture.TimeFixture())
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'cache')
+        self.region = dp_region.make_region()
+        self.region.configure(
+            'oslo_cache.shm',
+            arguments={'path': self.path, 'slots': 16, 'slot_size': 256,
+                       'expiration_time': 0.5})
+
+    def _backend(self, **arguments):
+        arguments.setdefault('path', self.path)
+        arguments.setdefault('slots', 16)
+        arguments.setdefault('slot_size', 256)
+        return shm.SharedMemoryCacheBackend(arguments)
+
+    def test_shm_backend(self):
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+        self.region.set(KEY, VALUE)
+        self.assertEqual(VALUE, self.region.get(KEY))
+
+        self.region.delete(KEY)
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+    def test_shm_backend_multi(self):
+        mapping = {'key1': 'value1', 'key2': {'key': 'value2'}}
+        self.region.set_multi(mapping)
+        self.assertEqual(['value1', {'key': 'value2'}, NO_VALUE],
+                         self.region.get_multi(['key1', 'key2', 'key3']))
+
+        self.region.delete_multi(['key1', 'key2'])
+        self.assertEqual([NO_VALUE, NO_VALUE],
+                         self.region.get_multi(['key1', 'key2']))
+
+    def test_shm_backend_expiration_time(self):
+        self.region.set(KEY, VALUE)
+        self.assertEqual(VALUE, self.region.get(KEY))
+
+        self.time_fixture.advance_time_seconds(1)
+        self.assertIs(NO_VALUE, self.region.get(KEY))
+
+    def test_shm_backend_shared(self):
+        backend = self._backend()
+        other = self._backend()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        backend.set(KEY, VALUE)
+        self.assertEqual(VALUE, other.get(KEY))
+        other.set(KEY, 'other_value')
+        self.assertEqual('other_value', backend.get(KEY))
+        other.delete(KEY)
+        self.assertIs(NO_VALUE, backend.get(KEY))
+
+    def test_shm_backend_shared_lock(self):
+        backend = self._backend()
+        other = self._backend()
+        link = self.path + '.link'
+        os.link(self.path, link)
+        linked = self._backend(path=link)
+        unrelated = self._backend(path=self.path + '.unrelated')
+        self.assertIsNot(backend._lock, unrelated._lock)
+
+        # The file locks of the process do not exclude the backends using
+        # the same file from each other.
+        with backend._locked(0):
+            self.assertFalse(other._lock.acquire(False))
+            self.assertFalse(linked._lock.acquire(False))
+        self.assertTrue(other._lock.acquire(False))
+        other._lock.release()
+
+    def test_shm_backend_shared_with_forked_process(self):
+        backend = self._backend()
+        backend.set('parent', VALUE)
+
+        pid = os.fork()
+        if not pid:
+            # NOTE: the child exits without running the test runner.
+            status = 1
+            try:
+                child = self._backend()
+                if child.get('parent') == VALUE:
+                    child.set('child', 'child_value')
+                    status = 0
+            finally:
+                os._exit(status)
+        _pid, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual('child_value', backend.get('child'))
+
+    def test_shm_backend_rejects_symlink(self):
+        self._backend()
+        link = self.path + '.symlink'
+        os.symlink(self.path, link)
+        self.assertRaises(exception.ConfigurationError,
+                          self._backend, path=link)
+
+    def test_shm_backend_rejects_file_writable_by_others(self):
+        self._backend()
+        for mode in (0o620, 0o602):
+            os.chmod(self.path, mode)
+            self.assertRaises(exception.ConfigurationError, self._backend)
+
+    def test_shm_backend_rejects_file_of_other_user(self):
+        self._backend()
+        self.useFixture(fixtures.MockPatch(
+            'oslo_cache.backends.shm.os.geteuid',
+            return_value=os.stat(self.path).st_uid + 1))
+        self.assertRaises(exception.ConfigurationError, self._backend)
+
+    def test_shm_backend_evicts_least_recently_used(self):
+        backend = self._backend(path=self.path + '.lru', slots=4)
+        for index in range(4):
+            self.time_fixture.advance_time_seconds(1)
+            backend.set('key%d' % index, index)
+        self.time_fixture.advance_time_seconds(1)
+        self.assertEqual(0, backend.get('key0'))
+
+        self.time_fixture.advance_time_seconds(1)
+        backend.set('key4', 4)
+        self.assertEqual([0, NO_VALUE, 2, 3, 4],
+                         backend.get_multi(['key%d' % index
+                                            for index in range(5)]))
+
+    def test_shm_backend_value_too_large(self):
+        backend = self._backend()
+        backend.set(KEY, VALUE)
+
+        backend.set(KEY, 'x' * 256)
+        self.assertIs(NO_VALUE, backend.get(KEY))
+
+    def test_shm_backend_unpicklable_value(self):
+        backend = self._backend()
+        backend.set(KEY, VALUE)
+
+        backend.set(KEY, lambda: None)
+        self.assertIs(NO_VALUE, backend.get(KEY))
+
+    def test_shm_backend_bytes_key(self):
+        backend = self._backend()
+        backend.set(b'key', VALUE)
+        self.assertEqual(VALUE, backend.get('key'))
+
+    def test_shm_backend_requires_path(self):
+        self.assertRaises(exception.ConfigurationError,
+                          shm.SharedMemoryCacheBackend, {})
+
+    def test_shm_backend_invalid_slots(self):
+        self.assertRaises(exception.ConfigurationError,
+                          self._backend, slots=0)
+        self.assertRaises(exception.ConfigurationError,
+                          self._backend, slot_size=16)
+
+    def test_shm_backend_rounds_slots(self):
+        backend = self._backend(path=self.path + '.rounded', slots=5)
+        self.assertEqual(8, backend.slots)
+
+    def test_shm_backend_different_layout(self):
+        self._backend()
+        self.assertRaises(exception.ConfigurationError,
+                          self._backend, slots=32)
+
+    def test_shm_backend_not_a_cache(self):
+        path = self.path + '.other'
+        with open(path, 'wb') as f:
+            f.write(b'not a cache file')
+        self.assertRaises(exception.ConfigurationError,
+                          self._backend, path=path)
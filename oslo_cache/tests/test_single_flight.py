@@ -0,0 +1,405 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+import mock
+
+from oslo_cache import _single_flight
+from oslo_cache import core as cache
+from oslo_cache.tests import test_cache
+
+
+NO_VALUE = cache.NO_VALUE
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.001)
+
+
+class _Interrupted(BaseException):
+    """Exception not derived from Exception, as the eventlet Timeout."""
+
+
+class _Blocking(object):
+    """Function blocking until released, recording its calls."""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, arg):
+        self.calls.append(arg)
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, BaseException):
+            raise self.result
+        return self.result(arg)
+
+
+class SingleFlightTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(SingleFlightTest, self).setUp()
+        self.flight = _single_flight.SingleFlight()
+        self.results = []
+
+    def _start(self, func, *args):
+        thread = threading.Thread(
+            target=lambda: self.results.append(func(*args)))
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def test_do_coalesces_concurrent_calls(self):
+        func = _Blocking(lambda key: key.upper())
+        leader = self._start(self.flight.do, 'key', func)
+        func.started.wait(5)
+        follower = self._start(self.flight.do, 'key', func)
+        _wait_for(lambda: self.flight.get_stats()['coalesced'] == 1)
+
+        func.release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(['KEY', 'KEY'], self.results)
+        self.assertEqual(['key'], func.calls)
+        self.assertEqual({'calls': 1, 'coalesced': 1},
+                         self.flight.get_stats())
+
+        # The call is done, the next one calls the function again
+        self.assertEqual('KEY', self.flight.do('key', lambda key: 'KEY'))
+        self.assertEqual(2, self.flight.get_stats()['calls'])
+
+    def test_do_copies_result(self):
+        self.flight = _single_flight.SingleFlight(copy=True)
+        func = _Blocking(lambda key: [key])
+        leader = self._start(self.flight.do, 'key', func)
+        func.started.wait(5)
+        followers = [self._start(self.flight.do, 'key', func)
+                     for _ in range(2)]
+        _wait_for(lambda: self.flight.get_stats()['coalesced'] == 2)
+
+        func.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual([['key']] * 3, self.results)
+        # Every caller can mutate its own result
+        self.results[0].append('mutated')
+        self.assertEqual([['key']] * 2, self.results[1:])
+        self.assertIsNot(self.results[1], self.results[2])
+
+    def test_do_shares_exception(self):
+        func = _Blocking(ValueError('failed'))
+        errors = []
+
+        def call():
+            try:
+                self.flight.do('key', func)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        func.started.wait(5)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        _wait_for(lambda: self.flight.get_stats()['coalesced'] == 1)
+        func.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, len(errors))
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(['key'], func.calls)
+
+    def test_do_shares_base_exception(self):
+        func = _Blocking(_Interrupted())
+        errors = []
+
+        def call():
+            try:
+                self.flight.do('key', func)
+            except _Interrupted as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        func.started.wait(5)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        _wait_for(lambda: self.flight.get_stats()['coalesced'] == 1)
+        func.release.set()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(2, len(errors))
+
+        # The next call calls the function again
+        self.assertEqual('KEY', self.flight.do('key', lambda key: 'KEY'))
+
+    def test_do_multi_calls_for_keys_not_in_flight(self):
+        func = _Blocking(lambda keys: [key.upper() for key in keys])
+        self._start(self.flight.do_multi, ['key1', 'key2'], func)
+        func.started.wait(5)
+
+        multi_calls = []
+
+        def get_multi(keys):
+            multi_calls.append(keys)
+            return [key.upper() for key in keys]
+
+        follower = self._start(self.flight.do_multi,
+                               ['key2', 'key3', 'key3'], get_multi)
+        _wait_for(lambda: self.flight.get_stats()['coalesced'] == 1)
+        self.assertEqual([['key3']], multi_calls)
+
+        func.release.set()
+        follower.join()
+        self.assertIn(['KEY2', 'KEY3', 'KEY3'], self.results)
+        self.assertEqual({'calls': 3, 'coalesced': 1},
+                         self.flight.get_stats())
+
+    def test_forget(self):
+        func = _Blocking(lambda key: 'old')
+        self._start(self.flight.do, 'key', func)
+        func.started.wait(5)
+
+        self.flight.forget('key')
+        self.assertEqual('new', self.flight.do('key', lambda key: 'new'))
+        func.release.set()
+
+
+class SingleFlightProxyTest(test_cache.BaseTestCase):
+
+    def setUp(self):
+        super(SingleFlightProxyTest, self).setUp()
+        self.config_fixture.config(group='cache', single_flight_enabled=True)
+        self.region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, self.region)
+        self.proxy = cache._find_proxy(self.region,
+                                       _single_flight.SingleFlightProxy)
+        self.backend = self.proxy.proxied
+
+    def test_concurrent_gets_read_backend_once(self):
+        self.region.set('key', 'value')
+        get = _Blocking(self.backend.get)
+        self.backend.get = get
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.region.get('key')))
+            for _ in range(3)]
+        threads[0].start()
+        get.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        _wait_for(lambda: self.proxy.get_stats()['coalesced'] == 2)
+        get.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['value'] * 3, results)
+        self.assertEqual(1, len(get.calls))
+        self.assertEqual({'reads': 1, 'coalesced': 2, 'lock_waits': 0,
+                          'handoffs': 0},
+                         cache.get_cache_stats(self.region)['single_flight'])
+
+    def test_set_not_hidden_by_read_in_flight(self):
+        get = _Blocking(self.backend.get)
+        self.backend.get = get
+        thread = threading.Thread(target=self.region.get, args=('key',))
+        thread.start()
+        get.started.wait(5)
+
+        self.region.set('key', 'value')
+        get.release.set()
+        self.assertEqual('value', self.region.get('key'))
+        thread.join()
+
+    def test_memoized_function_regenerated_once(self):
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        @memoize
+        def function(arg):
+            calls.append(arg)
+            started.set()
+            release.wait(5)
+            return arg * 2
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(function(2)))
+                   for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        _wait_for(lambda: self.proxy.get_stats()['lock_waits'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([4] * 3, results)
+        self.assertEqual([2], calls)
+        # The waiting threads got the value set without reading the backend
+        self.assertEqual(2, self.proxy.get_stats()['handoffs'])
+        self.assertEqual({}, self.proxy._handoffs)
+        self.assertEqual({}, self.proxy._waiters)
+
+    def _configure_without_copies(self):
+        # NOTE: CacheIsolatingProxy would copy the values read.
+        self.config_fixture.config(group='cache', proxies=[])
+        self.region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, self.region)
+        self.proxy = cache._find_proxy(self.region,
+                                       _single_flight.SingleFlightProxy)
+        self.backend = self.proxy.proxied
+
+    def test_waiters_get_own_copy(self):
+        self._configure_without_copies()
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache')
+        started = threading.Event()
+        release = threading.Event()
+
+        @memoize
+        def function(arg):
+            started.set()
+            release.wait(5)
+            return {'arg': arg}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(function(2)))
+                   for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        _wait_for(lambda: self.proxy.get_stats()['lock_waits'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(2, self.proxy.get_stats()['handoffs'])
+        results[0]['arg'] = 'mutated'
+        self.assertEqual([{'arg': 2}] * 2, results[1:])
+        self.assertIsNot(results[1], results[2])
+
+    def test_concurrent_gets_get_own_copy(self):
+        self._configure_without_copies()
+        self.region.set('key', ['value'])
+        get = _Blocking(self.backend.get)
+        self.backend.get = get
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.region.get('key')))
+            for _ in range(3)]
+        threads[0].start()
+        get.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        _wait_for(lambda: self.proxy.get_stats()['coalesced'] == 2)
+        get.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([['value']] * 3, results)
+        self.assertEqual(3, len(set(id(value) for value in results)))
+
+    def test_interrupted_creator(self):
+        memoize = cache.get_memoization_decorator(
+            self.config_fixture.conf, self.region, group='cache')
+        calls = []
+
+        @memoize
+        def function(arg):
+            calls.append(arg)
+            if len(calls) == 1:
+                raise _Interrupted()
+            return arg * 2
+
+        self.assertRaises(_Interrupted, function, 2)
+        thread = threading.Thread(target=function, args=(2,))
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(4, function(2))
+        self.assertEqual([2, 2], calls)
+
+    def test_delete_drops_handoff(self):
+        mutex = self.region.backend.get_mutex('key')
+        other = self.region.backend.get_mutex('key')
+        self.assertTrue(mutex.acquire())
+
+        def wait():
+            other.acquire()
+            other.release()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        _wait_for(lambda: self.proxy._waiters)
+
+        self.region.backend.set('key', 'value')
+        self.assertEqual('value', self.region.backend.get('key'))
+        self.assertEqual(1, self.proxy.get_stats()['handoffs'])
+        self.region.backend.delete('key')
+        self.assertIs(NO_VALUE, self.region.backend.get('key'))
+        mutex.release()
+        thread.join()
+        self.assertEqual({}, self.proxy._waiters)
+
+    def test_mutex_shared_by_regions(self):
+        region = cache.create_region()
+        cache.configure_cache_region(self.config_fixture.conf, region)
+        mutex = self.region.backend.get_mutex('key')
+        other = region.backend.get_mutex('key')
+
+        self.assertTrue(mutex.acquire(False))
+        self.assertFalse(other.acquire(False))
+        mutex.release()
+        self.assertTrue(other.acquire(False))
+        other.release()
+
+    def test_backend_mutex_acquired_after_process_mutex(self):
+        backend_mutex = mock.Mock()
+        backend_mutex.acquire.return_value = True
+        self.backend.get_mutex = lambda key: backend_mutex
+        mutex = self.region.backend.get_mutex('key')
+        other = self.region.backend.get_mutex('key')
+
+        self.assertTrue(mutex.acquire())
+        backend_mutex.acquire.assert_called_once_with(True)
+        # Only one thread of the process waits for the backend mutex
+        self.assertFalse(other.acquire(False))
+        backend_mutex.acquire.assert_called_once_with(True)
+        mutex.release()
+        backend_mutex.release.assert_called_once_with()
+
+        backend_mutex.acquire.side_effect = _Interrupted()
+        self.assertRaises(_Interrupted, other.acquire)
+        self.assertTrue(mutex._lock.acquire(False))
+        mutex._lock.release()
+
+        backend_mutex.acquire.side_effect = None
+        backend_mutex.acquire.return_value = False
+        self.assertFalse(other.acquire(False))
+        # The process mutex is released when the backend one is not acquired
+        self.assertTrue(mutex._lock.acquire(False))
+        mutex._lock.release()
@@ -0,0 +1,71 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from dogpile.cache import api
+
+from oslo_cache import _stats
+from oslo_cache.tests import test_cache
+
+
+class TestHistogram(test_cache.BaseTestCase):
+
+    def test_snapshot(self):
+        histogram = _stats.Histogram(buckets=(1, 10))
+        for value in (0.5, 1, 5, 20):
+            histogram.observe(value)
+        self.assertEqual({
+            'count': 4,
+            'sum': 26.5,
+            'max': 20,
+            'buckets': [(1, 2), (10, 1), (float('inf'), 1)],
+        }, histogram.snapshot())
+
+    def test_empty_snapshot(self):
+        snapshot = _stats.Histogram().snapshot()
+        self.assertEqual(0, snapshot['count'])
+        self.assertEqual(len(_stats.LATENCY_BUCKETS) + 1,
+                         len(snapshot['buckets']))
+
+
+class TestCacheStats(test_cache.BaseTestCase):
+
+    def test_approximate_size(self):
+        self.assertEqual(3, _stats.approximate_size(b'abc'))
+        self.assertEqual(
+            5, _stats.approximate_size(api.CachedValue('value', {})))
+        self.assertLess(0, _stats.approximate_size(api.CachedValue({}, {})))
+
+    def test_bind_namespace(self):
+        def get_namespace():
+            return _stats.current_namespace()
+
+        bound = _stats.bind_namespace('inner', get_namespace)
+        self.assertEqual('inner', bound())
+        nested = _stats.bind_namespace(
+            'outer', lambda: (bound(), get_namespace()))
+        self.assertEqual(('inner', 'outer'), nested())
+        self.assertEqual(_stats.NO_NAMESPACE, _stats.current_namespace())
+
+    def test_snapshot(self):
+        stats = _stats.CacheStats()
+        stats.record_get(0.001, [b'a'], 2)
+        stats.record_set(0.002, [b'a', b'b'])
+        stats.record_delete(0.003, 4)
+        snapshot = stats.snapshot()
+        self.assertEqual(1, snapshot['hits'])
+        self.assertEqual(2, snapshot['misses'])
+        self.assertEqual(2, snapshot['sets'])
+        self.assertEqual(4, snapshot['deletes'])
+        self.assertEqual({_stats.NO_NAMESPACE: {
+            'hits': 1, 'misses': 2, 'sets': 2, 'deletes': 4}},
+            snapshot['namespaces'])
+        self.assertEqual(3, snapshot['value_size']['count'])
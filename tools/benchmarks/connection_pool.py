@@ -0,0 +1,91 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the memcache connection pool implementations.
+
+Every thread acquires and releases a connection in a loop. The connections
+are plain objects, so only the cost of the pool itself is measured::
+
+    python tools/benchmarks/connection_pool.py --threads 1 8 64 256
+"""
+
+import argparse
+import threading
+import time
+
+from oslo_cache import _memcache_pool
+
+
+class _Connection(object):
+    pass
+
+
+class QueuePool(_memcache_pool.ConnectionPool):
+    def _create_connection(self):
+        return _Connection()
+
+    def _destroy_connection(self, conn):
+        pass
+
+
+class LifoPool(_memcache_pool.LifoConnectionPool):
+    def _create_connection(self):
+        return _Connection()
+
+    def _destroy_connection(self, conn):
+        pass
+
+
+POOLS = {'queue': QueuePool, 'lifo': LifoPool}
+
+
+def run(pool_class, threads, iterations, maxsize):
+    pool = pool_class(maxsize=maxsize, unused_timeout=60,
+                      conn_get_timeout=None)
+    start = threading.Barrier(threads + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(iterations):
+            with pool.acquire():
+                pass
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    begin = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    return threads * iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32, 64, 128, 256])
+    parser.add_argument('--iterations', type=int, default=20000,
+                        help='acquire/release cycles per thread')
+    parser.add_argument('--maxsize', type=int, default=10)
+    args = parser.parse_args()
+
+    print('%8s %14s %14s' % ('threads', 'queue ops/s', 'lifo ops/s'))
+    for threads in args.threads:
+        iterations = max(args.iterations // threads, 100)
+        results = [run(POOLS[name], threads, iterations, args.maxsize)
+                   for name in ('queue', 'lifo')]
+        print('%8d %14.0f %14.0f' % ((threads,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
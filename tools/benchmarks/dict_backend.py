@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the latency of the dict backend as the cache grows.
+
+The cache is filled with keys which do not expire during the run, then the
+latency of set and get is measured, for single keys and for batches of
+``--batch`` keys (per key)::
+
+    python tools/benchmarks/dict_backend.py --sizes 1000 10000 100000
+
+``--clock`` selects the clock measuring the time-to-live of the keys.
+"""
+
+import argparse
+import time
+
+from oslo_cache.backends import dictionary
+
+
+def run(size, iterations, batch, clock):
+    backend = dictionary.DictCacheBackend(
+        {'expiration_time': 3600, 'clock': clock})
+    backend.set_multi({'key%d' % i: i for i in range(size)})
+    keys = ['key%d' % (i % size) for i in range(iterations)]
+
+    begin = time.perf_counter()
+    for key in keys:
+        backend.set(key, 'value')
+    set_latency = (time.perf_counter() - begin) / iterations * 1e6
+
+    begin = time.perf_counter()
+    for key in keys:
+        backend.get(key)
+    get_latency = (time.perf_counter() - begin) / iterations * 1e6
+
+    batches = [keys[i:i + batch] for i in range(0, iterations, batch)]
+    mappings = [dict.fromkeys(keys, 'value') for keys in batches]
+    begin = time.perf_counter()
+    for mapping in mappings:
+        backend.set_multi(mapping)
+    set_multi_latency = (time.perf_counter() - begin) / iterations * 1e6
+
+    begin = time.perf_counter()
+    for keys in batches:
+        backend.get_multi(keys)
+    get_multi_latency = (time.perf_counter() - begin) / iterations * 1e6
+    return set_latency, get_latency, set_multi_latency, get_multi_latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--clock', choices=dictionary._CLOCKS,
+                        default='monotonic')
+    args = parser.parse_args()
+
+    print('%10s %10s %10s %12s %12s' % (
+        'keys', 'set us', 'get us', 'set_multi us', 'get_multi us'))
+    for size in args.sizes:
+        print('%10d %10.2f %10.2f %12.2f %12.2f' % (
+            (size,) + run(size, args.iterations, args.batch, args.clock)))
+
+
+if __name__ == '__main__':
+    main()
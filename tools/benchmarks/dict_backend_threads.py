@@ -0,0 +1,85 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the dict backends under concurrent access.
+
+Every thread reads and writes random keys, with one write for every
+``--read-ratio`` reads::
+
+    python tools/benchmarks/dict_backend_threads.py --threads 1 8 64
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from oslo_cache.backends import dictionary
+
+
+BACKENDS = {
+    'dict': dictionary.DictCacheBackend,
+    'sharded_dict': dictionary.ShardedDictCacheBackend,
+}
+
+
+def run(backend_class, threads, iterations, keys, read_ratio):
+    backend = backend_class({'expiration_time': 3600})
+    backend.set_multi({'key%d' % i: i for i in range(keys)})
+    start = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        operations = random.Random(seed)
+        names = ['key%d' % operations.randrange(keys)
+                 for _ in range(iterations)]
+        start.wait()
+        for i, key in enumerate(names):
+            if i % (read_ratio + 1):
+                backend.get(key)
+            else:
+                backend.set(key, i)
+
+    workers = [threading.Thread(target=worker, args=(seed,))
+               for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    begin = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    return threads * iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--iterations', type=int, default=200000,
+                        help='operations shared by all the threads')
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--read-ratio', type=int, default=9)
+    args = parser.parse_args()
+
+    names = sorted(BACKENDS)
+    print('%8s' % 'threads' + ''.join('%20s' % ('%s ops/s' % name)
+                                      for name in names))
+    for threads in args.threads:
+        iterations = max(args.iterations // threads, 100)
+        results = [run(BACKENDS[name], threads, iterations, args.keys,
+                       args.read_ratio) for name in names]
+        print('%8d' % threads + ''.join('%20.0f' % result
+                                        for result in results))
+
+
+if __name__ == '__main__':
+    main()
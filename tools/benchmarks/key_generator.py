@@ -0,0 +1,81 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the key generators with the ones of dogpile.cache.
+
+Both generate the same keys, only the cost per call is measured::
+
+    python tools/benchmarks/key_generator.py --iterations 200000
+"""
+
+import argparse
+import time
+import uuid
+
+from dogpile.cache import util
+
+from oslo_cache import core
+
+
+class Manager(object):
+    def get_user(self, user_id):
+        pass
+
+    def list_role_assignments(self, user_id, project_id, effective=False):
+        pass
+
+
+CASES = [
+    ('one str', Manager.get_user, (Manager(), uuid.uuid4().hex), {}),
+    ('uuid', Manager.get_user, (Manager(), uuid.uuid4()), {}),
+    ('three args', Manager.list_role_assignments,
+     (Manager(), uuid.uuid4().hex, uuid.uuid4().hex, True), {}),
+    ('kwargs', Manager.list_role_assignments,
+     (Manager(), uuid.uuid4().hex), {'project_id': uuid.uuid4().hex}),
+]
+
+
+def run(generate_key, args, kwargs, iterations):
+    begin = time.perf_counter()
+    for _ in range(iterations):
+        generate_key(*args, **kwargs)
+    return (time.perf_counter() - begin) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    print('%12s %10s %14s %14s' % ('arguments', 'generator', 'dogpile ns',
+                                   'oslo.cache ns'))
+    for name, fn, call_args, call_kwargs in CASES:
+        for generator, dogpile_generator in (
+                (core.function_key_generator, util.function_key_generator),
+                (core.kwarg_function_key_generator,
+                 util.kwarg_function_key_generator)):
+            if call_kwargs and generator is core.function_key_generator:
+                continue
+            results = [
+                run(dogpile_generator(None, fn,
+                                      to_str=core._key_generate_to_str),
+                    call_args, call_kwargs, args.iterations),
+                run(generator(None, fn), call_args, call_kwargs,
+                    args.iterations),
+            ]
+            print('%12s %10s %14.0f %14.0f' % (
+                (name, 'kwarg' if 'kwarg' in generator.__name__ else
+                 'default') + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the cost of the key manglers.
+
+The keys look like the ones generated for memoized functions::
+
+    python tools/benchmarks/key_mangler.py --iterations 200000
+"""
+
+import argparse
+import time
+import uuid
+
+from oslo_cache import core
+
+
+def run(key_mangler, keys, iterations):
+    begin = time.perf_counter()
+    for _ in range(iterations // len(keys)):
+        for key in keys:
+            key_mangler(key)
+    return (time.perf_counter() - begin) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    keys = ['keystone.identity.core:get_user|%s' % uuid.uuid4().hex
+            for _ in range(100)]
+    keys += ['keystone.assignment.core:list_role_assignments|%s %s True' %
+             (uuid.uuid4().hex, uuid.uuid4().hex) for _ in range(100)]
+    print('%10s %10s %12s' % ('mangler', 'ns/key', 'key length'))
+    for name, key_mangler in sorted(core._KEY_MANGLERS.items()):
+        print('%10s %10.0f %12d' % (name, run(key_mangler, keys,
+                                              args.iterations),
+                                    len(key_mangler(keys[0]))))
+
+
+if __name__ == '__main__':
+    main()
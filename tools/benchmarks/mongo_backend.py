@@ -0,0 +1,144 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Measure the round trips and time of the MongoDB backend set_multi.
+
+The backend talks to an in-process stand-in of mongod which sleeps
+``--latency`` milliseconds for every round trip, half of the keys of every
+mapping being already cached. The bulk upsert of the backend is compared
+with the find, insert and save per document of the previous releases::
+
+    python tools/benchmarks/mongo_backend.py --keys 10 200 2000
+"""
+
+import argparse
+import time
+
+from dogpile.cache import api
+
+from oslo_cache.backends import mongo
+
+
+class StandInCollection(object):
+    """Collection keeping the documents in a dict, counting round trips."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.documents = {}
+        self.round_trips = 0
+        self.write_concern = {}
+
+    def _round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def index_information(self):
+        return {}
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def find(self, spec=None, **kwargs):
+        self._round_trip()
+        keys = spec['_id']['$in']
+        return [dict(self.documents[key]) for key in keys
+                if key in self.documents]
+
+    def insert(self, docs, **kwargs):
+        self._round_trip()
+        for doc in docs:
+            self.documents[doc['_id']] = doc
+
+    def save(self, doc, **kwargs):
+        self._round_trip()
+        self.documents[doc['_id']] = doc
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        self._round_trip()
+        for request in requests:
+            self.documents[request._filter['_id']] = request._doc
+
+
+class StandInDatabase(object):
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+def legacy_set_multi(client, mapping):
+    """set_multi of the previous releases, reading the keys first."""
+    doc_date = client._get_doc_date()
+    insert_refs = []
+    update_refs = []
+    existing_docs = client._get_results_as_dict(list(mapping.keys()))
+    for key, value in mapping.items():
+        ref = client._get_cache_entry(key, value.payload, value.metadata,
+                                      doc_date)
+        if key in existing_docs:
+            update_refs.append(ref)
+        else:
+            insert_refs.append(ref)
+    if insert_refs:
+        client.get_cache_collection().insert(insert_refs, manipulate=True)
+    for upd_doc in update_refs:
+        client.get_cache_collection().save(upd_doc, manipulate=True)
+
+
+def run(set_multi, keys, latency, iterations):
+    collection = StandInCollection(latency)
+    backend = mongo.MongoCacheBackend({'db_hosts': 'localhost',
+                                       'db_name': 'cache',
+                                       'cache_collection': 'cache'})
+    mongo.MongoApi._DB = {backend.api._get_db_key():
+                          StandInDatabase(collection)}
+    mongo.MongoApi._MONGO_COLLS = {}
+    client = backend.client
+    elapsed = 0.0
+    for i in range(iterations):
+        # half of the keys were cached by the previous iteration
+        first = i * keys // 2
+        mapping = {'key%d' % n: api.CachedValue(n, {'v': 1, 'ct': 0})
+                   for n in range(first, first + keys)}
+        collection.round_trips = 0
+        start = time.perf_counter()
+        set_multi(client, mapping)
+        elapsed += time.perf_counter() - start
+    return collection.round_trips, elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, nargs='+',
+                        default=[10, 200, 2000])
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='milliseconds per round trip')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    implementations = [('legacy', legacy_set_multi),
+                       ('bulk', mongo.MongoApi.set_multi)]
+    print('%8s %8s %12s %10s' % ('keys', 'path', 'round trips', 'ms'))
+    for keys in args.keys:
+        for name, set_multi in implementations:
+            round_trips, elapsed = run(set_multi, keys, args.latency / 1000,
+                                       args.iterations)
+            print('%8d %8s %12d %10.2f' % (keys, name, round_trips,
+                                           elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
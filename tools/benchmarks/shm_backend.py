@@ -0,0 +1,81 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Measure the throughput of the shared memory backend across processes.
+
+Every process reads and writes random keys of the same cache, with one
+write for every ``--read-ratio`` reads::
+
+    python tools/benchmarks/shm_backend.py --processes 1 4 16
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from oslo_cache.backends import shm
+
+
+def worker(path, seed, iterations, keys, read_ratio, start):
+    backend = shm.SharedMemoryCacheBackend({'path': path,
+                                            'expiration_time': 3600})
+    operations = random.Random(seed)
+    names = ['key%d' % operations.randrange(keys) for _ in range(iterations)]
+    start.wait()
+    for i, key in enumerate(names):
+        if i % (read_ratio + 1):
+            backend.get(key)
+        else:
+            backend.set(key, i)
+
+
+def run(processes, iterations, keys, read_ratio):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache')
+        backend = shm.SharedMemoryCacheBackend({'path': path,
+                                                'expiration_time': 3600})
+        backend.set_multi({'key%d' % i: i for i in range(keys)})
+        start = multiprocessing.Barrier(processes + 1)
+        workers = [multiprocessing.Process(
+            target=worker,
+            args=(path, seed, iterations, keys, read_ratio, start))
+            for seed in range(processes)]
+        for process in workers:
+            process.start()
+        start.wait()
+        begin = time.perf_counter()
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - begin
+    return processes * iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--iterations', type=int, default=50000,
+                        help='operations done by each process')
+    parser.add_argument('--keys', type=int, default=500)
+    parser.add_argument('--read-ratio', type=int, default=9)
+    args = parser.parse_args()
+
+    print('%10s %12s' % ('processes', 'ops/s'))
+    for processes in args.processes:
+        print('%10d %12.0f' % (processes, run(processes, args.iterations,
+                                              args.keys, args.read_ratio)))
+
+
+if __name__ == '__main__':
+    main()
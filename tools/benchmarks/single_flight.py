@@ -0,0 +1,103 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Measure a thundering herd on a memoized function with single flight.
+
+Many threads call a memoized function whose value is missing at once, the
+backend reads and the regeneration taking some time. The number of backend
+reads and regenerations is reported with and without single flight::
+
+    python tools/benchmarks/single_flight.py --threads 10 100
+"""
+
+import argparse
+import threading
+import time
+
+from dogpile.cache import proxy
+from oslo_config import cfg
+
+from oslo_cache import core
+
+
+def slow_down(region, latency):
+    """Make the backend reads slow, returning the list of the keys read."""
+    backend = region.backend
+    while isinstance(backend, proxy.ProxyBackend):
+        backend = backend.proxied
+    reads = []
+    get = backend.get
+
+    def slow_get(key):
+        reads.append(key)
+        time.sleep(latency)
+        return get(key)
+
+    backend.get = slow_get
+    return reads
+
+
+def run(single_flight_enabled, threads, latency):
+    conf = cfg.ConfigOpts()
+    core.configure(conf)
+    conf([])
+    conf.set_override('enabled', True, group='cache')
+    conf.set_override('backend', 'dogpile.cache.memory', group='cache')
+    conf.set_override('single_flight_enabled', single_flight_enabled,
+                      group='cache')
+    region = core.create_region()
+    core.configure_cache_region(conf, region)
+    reads = slow_down(region, latency)
+    memoize = core.get_memoization_decorator(conf, region, group='cache')
+    regenerations = []
+
+    @memoize
+    def validate(token):
+        regenerations.append(token)
+        time.sleep(latency * 10)
+        return token
+
+    start = threading.Barrier(threads + 1)
+
+    def worker():
+        start.wait()
+        validate('token')
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    begin = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    return len(reads), len(regenerations), elapsed * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[10, 100, 500])
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds per backend read, ten times more to '
+                             'regenerate the value')
+    args = parser.parse_args()
+
+    print('%8s %14s %8s %14s %8s' % (
+        'threads', 'single flight', 'reads', 'regenerations', 'ms'))
+    for threads in args.threads:
+        for enabled in (False, True):
+            print('%8d %14s %8d %14d %8.1f' % (
+                (threads, enabled) + run(enabled, threads, args.latency)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the cost of the statistics proxy per cache operation.
+
+The region uses the in-memory backend, so the difference between the two
+runs is the cost of the proxy itself::
+
+    python tools/benchmarks/stats_proxy.py --iterations 200000
+"""
+
+import argparse
+import time
+
+from oslo_config import cfg
+
+from oslo_cache import core
+
+
+def run(stats_enabled, iterations):
+    conf = cfg.ConfigOpts()
+    core.configure(conf)
+    conf([])
+    conf.set_override('enabled', True, group='cache')
+    conf.set_override('backend', 'dogpile.cache.memory', group='cache')
+    conf.set_override('stats_enabled', stats_enabled, group='cache')
+    region = core.create_region()
+    core.configure_cache_region(conf, region)
+    region.set('hit', 'value')
+
+    results = {}
+    for name, operation in (('get hit', lambda: region.get('hit')),
+                            ('get miss', lambda: region.get('miss')),
+                            ('set', lambda: region.set('key', 'value'))):
+        begin = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        results[name] = (time.perf_counter() - begin) / iterations * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    without = run(False, args.iterations)
+    with_stats = run(True, args.iterations)
+    print('%10s %12s %12s %12s' % ('operation', 'without us', 'with us',
+                                   'overhead us'))
+    for name in without:
+        print('%10s %12.2f %12.2f %12.2f' % (
+            name, without[name], with_stats[name],
+            with_stats[name] - without[name]))
+
+
+if __name__ == '__main__':
+    main()